@@ -1,21 +1,22 @@
 from datetime import datetime, timedelta
-from typing import Optional, Annotated
+from typing import Optional, Annotated, Tuple
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
-from passlib.context import CryptContext
-from pydantic import BaseModel
-from sqlalchemy.orm import Session
+from pydantic import BaseModel, ConfigDict
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+import cache
 import models
-from models import get_db
+import passwords
 
 # Configuration
 SECRET_KEY = "SECRETKEYCHANGELOL"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 900
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login", auto_error=False)
 
 
 # ===== Schemas =====
@@ -34,6 +35,15 @@ class UserLogin(BaseModel):
     password: str
 
 
+class Principal(BaseModel):
+    """What permission checks need to know about the caller; load the full User via crud.get_user"""
+    id: int
+    role: int
+    org_id: Optional[int] = None
+
+    model_config = ConfigDict(from_attributes=True, frozen=True)
+
+
 # ===== Role Enum for clarity =====
 
 class Role:
@@ -44,12 +54,13 @@ class Role:
 
 # ===== Password Hashing =====
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Check a password in the hashing pool; also returns a replacement hash if the cost changed"""
+    return await passwords.pool.run(passwords.verify_and_update, plain_password, hashed_password)
 
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+async def get_password_hash(password: str) -> str:
+    return await passwords.pool.run(passwords.hash_password, password)
 
 
 # ===== JWT Token Functions =====
@@ -65,36 +76,65 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-def authenticate_user(db: Session, email: str, password: str) -> Optional[models.User]:
-    user = db.query(models.User).filter(models.User.email == email).first()
-    if not user or not verify_password(password, user.password):
+async def authenticate_user(db: AsyncSession, email: str, password: str) -> Optional[models.User]:
+    user = await db.scalar(select(models.User).filter(models.User.email == email))
+    if not user:
         return None
+
+    valid, new_hash = await verify_password(password, user.password)
+    if not valid:
+        return None
+
+    # Transparently upgrade hashes made with a different bcrypt cost
+    if new_hash:
+        user.password = new_hash
+        await db.commit()
     return user
 
 
 # ===== Dependency: Get Current User =====
 
-async def get_current_user(
-        token: Annotated[str, Depends(oauth2_scheme)],
-        db: Session = Depends(get_db)
-) -> models.User:
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+async def load_principal(token: str) -> Optional[Principal]:
+    """
+    The caller behind a bearer token, or None if the token is invalid or the user is gone.
+    Cache misses use their own short-lived session: a request-scoped one would stay checked out
+    until the response ends, which for SSE and exports is as long as the client stays connected.
+    """
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: int = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if user is None:
-        raise credentials_exception
-    return user
+        user_id = int(payload.get("sub"))
+    except (JWTError, TypeError, ValueError):
+        return None
+
+    principal = cache.principal_cache.get(user_id)
+    if principal is None:
+        async with models.ReadSessionLocal() as db:
+            user = await db.scalar(select(models.User).filter(models.User.id == user_id))
+        if user is None:
+            return None
+        principal = Principal.model_validate(user)
+        cache.principal_cache.set(user_id, principal)
+    return principal
+
+
+async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]) -> Principal:
+    principal = await load_principal(token)
+    if principal is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return principal
+
+
+async def get_optional_user(
+        token: Annotated[Optional[str], Depends(optional_oauth2_scheme)]
+) -> Optional[Principal]:
+    """For public endpoints that personalise their output: None for anonymous or invalid tokens"""
+    if not token:
+        return None
+    return await load_principal(token)
 
 
 # ===== Authorization Checks =====
@@ -102,7 +142,7 @@ async def get_current_user(
 def require_role(required_role: int):
     """Dependency that requires a minimum role level"""
 
-    async def role_checker(current_user: models.User = Depends(get_current_user)):
+    async def role_checker(current_user: Principal = Depends(get_current_user)):
         if current_user.role < required_role:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
@@ -113,19 +153,19 @@ def require_role(required_role: int):
     return role_checker
 
 
-def require_student(current_user: models.User = Depends(get_current_user)):
+async def require_student(current_user: Principal = Depends(get_current_user)):
     """Any authenticated user"""
     return current_user
 
 
-def require_agent(current_user: models.User = Depends(get_current_user)):
+async def require_agent(current_user: Principal = Depends(get_current_user)):
     """Agents and Admins only"""
     if current_user.role < Role.AGENT:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Agent privileges required")
     return current_user
 
 
-def require_admin(current_user: models.User = Depends(get_current_user)):
+async def require_admin(current_user: Principal = Depends(get_current_user)):
     """Admins only"""
     if current_user.role < Role.ADMIN:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin privileges required")
@@ -134,43 +174,12 @@ def require_admin(current_user: models.User = Depends(get_current_user)):
 
 # ===== Permission Checks (Business Logic) =====
 
-def can_view_user(current_user: models.User, target_user_id: int, db: Session) -> bool:
-    """
-    Students: Only their own profile
-    Agents: Own profile + students who applied to their org's vacancies
-    Admins: Everyone
-    """
-    if current_user.role == Role.ADMIN:
-        return True
-
-    if current_user.id == target_user_id:
-        return True
-
-    if current_user.role == Role.AGENT:
-        # Check if target user is a student who applied to agent's org vacancies
-        target_user = db.query(models.User).filter(models.User.id == target_user_id).first()
-        if not target_user or target_user.role != Role.STUDENT:
-            return False
-
-        # Check if student has applications to this agent's org
-        has_application = db.query(models.Application).join(
-            models.Vacancy
-        ).filter(
-            models.Application.user_id == target_user_id,
-            models.Vacancy.employer_id == current_user.org_id
-        ).first()
-
-        return has_application is not None
-
-    return False
-
-
-def can_modify_user(current_user: models.User, target_user_id: int) -> bool:
+def can_modify_user(current_user: Principal, target_user_id: int) -> bool:
     """Only admins or the user themselves can modify user data"""
     return current_user.role == Role.ADMIN or current_user.id == target_user_id
 
 
-def can_modify_vacancy(current_user: models.User, vacancy: models.Vacancy) -> bool:
+def can_modify_vacancy(current_user: Principal, vacancy: models.Vacancy) -> bool:
     """Agents can modify their org's vacancies, Admins can modify any"""
     if current_user.role == Role.ADMIN:
         return True
@@ -179,7 +188,7 @@ def can_modify_vacancy(current_user: models.User, vacancy: models.Vacancy) -> bo
     return False
 
 
-def can_modify_application(current_user: models.User, application: models.Application) -> bool:
+def can_modify_application(current_user: Principal, application: models.Application) -> bool:
     """Students can modify their own applications, Admins can modify any"""
     if current_user.role == Role.ADMIN:
         return True
@@ -188,7 +197,7 @@ def can_modify_application(current_user: models.User, application: models.Applic
     return False
 
 
-def can_modify_organisation(current_user: models.User, org_id: int) -> bool:
+def can_modify_organisation(current_user: Principal, org_id: int) -> bool:
     """Agents can modify their own org, Admins can modify any"""
     if current_user.role == Role.ADMIN:
         return True
@@ -0,0 +1,8 @@
+"""
+Offline load testing for the API.
+
+    python -m benchmarks generate --scale 100      # ~1M applications into bench.db
+    python -m benchmarks run --duration 30 --concurrency 64
+
+Both commands use DATABASE_PATH (default ./bench.db), never the application database.
+"""
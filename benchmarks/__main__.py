@@ -0,0 +1,53 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Offline load testing")
+    parser.add_argument("--database", default=os.environ.get("DATABASE_PATH", "./bench.db"),
+                        help="SQLite file to use (default ./bench.db)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    generate = subparsers.add_parser("generate", help="Fill the benchmark database with synthetic data")
+    generate.add_argument("--scale", type=float, default=1.0, help="1.0 = 10k applications, 100 = 1M")
+    generate.add_argument("--seed", type=int, default=42)
+    generate.add_argument("--reset", action="store_true", help="Delete the database file first")
+
+    run = subparsers.add_parser("run", help="Drive every router concurrently and report latencies")
+    run.add_argument("--duration", type=float, default=30.0, help="Seconds to run")
+    run.add_argument("--concurrency", type=int, default=32, help="Concurrent virtual users")
+    run.add_argument("--seed", type=int, default=42)
+    run.add_argument("--json", help="Also write the report to this file")
+
+    args = parser.parse_args()
+
+    # models reads DATABASE_PATH at import time, so configure before importing anything from the app
+    os.environ["DATABASE_PATH"] = args.database
+    os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+    if args.command == "generate":
+        if args.reset:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(args.database + suffix):
+                    os.remove(args.database + suffix)
+        import models
+        from benchmarks import dataset
+        counts = dataset.generate(models.engine, scale=args.scale, seed=args.seed)
+        for table, count in counts.items():
+            print(f"{table:<14} {count:>10}")
+    else:
+        if not os.path.exists(args.database):
+            sys.exit(f"{args.database} does not exist; run 'python -m benchmarks generate' first")
+        from benchmarks import harness
+        report = asyncio.run(harness.run(duration=args.duration, concurrency=args.concurrency, seed=args.seed))
+        print(harness.format_report(report))
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+import random
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List
+from sqlalchemy import func, insert, select
+from sqlalchemy.engine import Engine
+import migrations
+import models
+import passwords
+from auth import Role
+
+BATCH_SIZE = 10_000
+BENCH_PASSWORD = "benchmark-password"
+
+# Rows per unit of scale; scale=100 gives 1M applications
+PER_SCALE = {
+    "organisations": 50,
+    "admins": 2,
+    "agents": 100,
+    "students": 5_000,
+    "vacancies": 1_000,
+    "applications": 10_000,
+    "bookmarks": 10_000,
+    "messages": 10_000,
+}
+
+WORDS = (
+    "python backend frontend data analyst intern junior developer designer marketing sales "
+    "java golang devops qa support product manager research mobile android ios ml cloud "
+    "аналитик разработчик стажёр дизайнер тестировщик маркетолог"
+).split()
+
+
+def _batches(rows: Iterator[dict], size: int = BATCH_SIZE) -> Iterator[List[dict]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def generate(engine: Engine, scale: float = 1.0, seed: int = 42) -> Dict[str, int]:
+    """Fill an empty database with a deterministic synthetic dataset; returns row counts"""
+    rng = random.Random(seed)
+    counts = {name: max(1, int(per_scale * scale)) for name, per_scale in PER_SCALE.items()}
+    now = datetime.utcnow()
+    # One hash for everybody: hashing per user would dominate generation time
+    password = passwords.hash_password(BENCH_PASSWORD)
+
+    with engine.begin() as connection:
+        migrations.upgrade(connection)
+        if connection.scalar(select(func.count()).select_from(models.User)):
+            raise RuntimeError("Benchmark database is not empty; delete it or pass --reset")
+
+    def ago(max_days: int) -> datetime:
+        return now - timedelta(seconds=rng.randrange(max_days * 86400))
+
+    def organisations():
+        for i in range(counts["organisations"]):
+            yield {"id": i + 1, "title": f"Organisation {i + 1}", "description": _text(rng, 30)}
+
+    def users():
+        user_id = 0
+        for role, amount in ((Role.ADMIN, counts["admins"]), (Role.AGENT, counts["agents"]),
+                             (Role.STUDENT, counts["students"])):
+            for _ in range(amount):
+                user_id += 1
+                yield {
+                    "id": user_id, "fname": f"First{user_id}", "lname": f"Last{user_id}",
+                    "email": f"user{user_id}@bench.example.com", "password": password, "role": role,
+                    "registred": ago(730),
+                    "org_id": (user_id % counts["organisations"]) + 1 if role == Role.AGENT else None,
+                }
+
+    def vacancies():
+        for i in range(counts["vacancies"]):
+            bottom = rng.randrange(20, 150) * 1000
+            yield {
+                "id": i + 1, "employer_id": rng.randrange(counts["organisations"]) + 1,
+                "title": f"{_text(rng, 3)} #{i + 1}", "brief": _text(rng, 8), "description": _text(rng, 60),
+                "salary_bottom": bottom, "salary_top": bottom + rng.randrange(0, 100) * 1000,
+                "required_year": rng.choice([None, 1, 2, 3, 4]), "created": ago(365), "status": rng.choice([0, 1, 1, 1]),
+            }
+
+    first_student = counts["admins"] + counts["agents"] + 1
+    last_user = first_student + counts["students"] - 1
+
+    def applications():
+        for i in range(counts["applications"]):
+            yield {
+                "id": i + 1, "user_id": rng.randint(first_student, last_user),
+                "vacancy_id": rng.randrange(counts["vacancies"]) + 1,
+                "title": _text(rng, 4), "content": _text(rng, 40),
+            }
+
+    def bookmarks():
+        for _ in range(counts["bookmarks"]):
+            yield {"user_id": rng.randint(first_student, last_user), "vacancy_id": rng.randrange(counts["vacancies"]) + 1}
+
+    def messages():
+        for i in range(counts["messages"]):
+            sender, recipient = rng.sample(range(1, last_user + 1), 2)
+            yield {"id": i + 1, "sender_id": sender, "recipient_id": recipient, "content": _text(rng, 15),
+                   "sent": ago(180)}
+
+    tables = (
+        (models.Organisation, organisations()),
+        (models.User, users()),
+        (models.Vacancy, vacancies()),
+        (models.Application, applications()),
+        # Random pairs repeat; keep the first one
+        (models.Bookmark, bookmarks()),
+        (models.Message, messages()),
+    )
+    for model, rows in tables:
+        statement = insert(model.__table__)
+        if model is models.Bookmark:
+            statement = statement.prefix_with("OR IGNORE")
+        for batch in _batches(rows):
+            with engine.begin() as connection:
+                connection.execute(statement, batch)
+
+    with engine.begin() as connection:
+        for statement in models.CONVERSATIONS_REBUILD:
+            connection.exec_driver_sql(statement)
+        connection.exec_driver_sql("ANALYZE")
+        return {
+            model.__tablename__: connection.scalar(select(func.count()).select_from(model))
+            for model, _ in tables
+        }
@@ -0,0 +1,336 @@
+import asyncio
+import functools
+import itertools
+import logging
+import random
+import struct
+import time
+import zlib
+from collections import Counter, defaultdict
+from datetime import timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+import httpx
+from sqlalchemy import select
+import auth
+import main
+import models
+from auth import Role
+from benchmarks.dataset import BENCH_PASSWORD, WORDS
+
+# main configures DEBUG logging; the benchmark must not measure log formatting
+logging.getLogger().setLevel(logging.WARNING)
+
+# Share of virtual users per role
+ROLE_MIX = {"anonymous": 0.50, "student": 0.35, "agent": 0.12, "admin": 0.03}
+
+
+class Context:
+    """Ids and tokens sampled from the benchmark database before the clock starts"""
+
+    def __init__(self, rng: random.Random, sample_size: int = 200):
+        engine = models.engine
+        with engine.connect() as connection:
+            def ids(query):
+                return [row[0] for row in connection.execute(query.limit(sample_size * 10))]
+
+            self.users = {
+                role: connection.execute(
+                    select(models.User.id, models.User.email).filter(models.User.role == role).limit(sample_size)
+                ).all()
+                for role in (Role.STUDENT, Role.AGENT, Role.ADMIN)
+            }
+            self.vacancy_ids = ids(select(models.Vacancy.id).order_by(models.Vacancy.id.desc()))
+            self.organisation_ids = ids(select(models.Organisation.id))
+            self.application_ids = ids(select(models.Application.id))
+            self.agent_orgs = dict(connection.execute(
+                select(models.User.id, models.User.org_id).filter(models.User.role == Role.AGENT)
+            ).all())
+        if not self.vacancy_ids:
+            raise RuntimeError("Benchmark database is empty; run 'python -m benchmarks generate' first")
+
+        expires = timedelta(hours=1)
+        self.tokens = {
+            role: [(user_id, email, auth.create_access_token({"sub": str(user_id)}, expires)) for user_id, email in users]
+            for role, users in self.users.items()
+        }
+        self.counter = itertools.count()
+        # Filled by seed_media once the app is running
+        self.media_ids: List[int] = []
+
+
+# ===== Scenario =====
+# Each action returns (route template, method, url, request kwargs)
+
+Action = Callable[[random.Random, Context, Optional[tuple]], Tuple[str, str, str, dict]]
+
+
+def list_vacancies(rng, ctx, user):
+    return "/api/vacancies/", "GET", f"/api/vacancies/?limit=20&skip={rng.choice([0, 0, 0, 20, 40, 200])}", {}
+
+
+def list_vacancies_by_employer(rng, ctx, user):
+    return "/api/vacancies/", "GET", f"/api/vacancies/?employer_id={rng.choice(ctx.organisation_ids)}", {}
+
+
+def filter_vacancies(rng, ctx, user):
+    params = {"limit": 20, "status": 1, "facets": "status,required_year,salary",
+              "sort": rng.choice(["created", "-created", "-salary"])}
+    if rng.random() < 0.5:
+        params["required_year"] = rng.choice([1, 2, 3, 4])
+    if rng.random() < 0.5:
+        params["salary_min"] = rng.choice([50_000, 100_000, 150_000])
+    return "/api/vacancies/", "GET", "/api/vacancies/", {"params": params}
+
+
+def get_vacancy(rng, ctx, user):
+    return "/api/vacancies/{vacancy_id}", "GET", f"/api/vacancies/{rng.choice(ctx.vacancy_ids)}", {}
+
+
+def search_vacancies(rng, ctx, user):
+    return "/api/vacancies/search", "GET", "/api/vacancies/search", {"params": {"q": " ".join(rng.sample(WORDS, 2))}}
+
+
+def list_organisations(rng, ctx, user):
+    return "/api/organisations/", "GET", "/api/organisations/?limit=50", {}
+
+
+def get_organisation(rng, ctx, user):
+    return "/api/organisations/{org_id}", "GET", f"/api/organisations/{rng.choice(ctx.organisation_ids)}", {}
+
+
+def me(rng, ctx, user):
+    return "/api/auth/me", "GET", "/api/auth/me", {}
+
+
+def login(rng, ctx, user):
+    return "/api/auth/login", "POST", "/api/auth/login", {"data": {"username": user[1], "password": BENCH_PASSWORD}}
+
+
+def list_applications(rng, ctx, user):
+    return "/api/applications/", "GET", "/api/applications/?limit=50", {}
+
+
+def get_application(rng, ctx, user):
+    return ("/api/applications/{application_id}", "GET",
+            f"/api/applications/{rng.choice(ctx.application_ids)}", {})
+
+
+def create_application(rng, ctx, user):
+    body = {"vacancy_id": rng.choice(ctx.vacancy_ids), "title": "Benchmark", "content": " ".join(rng.sample(WORDS, 10))}
+    return "/api/applications/", "POST", "/api/applications/", {"json": body}
+
+
+def list_users(rng, ctx, user):
+    return "/api/users/", "GET", "/api/users/?limit=50", {}
+
+
+def get_user(rng, ctx, user):
+    return "/api/users/{user_id}", "GET", f"/api/users/{user[0]}", {}
+
+
+def create_vacancy(rng, ctx, user):
+    body = {
+        "title": f"Benchmark vacancy {user[0]}-{next(ctx.counter)}-{rng.random()}", "description": "Benchmark",
+        "status": 1, "employer_id": ctx.agent_orgs.get(user[0]) or rng.choice(ctx.organisation_ids),
+    }
+    return "/api/vacancies/", "POST", "/api/vacancies/", {"json": body}
+
+
+def toggle_bookmarks(rng, ctx, user):
+    ids = rng.sample(ctx.vacancy_ids, 4)
+    return "/api/bookmarks/batch", "POST", "/api/bookmarks/batch", {"json": {"add": ids[:2], "remove": ids[2:]}}
+
+
+def organisation_stats(rng, ctx, user):
+    org_id = ctx.agent_orgs.get(user[0]) or rng.choice(ctx.organisation_ids)
+    return "/api/organisations/{org_id}/stats", "GET", f"/api/organisations/{org_id}/stats", {}
+
+
+def upload_media(rng, ctx, user):
+    # A tEXt chunk makes each upload distinct content; every tenth repeats one to exercise dedup
+    note = "shared" if rng.random() < 0.1 else f"{user[0]}-{next(ctx.counter)}"
+    return ("/api/media/upload", "POST", "/api/media/upload", {
+        "params": {"name": "icon.png"}, "content": make_png(rng.choice(ICON_SIZES), note),
+        "headers": {"Content-Type": "image/png"},
+    })
+
+
+def get_media_content(rng, ctx, user):
+    kwargs = {"headers": {"Range": "bytes=0-1023"}} if rng.random() < 0.3 else {}
+    return "/api/media/{media_id}/content", "GET", f"/api/media/{rng.choice(ctx.media_ids)}/content", kwargs
+
+
+def get_media_thumbnail(rng, ctx, user):
+    return ("/api/media/{media_id}/thumb/{size}", "GET",
+            f"/api/media/{rng.choice(ctx.media_ids)}/thumb/{rng.choice([64, 128, 256])}", {})
+
+
+def list_inbox(rng, ctx, user):
+    return "/api/messages/inbox", "GET", "/api/messages/inbox?limit=20", {}
+
+
+def send_message(rng, ctx, user):
+    recipient = rng.choice(ctx.users[rng.choice([Role.STUDENT, Role.AGENT])] or ctx.users[Role.ADMIN])[0]
+    body = {"recipient_id": recipient, "content": " ".join(rng.sample(WORDS, 8))}
+    return "/api/messages/", "POST", "/api/messages/", {"json": body}
+
+
+SCENARIO: Dict[str, List[Tuple[float, Action]]] = {
+    "anonymous": [
+        (30, list_vacancies), (10, filter_vacancies), (10, list_vacancies_by_employer), (25, get_vacancy), (15, search_vacancies),
+        (5, list_organisations), (5, get_organisation),
+    ],
+    "student": [
+        (20, list_vacancies), (5, filter_vacancies), (20, get_vacancy), (10, search_vacancies), (10, me), (15, list_applications),
+        (5, get_user), (10, create_application), (5, get_organisation), (8, list_inbox), (2, send_message),
+        (3, toggle_bookmarks), (1, upload_media), (4, get_media_content), (6, get_media_thumbnail),
+    ],
+    "agent": [
+        (25, list_applications), (20, list_users), (10, get_application), (10, list_vacancies_by_employer),
+        (10, me), (5, create_vacancy), (10, get_vacancy), (10, get_user), (8, list_inbox), (2, send_message),
+        (5, organisation_stats), (1, upload_media), (3, get_media_content), (5, get_media_thumbnail),
+    ],
+    "admin": [
+        (20, list_users), (20, list_applications), (20, list_organisations), (20, get_user), (20, list_vacancies),
+    ],
+}
+# Logins are expensive (bcrypt) but real; a small share of authenticated traffic
+LOGIN_SHARE = 0.01
+
+ROLE_IDS = {"student": Role.STUDENT, "agent": Role.AGENT, "admin": Role.ADMIN}
+
+
+# ===== Media =====
+# The dataset has no stored files, so icons are uploaded through the API before the clock starts.
+
+ICON_SIZES = (128, 512)
+SEED_MEDIA = 20
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+@functools.lru_cache(maxsize=None)
+def _gradient(size: int) -> bytes:
+    rows = b"".join(b"\x00" + bytes(v for x in range(size) for v in (x % 256, y % 256, (x + y) % 256))
+                    for y in range(size))
+    return _png_chunk(b"IDAT", zlib.compress(rows))
+
+
+def make_png(size: int, note: str) -> bytes:
+    """A size x size RGB gradient, built without Pillow; `note` goes into a tEXt chunk"""
+    return (b"\x89PNG\r\n\x1a\n" + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0))
+            + _png_chunk(b"tEXt", b"Comment\x00" + note.encode()) + _gradient(size) + _png_chunk(b"IEND", b""))
+
+
+async def seed_media(client: httpx.AsyncClient, ctx: Context) -> None:
+    candidates = [token for tokens in ctx.tokens.values() for _, _, token in tokens]
+    if not candidates:
+        raise RuntimeError("Benchmark database has no users to upload media with")
+    headers = {"Authorization": f"Bearer {candidates[0]}", "Content-Type": "image/png"}
+    for index in range(SEED_MEDIA):
+        response = await client.post("/api/media/upload", params={"name": f"seed-{index}.png"},
+                                     content=make_png(ICON_SIZES[index % len(ICON_SIZES)], f"seed-{index}"),
+                                     headers=headers)
+        response.raise_for_status()
+        ctx.media_ids.append(response.json()["id"])
+
+
+# ===== Results =====
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class RouteStats:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.statuses = Counter()
+        self.errors = 0
+
+    def summary(self, elapsed: float) -> dict:
+        ordered = sorted(self.latencies)
+        return {
+            "requests": len(ordered),
+            "errors": self.errors,
+            "statuses": dict(self.statuses),
+            "rps": len(ordered) / elapsed if elapsed else 0.0,
+            "p50_ms": percentile(ordered, 0.50) * 1000,
+            "p95_ms": percentile(ordered, 0.95) * 1000,
+            "p99_ms": percentile(ordered, 0.99) * 1000,
+        }
+
+
+# ===== Runner =====
+
+async def _virtual_user(client: httpx.AsyncClient, rng: random.Random, ctx: Context, deadline: float,
+                        stats: Dict[str, RouteStats]) -> None:
+    role = rng.choices(list(ROLE_MIX), weights=list(ROLE_MIX.values()))[0]
+    user, headers = None, {}
+    if role != "anonymous":
+        candidates = ctx.tokens[ROLE_IDS[role]]
+        if not candidates:
+            role = "anonymous"
+        else:
+            user_id, email, token = rng.choice(candidates)
+            user, headers = (user_id, email), {"Authorization": f"Bearer {token}"}
+
+    weights, actions = zip(*SCENARIO[role])
+    while time.perf_counter() < deadline:
+        action = login if user and rng.random() < LOGIN_SHARE else rng.choices(actions, weights=weights)[0]
+        route, method, url, kwargs = action(rng, ctx, user)
+        request_headers = {**headers, **kwargs.pop("headers", {})}
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, headers=request_headers, **kwargs)
+            status = response.status_code
+        except Exception:
+            status = "exception"
+        elapsed = time.perf_counter() - started
+
+        route_stats = stats[f"{method} {route}"]
+        route_stats.latencies.append(elapsed)
+        route_stats.statuses[status] += 1
+        if status == "exception" or status >= 500:
+            route_stats.errors += 1
+
+
+async def run(duration: float = 30.0, concurrency: int = 32, seed: int = 42) -> Dict[str, dict]:
+    """Drive the app in-process (no sockets) and return per-route latency and throughput"""
+    rng = random.Random(seed)
+    ctx = Context(rng)
+    stats: Dict[str, RouteStats] = defaultdict(RouteStats)
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.lifespan(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            await seed_media(client, ctx)
+            started = time.perf_counter()
+            deadline = started + duration
+            await asyncio.gather(*(
+                _virtual_user(client, random.Random(rng.random()), ctx, deadline, stats) for _ in range(concurrency)
+            ))
+            elapsed = time.perf_counter() - started
+
+    report = {route: route_stats.summary(elapsed) for route, route_stats in sorted(stats.items())}
+    total = RouteStats()
+    for route_stats in stats.values():
+        total.latencies.extend(route_stats.latencies)
+        total.statuses.update(route_stats.statuses)
+        total.errors += route_stats.errors
+    report["TOTAL"] = total.summary(elapsed)
+    return report
+
+
+def format_report(report: Dict[str, dict]) -> str:
+    header = f"{'route':<44} {'reqs':>7} {'err':>5} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    lines = [header, "-" * len(header)]
+    for route, row in report.items():
+        lines.append(
+            f"{route:<44} {row['requests']:>7} {row['errors']:>5} {row['rps']:>8.1f} "
+            f"{row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f}"
+        )
+    return "\n".join(lines)
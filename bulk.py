@@ -0,0 +1,158 @@
+import json
+import tempfile
+from typing import AsyncIterator, Callable, Iterator, List, Optional, Tuple, Type
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+BATCH_SIZE = 1000
+MAX_LINE_BYTES = 1024 * 1024
+RESULT_CHUNK_BYTES = 64 * 1024
+
+
+# ===== NDJSON Input =====
+
+async def iter_ndjson_lines(request: Request) -> AsyncIterator[Tuple[int, Optional[bytes]]]:
+    """Yield (line number, raw line) from a streamed body without buffering it whole.
+
+    Lines longer than MAX_LINE_BYTES are yielded once as None and otherwise skipped.
+    """
+    buffer = b""
+    number = 0
+    skipping = False
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if skipping:
+                # Tail end of an oversized line that was already reported
+                skipping = False
+                continue
+            number += 1
+            yield number, line if len(line) <= MAX_LINE_BYTES else None
+        if len(buffer) > MAX_LINE_BYTES:
+            if not skipping:
+                number += 1
+                yield number, None
+            skipping = True
+            buffer = b""
+    if buffer.strip() and not skipping:
+        yield number + 1, buffer
+
+
+def _describe(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(map(str, err['loc'])) or 'row'}: {err['msg']}" for err in error.errors())
+
+
+# ===== Ingestion =====
+
+class BulkIngest:
+    """Validates NDJSON rows against `schema` and inserts them into `model` in batched transactions.
+
+    Per-row results are written in input line order and spooled to a temporary file (disk past
+    1 MB), so memory stays flat no matter how many rows are sent.
+    """
+
+    def __init__(self, db: AsyncSession, schema: Type[BaseModel], model,
+                 authorize: Optional[Callable[[BaseModel], Optional[str]]] = None,
+                 batch_size: int = BATCH_SIZE):
+        self.db = db
+        self.schema = schema
+        self.model = model
+        self.authorize = authorize
+        self.batch_size = batch_size
+        self.inserted = 0
+        self.failed = 0
+        self.results = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+        self._batch: List[Tuple[int, dict]] = []
+        # Results of rejected lines that come after a row still waiting in the batch
+        self._held: List[Tuple[int, dict]] = []
+
+    def _write(self, results: List[Tuple[int, dict]]) -> None:
+        for line, result in results:
+            if "error" in result:
+                self.failed += 1
+            else:
+                self.inserted += 1
+            self.results.write(json.dumps({"line": line, **result}).encode() + b"\n")
+
+    def _reject(self, line: int, error: str) -> None:
+        if self._batch:
+            self._held.append((line, {"error": error}))
+        else:
+            self._write([(line, {"error": error})])
+
+    async def run(self, rows: AsyncIterator[Tuple[int, Optional[bytes]]]) -> "BulkIngest":
+        async for line, raw in rows:
+            self._accept(line, raw)
+            if len(self._batch) + len(self._held) >= self.batch_size:
+                await self._flush()
+        await self._flush()
+        return self
+
+    def _accept(self, line: int, raw: Optional[bytes]) -> None:
+        if raw is None:
+            self._reject(line, f"Line exceeds {MAX_LINE_BYTES} bytes")
+            return
+        if not raw.strip():
+            return
+        try:
+            item = self.schema.model_validate_json(raw)
+        except ValidationError as e:
+            self._reject(line, _describe(e))
+            return
+        denied = self.authorize(item) if self.authorize else None
+        if denied:
+            self._reject(line, denied)
+            return
+        self._batch.append((line, item.model_dump()))
+
+    async def _flush(self) -> None:
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, []
+        statement = insert(self.model).returning(self.model.id, sort_by_parameter_order=True)
+        try:
+            ids = (await self.db.scalars(statement, [values for _, values in batch])).all()
+            await self.db.commit()
+        except IntegrityError:
+            # Some row broke a constraint; retry the batch row by row to attribute the error
+            await self.db.rollback()
+            results = await self._insert_rows(batch)
+        else:
+            results = [(line, {"id": new_id}) for (line, _), new_id in zip(batch, ids)]
+        held, self._held = self._held, []
+        self._write(sorted(results + held, key=lambda result: result[0]))
+
+    async def _insert_rows(self, batch: List[Tuple[int, dict]]) -> List[Tuple[int, dict]]:
+        statement = insert(self.model).returning(self.model.id)
+        results = []
+        for line, values in batch:
+            try:
+                async with self.db.begin_nested():
+                    new_id = await self.db.scalar(statement, values)
+            except IntegrityError as e:
+                results.append((line, {"error": str(e.orig)}))
+            else:
+                results.append((line, {"id": new_id}))
+        await self.db.commit()
+        return results
+
+    def _iter_results(self) -> Iterator[bytes]:
+        self.results.seek(0)
+        try:
+            while chunk := self.results.read(RESULT_CHUNK_BYTES):
+                yield chunk
+        finally:
+            self.results.close()
+
+    def response(self) -> StreamingResponse:
+        """NDJSON with one {"line", "id"} or {"line", "error"} object per input row, in line order"""
+        return StreamingResponse(
+            self._iter_results(),
+            media_type="application/x-ndjson",
+            headers={"X-Bulk-Inserted": str(self.inserted), "X-Bulk-Failed": str(self.failed)},
+        )
@@ -0,0 +1,328 @@
+import os
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Sequence, Tuple
+from fastapi import Depends, HTTPException, Request, Response, status
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+import models
+from models import get_read_db
+
+
+class TTLCache:
+    """Bounded LRU mapping whose entries also expire `ttl` seconds after they are stored.
+
+    Not thread-safe: it is meant to be touched from the event loop only.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is not None:
+            value, expires = entry
+            if expires > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+        self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data)}
+
+
+# user id -> auth.Principal. Writes through crud invalidate their entry; the TTL bounds
+# staleness for changes made by other workers or directly in the database.
+principal_cache = TTLCache(maxsize=10_000, ttl=60.0)
+
+# user id -> (bookmarks version, frozenset of bookmarked vacancy ids), reloaded by
+# crud.get_bookmarked_ids once the user's version moves, so listings can be annotated
+# without a query.
+bookmark_cache = TTLCache(maxsize=10_000, ttl=300.0)
+
+
+# ===== Table Versions / Conditional GET =====
+
+class TableVersions:
+    """In-process copy of the per-table versions that triggers keep in the database (models.TableVersion).
+
+    The copy is re-read once it is `ttl` seconds old and after every commit made in this
+    process, so most requests get their versions without touching the database while writes
+    from other processes (workers, manage.py) show up within `ttl`. Scoped versions
+    (models.SCOPED_VERSION_DDL) are fetched one by one as they are asked for and kept alike.
+    """
+
+    MAX_SCOPED = 100_000
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._versions: Dict[str, int] = {}
+        self._expires = 0.0
+        self._scoped: Dict[str, Tuple[int, float]] = {}
+        # Bumped by expire(), so a load that was already running when a commit landed isn't kept
+        self._generation = 0
+
+    def expire(self) -> None:
+        self._generation += 1
+        self._expires = 0.0
+        self._scoped.clear()
+
+    async def get(self, db: AsyncSession) -> Dict[str, int]:
+        """Versions of whole tables, by table name"""
+        if time.monotonic() >= self._expires:
+            generation, started = self._generation, time.monotonic()
+            versions = dict((await db.execute(
+                select(models.TableVersion.name, models.TableVersion.version).filter(
+                    models.TableVersion.name.not_like("%:%")
+                )
+            )).all())
+            if generation == self._generation:
+                self._versions, self._expires = versions, started + self.ttl
+            return versions
+        return self._versions
+
+    async def scoped(self, db: AsyncSession, table: str, scope: Hashable) -> int:
+        """Version of the rows of `table` whose scope column is `scope`"""
+        name = f"{table}:{scope}"
+        version, expires = self._scoped.get(name, (0, 0.0))
+        if time.monotonic() >= expires:
+            generation, started = self._generation, time.monotonic()
+            version = await db.scalar(
+                select(models.TableVersion.version).filter(models.TableVersion.name == name)
+            ) or 0
+            if generation == self._generation:
+                if len(self._scoped) >= self.MAX_SCOPED:
+                    self._scoped.clear()
+                self._scoped[name] = (version, started + self.ttl)
+        return version
+
+
+table_versions = TableVersions(ttl=float(os.environ.get("TABLE_VERSIONS_TTL", "1.0")))
+
+
+@event.listens_for(Session, "after_commit")
+def _expire_table_versions(session: Session) -> None:
+    table_versions.expire()
+
+
+async def get_versions(db: AsyncSession = Depends(get_read_db)) -> Dict[str, int]:
+    """
+    Dependency: the table versions, read once per request so its ETag and cache keys agree on
+    one snapshot. The session only checks out a connection if the in-process copy is stale.
+    """
+    return await table_versions.get(db)
+
+
+def version_etag(versions: Dict[str, int], *tables: str) -> str:
+    return '"' + "-".join(str(versions.get(name, 0)) for name in ("epoch", *tables)) + '"'
+
+PUBLIC_CACHE_CONTROL = "public, max-age=10, stale-while-revalidate=30"
+PRIVATE_CACHE_CONTROL = "private, no-cache"
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in (candidate.removeprefix("W/") for candidate in candidates)
+
+
+async def _no_variant() -> None:
+    return None
+
+
+def conditional_get(*tables: str, variant: Optional[Callable[..., Awaitable[Optional[str]]]] = None):
+    """
+    Route dependency for public reads whose body depends only on `tables`. Answers
+    If-None-Match with 304 before the handler runs, from the in-process table versions,
+    so while those are fresh the database isn't reached at all; otherwise tags the response
+    with an ETag and Cache-Control.
+
+    `variant` is a dependency returning a token for callers who get a personalised body
+    (or None for the public one); it is folded into the ETag and makes the response private.
+    """
+
+    async def check(request: Request, response: Response, tag: Optional[str] = Depends(variant or _no_variant),
+                    versions: Dict[str, int] = Depends(get_versions)) -> None:
+        # The versions are read before the handler queries, so a racing write can only make the tag older
+        etag = version_etag(versions, *tables)
+        if tag is None:
+            headers = {"ETag": etag, "Cache-Control": PUBLIC_CACHE_CONTROL}
+        else:
+            headers = {"ETag": etag[:-1] + "-" + tag + '"', "Cache-Control": PRIVATE_CACHE_CONTROL}
+        if variant is not None:
+            headers["Vary"] = "Authorization"
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and etag_matches(if_none_match, headers["ETag"]):
+            raise HTTPException(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        response.headers.update(headers)
+
+    return check
+
+
+# ===== Response Cache =====
+
+class CachedResponse:
+    __slots__ = ("body", "headers", "flags")
+
+    def __init__(self, body: bytes, headers: dict, flags: Tuple[Tuple[int, int], ...] = ()):
+        self.body = body
+        self.headers = headers
+        # (row id, offset of its `false`) for a per-caller boolean in each row, see flag_offsets()
+        self.flags = flags
+
+    @classmethod
+    def capture(cls, body: bytes, response: Response, headers: tuple = (),
+                flags: Tuple[Tuple[int, int], ...] = ()) -> "CachedResponse":
+        """`body` plus the named headers from `response`"""
+        return cls(body, {name.lower(): response.headers[name] for name in headers if name in response.headers}, flags)
+
+    def with_flags(self, ids: frozenset) -> "CachedResponse":
+        """Copy with the flag of every row in `ids` set to true, spliced in without parsing the body"""
+        chunks, start = [], 0
+        for row_id, offset in self.flags:
+            if row_id in ids:
+                chunks += (self.body[start:offset], b"true")
+                start = offset + len(b"false")
+        if not chunks:
+            return self
+        chunks.append(self.body[start:])
+        return CachedResponse(b"".join(chunks), self.headers, ())
+
+    def to_response(self, response: Response, status: str = "HIT") -> Response:
+        """Rebuild the response, keeping headers (ETag etc.) already set on the injected `response`"""
+        headers = {name: value for name, value in response.headers.items() if name != "content-length"}
+        headers.update(self.headers)
+        headers["X-Cache"] = status
+        return Response(content=self.body, media_type="application/json", headers=headers)
+
+
+def flag_offsets(body: bytes, field: str, ids: Sequence[int]) -> Tuple[Tuple[int, int], ...]:
+    """
+    Pair each row id of a serialized list with the offset of its `"field":false`. Quotes inside
+    JSON strings are escaped, so the pattern only ever matches the field itself.
+    """
+    pattern = b'"' + field.encode() + b'":false'
+    offsets = []
+    position = body.find(pattern)
+    while position != -1:
+        offsets.append(position + len(pattern) - len(b"false"))
+        position = body.find(pattern, position + len(pattern))
+    return tuple(zip(ids, offsets))
+
+
+class ResponseCache:
+    """LRU of serialized JSON bodies bounded by total byte size.
+
+    Entries belong to a (table, scope) pair, e.g. ("vacancies", None) for vacancy lists built
+    from the whole table or ("vacancies", 5) for employer 5's. Keys carry the request's version
+    of that pair (see TableVersions), so a write moves lookups to new keys for exactly the
+    scopes it touched: at once for this process's writes, within TableVersions.ttl for other
+    processes'. Entries of a pair's older versions are dropped as soon as a newer one is stored,
+    and a pair's bookkeeping goes with its last entry, so everything held is bounded by max_bytes.
+    """
+
+    ENTRY_OVERHEAD = 256
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict = OrderedDict()
+        # Newest version stored per (table, scope) that still has entries
+        self._latest: Dict[tuple, int] = {}
+        # (table, scope) -> version -> keys
+        self._keys: Dict[tuple, Dict[int, set]] = defaultdict(dict)
+
+    def key(self, request: Request, table: str, version: int, scope: Hashable = None) -> tuple:
+        return (
+            request.url.path,
+            tuple(sorted(request.query_params.multi_items())),
+            table,
+            scope,
+            version,
+        )
+
+    def get(self, key: tuple):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def set(self, key: tuple, body: bytes, response: Response, headers: tuple = (),
+            flags: Tuple[Tuple[int, int], ...] = ()) -> CachedResponse:
+        """Store `body` plus the named headers from `response`; returns the new entry"""
+        entry = CachedResponse.capture(body, response, headers, flags)
+        pair, version = key[2:4], key[4]
+        if version < self._latest.get(pair, version):
+            # Rendered by a request that started before a write this cache has already seen
+            return entry
+        if version > self._latest.get(pair, version):
+            self._drop_before(pair, version)
+        self._latest[pair] = version
+        self._discard(key)
+        self._entries[key] = entry
+        self._keys[pair].setdefault(version, set()).add(key)
+        self.size += len(body) + self.ENTRY_OVERHEAD
+        while self.size > self.max_bytes and self._entries:
+            self._discard(next(iter(self._entries)))
+            self.evictions += 1
+        return entry
+
+    def _drop_before(self, pair: tuple, version: int) -> None:
+        versions = self._keys.get(pair, {})
+        for stale in [old for old in versions if old < version]:
+            for key in list(versions.get(stale, ())):
+                self._discard(key)
+
+    def _discard(self, key: tuple) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry.body) + self.ENTRY_OVERHEAD
+            pair, version = key[2:4], key[4]
+            versions = self._keys.get(pair, {})
+            keys = versions.get(version)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del versions[version]
+                if not versions:
+                    self._keys.pop(pair, None)
+                    self._latest.pop(pair, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self.size,
+        }
+
+
+response_cache = ResponseCache()
@@ -1,294 +1,721 @@
-from sqlalchemy.orm import Session
-from typing import List, Optional
+from sqlalchemy import Integer, and_, cast, delete, func, literal, literal_column, or_, select, text, tuple_, union_all, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
+from typing import Dict, Iterable, List, Optional, Tuple
 from datetime import datetime
-from passlib.context import CryptContext
+from enum import Enum
+import cache
+import html
 import models
+import passwords
+import storage
+
+
+# ===== LOADER PROFILES =====
+# Each profile eager-loads exactly the relationships its schemas.*Detailed model serializes:
+# many-to-one via joinedload (same statement), collections via selectinload (one IN query each).
+
+USER_DETAILED = (
+    selectinload(models.User.applications),
+    selectinload(models.User.bookmarks),
+    selectinload(models.User.sent_messages),
+)
+VACANCY_DETAILED = (
+    joinedload(models.Vacancy.employer),
+    selectinload(models.Vacancy.applications),
+)
+ORGANISATION_DETAILED = (
+    selectinload(models.Organisation.vacancies),
+    selectinload(models.Organisation.members),
+)
+APPLICATION_DETAILED = (
+    joinedload(models.Application.user),
+    joinedload(models.Application.vacancy),
+)
+MESSAGE_DETAILED = (
+    joinedload(models.Message.sender),
+    joinedload(models.Message.recipient),
+)
+BOOKMARK_DETAILED = (
+    joinedload(models.Bookmark.vacancy),
+)
+CONVERSATION_DETAILED = (
+    joinedload(models.Conversation.peer),
+    joinedload(models.Conversation.last_message),
+)
 
 
 # ===== USER CRUD =====
 
-def get_user(db: Session, user_id: int) -> Optional[models.User]:
-    return db.query(models.User).filter(models.User.id == user_id).first()
+async def get_user(db: AsyncSession, user_id: int, *options) -> Optional[models.User]:
+    return await db.scalar(select(models.User).options(*options).filter(models.User.id == user_id))
 
 
-def get_user_by_email(db: Session, email: str) -> Optional[models.User]:
-    return db.query(models.User).filter(models.User.email == email).first()
+async def get_org_applicants(db: AsyncSession, org_id: int, skip: int = 0, limit: int = 100,
+                             after_id: Optional[int] = None, scope=None) -> List[models.User]:
+    """
+    Users who applied to the organisation's vacancies, by id, read from the org_applicants index;
+    `scope` (see policy.py) further filters them
+    """
+    query = select(models.User).join(
+        models.OrgApplicant, models.OrgApplicant.user_id == models.User.id
+    ).filter(models.OrgApplicant.org_id == org_id)
+    if scope is not None:
+        query = query.filter(scope)
+    if after_id is not None:
+        query = query.filter(models.OrgApplicant.user_id > after_id)
+    result = await db.scalars(query.order_by(models.OrgApplicant.user_id).offset(skip).limit(limit))
+    return result.all()
 
 
-def get_users(db: Session, skip: int = 0, limit: int = 100) -> List[models.User]:
-    return db.query(models.User).offset(skip).limit(limit).all()
+async def get_user_by_email(db: AsyncSession, email: str) -> Optional[models.User]:
+    return await db.scalar(select(models.User).filter(models.User.email == email))
 
 
-def create_user(db: Session, user_data: dict) -> models.User:
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-    user_data['password'] = pwd_context.hash(user_data['password'])
+async def get_users(db: AsyncSession, skip: int = 0, limit: int = 100, after_id: Optional[int] = None) -> List[
+    models.User]:
+    query = select(models.User)
+    if after_id is not None:
+        query = query.filter(models.User.id > after_id)
+    result = await db.scalars(query.order_by(models.User.id).offset(skip).limit(limit))
+    return result.all()
+
+
+async def create_user(db: AsyncSession, user_data: dict) -> models.User:
+    user_data['password'] = await passwords.pool.run(passwords.hash_password, user_data['password'])
 
     db_user = models.User(**user_data)
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 
-def update_user(db: Session, user_id: int, user_data: dict) -> Optional[models.User]:
-    db_user = get_user(db, user_id)
+async def update_user(db: AsyncSession, user_id: int, user_data: dict) -> Optional[models.User]:
+    db_user = await get_user(db, user_id)
     if not db_user:
         return None
 
     for field, value in user_data.items():
         setattr(db_user, field, value)
 
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    cache.principal_cache.invalidate(user_id)
+    await db.refresh(db_user)
     return db_user
 
 
-def delete_user(db: Session, user_id: int) -> bool:
-    db_user = get_user(db, user_id)
+async def delete_user(db: AsyncSession, user_id: int) -> bool:
+    db_user = await get_user(db, user_id)
     if not db_user:
         return False
-    db.delete(db_user)
-    db.commit()
+    await db.delete(db_user)
+    await db.commit()
+    cache.principal_cache.invalidate(user_id)
     return True
 
 
-def get_organisation(db: Session, org_id: int) -> Optional[models.Organisation]:
-    return db.query(models.Organisation).filter(models.Organisation.id == org_id).first()
+async def get_organisation(db: AsyncSession, org_id: int, *options) -> Optional[models.Organisation]:
+    return await db.scalar(select(models.Organisation).options(*options).filter(models.Organisation.id == org_id))
 
 
-def get_organisations(db: Session, skip: int = 0, limit: int = 100) -> List[models.Organisation]:
-    return db.query(models.Organisation).offset(skip).limit(limit).all()
+async def get_organisations(db: AsyncSession, skip: int = 0, limit: int = 100, after_id: Optional[int] = None,
+                            ids: Optional[List[int]] = None) -> List[models.Organisation]:
+    query = select(models.Organisation)
+    if ids is not None:
+        query = query.filter(models.Organisation.id.in_(ids))
+    if after_id is not None:
+        query = query.filter(models.Organisation.id > after_id)
+    result = await db.scalars(query.order_by(models.Organisation.id).offset(skip).limit(limit))
+    return result.all()
 
 
-def create_organisation(db: Session, org_data: dict) -> models.Organisation:
+async def create_organisation(db: AsyncSession, org_data: dict) -> models.Organisation:
     db_org = models.Organisation(**org_data)
     db.add(db_org)
-    db.commit()
-    db.refresh(db_org)
+    await db.commit()
+    await db.refresh(db_org)
     return db_org
 
 
-def update_organisation(db: Session, org_id: int, org_data: dict) -> Optional[models.Organisation]:
-    db_org = get_organisation(db, org_id)
+async def update_organisation(db: AsyncSession, org_id: int, org_data: dict) -> Optional[models.Organisation]:
+    db_org = await get_organisation(db, org_id)
     if not db_org:
         return None
 
     for field, value in org_data.items():
         setattr(db_org, field, value)
 
-    db.commit()
-    db.refresh(db_org)
+    await db.commit()
+    await db.refresh(db_org)
     return db_org
 
 
-def delete_organisation(db: Session, org_id: int) -> bool:
-    db_org = get_organisation(db, org_id)
+async def delete_organisation(db: AsyncSession, org_id: int) -> bool:
+    db_org = await get_organisation(db, org_id)
     if not db_org:
         return False
-    db.delete(db_org)
-    db.commit()
+    await db.delete(db_org)
+    await db.commit()
+    # Members' org_id was nulled by the delete; their cached principals are stale
+    cache.principal_cache.clear()
     return True
 
 
-def get_vacancy(db: Session, vacancy_id: int) -> Optional[models.Vacancy]:
-    return db.query(models.Vacancy).filter(models.Vacancy.id == vacancy_id).first()
+async def get_vacancy(db: AsyncSession, vacancy_id: int, *options) -> Optional[models.Vacancy]:
+    return await db.scalar(select(models.Vacancy).options(*options).filter(models.Vacancy.id == vacancy_id))
 
 
-def get_vacancies(db: Session, skip: int = 0, limit: int = 100, employer_id: Optional[int] = None) -> List[
-    models.Vacancy]:
-    query = db.query(models.Vacancy)
-    if employer_id:
-        query = query.filter(models.Vacancy.employer_id == employer_id)
-    return query.offset(skip).limit(limit).all()
+class VacancySort(str, Enum):
+    created = "created"
+    newest = "-created"
+    salary = "salary"
+    highest_salary = "-salary"
 
 
-def create_vacancy(db: Session, vacancy_data: dict) -> models.Vacancy:
+SALARY_FACET_BUCKET = 50_000
+
+# Facet name -> the value vacancies are grouped by; salaries are counted in SALARY_FACET_BUCKET bands
+VACANCY_FACETS = {
+    "status": models.Vacancy.status,
+    "required_year": models.Vacancy.required_year,
+    "salary": cast(models.Vacancy.salary_bottom / SALARY_FACET_BUCKET, Integer) * SALARY_FACET_BUCKET,
+}
+
+
+def vacancy_filters(employer_id: Optional[int] = None, status: Optional[int] = None,
+                    required_year: Optional[int] = None, salary_min: Optional[float] = None,
+                    salary_max: Optional[float] = None, ids: Optional[List[int]] = None) -> Dict[str, object]:
+    """
+    WHERE conditions keyed by the facet they restrict, so facet counts can leave out their own.
+    The salary range matches vacancies whose [salary_bottom, salary_top] overlaps it.
+    """
+    filters = {}
+    if ids is not None:
+        filters["ids"] = models.Vacancy.id.in_(ids)
+    if employer_id:
+        filters["employer_id"] = models.Vacancy.employer_id == employer_id
+    if status is not None:
+        filters["status"] = models.Vacancy.status == status
+    if required_year is not None:
+        filters["required_year"] = models.Vacancy.required_year == required_year
+    salary = []
+    if salary_min is not None:
+        salary.append(func.coalesce(models.Vacancy.salary_top, models.Vacancy.salary_bottom) >= salary_min)
+    if salary_max is not None:
+        salary.append(func.coalesce(models.Vacancy.salary_bottom, models.Vacancy.salary_top) <= salary_max)
+    if salary:
+        filters["salary"] = and_(*salary)
+    return filters
+
+
+def _after_nullable(column, value, row_id: int, descending: bool):
+    """Keyset condition for a nullable sort column; SQLite puts NULLs first ascending, last descending"""
+    vacancy_id = models.Vacancy.id
+    if not descending:
+        if value is None:
+            return or_(and_(column.is_(None), vacancy_id > row_id), column.is_not(None))
+        return or_(column > value, and_(column == value, vacancy_id > row_id))
+    if value is None:
+        return and_(column.is_(None), vacancy_id < row_id)
+    return or_(column < value, and_(column == value, vacancy_id < row_id), column.is_(None))
+
+
+async def get_vacancies(db: AsyncSession, skip: int = 0, limit: int = 100, employer_id: Optional[int] = None,
+                        after: Optional[tuple] = None, sort: VacancySort = VacancySort.created,
+                        filters: Optional[Dict[str, object]] = None) -> List[models.Vacancy]:
+    """
+    Vacancies ordered by `sort`, ties broken by id; `after` is the sort key of the last row already
+    seen: (created, id) for the date sorts, (salary_bottom, id) for the salary ones.
+    `filters` comes from vacancy_filters().
+    """
+    query = select(models.Vacancy)
+    if employer_id:
+        query = query.filter(models.Vacancy.employer_id == employer_id)
+    if filters:
+        query = query.filter(*filters.values())
+
+    key = (models.Vacancy.created, models.Vacancy.id)
+    if sort == VacancySort.created:
+        if after is not None:
+            query = query.filter(tuple_(*key) > tuple_(*after))
+        query = query.order_by(*key)
+    elif sort == VacancySort.newest:
+        if after is not None:
+            query = query.filter(tuple_(*key) < tuple_(*after))
+        query = query.order_by(*(column.desc() for column in key))
+    else:
+        descending = sort == VacancySort.highest_salary
+        if after is not None:
+            query = query.filter(_after_nullable(models.Vacancy.salary_bottom, *after, descending))
+        if descending:
+            query = query.order_by(models.Vacancy.salary_bottom.desc(), models.Vacancy.id.desc())
+        else:
+            query = query.order_by(models.Vacancy.salary_bottom, models.Vacancy.id)
+
+    result = await db.scalars(query.offset(skip).limit(limit))
+    return result.all()
+
+
+async def count_vacancy_facets(db: AsyncSession, facets: Iterable[str],
+                               filters: Dict[str, object]) -> Dict[str, Dict[Optional[int], int]]:
+    """
+    Vacancy counts per value of each facet in one UNION ALL statement. Each facet is counted
+    under every filter except its own, so the counts show what selecting another value would give.
+    """
+    parts = []
+    for name in facets:
+        value = VACANCY_FACETS[name]
+        conditions = [condition for facet, condition in filters.items() if facet != name]
+        parts.append(
+            select(literal(name).label("facet"), value.label("value"), func.count().label("count"))
+            .filter(*conditions)
+            .group_by(value)
+        )
+    if not parts:
+        return {}
+
+    counts = {name: {} for name in facets}
+    statement = union_all(*parts) if len(parts) > 1 else parts[0]
+    for facet, value, count in await db.execute(statement):
+        counts[facet][value] = count
+    return counts
+
+
+def _fts_match(q: str) -> str:
+    """Quote every term so user input can't break FTS5 syntax; the last term matches as a prefix"""
+    terms = ['"' + term.replace('"', '""') + '"' for term in q.split()]
+    if terms:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+
+# snippet() brackets matches with these private-use characters. Vacancy text is user-written, so the
+# snippet is HTML-escaped first and only then are the markers turned into <mark> tags.
+_MATCH_START, _MATCH_END = '\ue000', '\ue001'
+
+
+def _highlight(snippet: str) -> str:
+    return html.escape(snippet).replace(_MATCH_START, '<mark>').replace(_MATCH_END, '</mark>')
+
+
+async def search_vacancies(db: AsyncSession, q: str, skip: int = 0, limit: int = 20) -> List[
+    Tuple[models.Vacancy, float, str]]:
+    """
+    BM25-ranked full-text search over title, brief and description (title weighs most).
+    Snippets are HTML: escaped vacancy text with matches wrapped in <mark>.
+    """
+    match = _fts_match(q)
+    if not match:
+        return []
+
+    fts = literal_column('vacancies_fts')
+    rank = func.bm25(fts, 10.0, 5.0, 1.0).label('rank')
+    snippet = func.snippet(fts, -1, _MATCH_START, _MATCH_END, '…', 16).label('snippet')
+    result = await db.execute(
+        select(models.Vacancy, rank, snippet).select_from(models.vacancies_fts).join(
+            models.Vacancy, models.Vacancy.id == models.vacancies_fts.c.rowid
+        ).filter(
+            fts.op('MATCH')(match)
+        ).order_by(rank).offset(skip).limit(limit)
+    )
+    return [(vacancy, rank, _highlight(snippet)) for vacancy, rank, snippet in result.all()]
+
+
+async def rebuild_vacancy_index(db: AsyncSession) -> None:
+    """Create the FTS index if missing and repopulate it from the vacancies table"""
+    for statement in models.VACANCY_FTS_DDL:
+        await db.execute(text(statement))
+    await db.execute(text("INSERT INTO vacancies_fts(vacancies_fts) VALUES ('rebuild')"))
+    await db.commit()
+
+
+async def create_vacancy(db: AsyncSession, vacancy_data: dict) -> models.Vacancy:
     db_vacancy = models.Vacancy(**vacancy_data)
     db.add(db_vacancy)
-    db.commit()
-    db.refresh(db_vacancy)
+    await db.commit()
+    await db.refresh(db_vacancy)
     return db_vacancy
 
 
-def update_vacancy(db: Session, vacancy_id: int, vacancy_data: dict) -> Optional[models.Vacancy]:
-    db_vacancy = get_vacancy(db, vacancy_id)
+async def update_vacancy(db: AsyncSession, vacancy_id: int, vacancy_data: dict) -> Optional[models.Vacancy]:
+    db_vacancy = await get_vacancy(db, vacancy_id)
     if not db_vacancy:
         return None
 
     for field, value in vacancy_data.items():
         setattr(db_vacancy, field, value)
 
-    db.commit()
-    db.refresh(db_vacancy)
+    await db.commit()
+    await db.refresh(db_vacancy)
     return db_vacancy
 
 
-def delete_vacancy(db: Session, vacancy_id: int) -> bool:
-    db_vacancy = get_vacancy(db, vacancy_id)
+async def delete_vacancy(db: AsyncSession, vacancy_id: int) -> bool:
+    db_vacancy = await get_vacancy(db, vacancy_id)
     if not db_vacancy:
         return False
-    db.delete(db_vacancy)
-    db.commit()
+    await db.delete(db_vacancy)
+    await db.commit()
     return True
 
 
-def get_message(db: Session, message_id: int) -> Optional[models.Message]:
-    return db.query(models.Message).filter(models.Message.id == message_id).first()
+async def get_vacancy_stats(db: AsyncSession, employer_id: Optional[int] = None,
+                            vacancy_id: Optional[int] = None) -> List[tuple]:
+    """(id, employer_id, title, application_count, bookmark_count) rows read from the maintained counters"""
+    query = select(models.Vacancy.id, models.Vacancy.employer_id, models.Vacancy.title,
+                   models.Vacancy.application_count, models.Vacancy.bookmark_count)
+    if employer_id is not None:
+        query = query.filter(models.Vacancy.employer_id == employer_id)
+    if vacancy_id is not None:
+        query = query.filter(models.Vacancy.id == vacancy_id)
+    result = await db.execute(query.order_by(models.Vacancy.id))
+    return result.all()
+
 
+async def repair_vacancy_counters(db: AsyncSession) -> int:
+    """Recount applications and bookmarks per vacancy; returns how many vacancies were off"""
+    result = await db.execute(text(models.VACANCY_COUNTERS_REPAIR))
+    await db.commit()
+    return result.rowcount
+
+
+async def get_message(db: AsyncSession, message_id: int, *options) -> Optional[models.Message]:
+    return await db.scalar(select(models.Message).options(*options).filter(models.Message.id == message_id))
 
-def get_user_messages(db: Session, user_id: int, sent: bool = True) -> List[models.Message]:
-    if sent:
-        return db.query(models.Message).filter(models.Message.sender_id == user_id).all()
-    else:
-        return db.query(models.Message).filter(models.Message.recipient_id == user_id).all()
 
+async def get_user_messages(db: AsyncSession, user_id: int, sent: bool = True, limit: int = 100,
+                            before_id: Optional[int] = None) -> List[models.Message]:
+    """One page of a user's outbox (sent=True) or inbox, newest first"""
+    owner = models.Message.sender_id if sent else models.Message.recipient_id
+    query = select(models.Message).filter(owner == user_id)
+    if before_id is not None:
+        query = query.filter(models.Message.id < before_id)
+    result = await db.scalars(query.order_by(models.Message.id.desc()).limit(limit))
+    return result.all()
 
-def create_message(db: Session, sender_id: int, message_data: dict) -> models.Message:
+
+async def create_message(db: AsyncSession, sender_id: int, message_data: dict) -> models.Message:
     db_message = models.Message(sender_id=sender_id, **message_data)
     db.add(db_message)
-    db.commit()
-    db.refresh(db_message)
+    await db.flush()
+    await _record_message(db, db_message)
+    await db.commit()
+    await db.refresh(db_message)
     return db_message
 
 
-def update_message(db: Session, message_id: int, content: str) -> Optional[models.Message]:
-    db_message = get_message(db, message_id)
+async def update_message(db: AsyncSession, message_id: int, content: str) -> Optional[models.Message]:
+    db_message = await get_message(db, message_id)
     if not db_message:
         return None
 
     db_message.content = content
     db_message.last_edit = datetime.utcnow()
-    db.commit()
-    db.refresh(db_message)
+    await db.commit()
+    await db.refresh(db_message)
     return db_message
 
 
-def delete_message(db: Session, message_id: int) -> bool:
-    db_message = get_message(db, message_id)
+async def delete_message(db: AsyncSession, message_id: int) -> bool:
+    db_message = await get_message(db, message_id)
     if not db_message:
         return False
-    db.delete(db_message)
-    db.commit()
+    await db.delete(db_message)
+    await db.flush()
+    await _forget_message(db, db_message)
+    await db.commit()
     return True
 
 
-def get_application(db: Session, application_id: int) -> Optional[models.Application]:
-    return db.query(models.Application).filter(models.Application.id == application_id).first()
+# ===== CONVERSATION SUMMARIES =====
+# Kept in the same transaction as the message write. Editing a message needs no summary
+# change: the list joins the last message row, so it always shows the current content.
+
+def _pair(user_id: int, peer_id: int):
+    return and_(models.Conversation.user_id == user_id, models.Conversation.peer_id == peer_id)
+
+
+async def _record_message(db: AsyncSession, message: models.Message) -> None:
+    perspectives = [(message.sender_id, message.recipient_id, 0)]
+    if message.recipient_id != message.sender_id:
+        perspectives.append((message.recipient_id, message.sender_id, 1))
+
+    for user_id, peer_id, unread in perspectives:
+        statement = sqlite_insert(models.Conversation).values(
+            user_id=user_id, peer_id=peer_id, last_message_id=message.id, last_sent=message.sent,
+            last_read_id=0, unread_count=unread,
+        )
+        await db.execute(statement.on_conflict_do_update(
+            index_elements=[models.Conversation.user_id, models.Conversation.peer_id],
+            set_={
+                "last_message_id": statement.excluded.last_message_id,
+                "last_sent": statement.excluded.last_sent,
+                "unread_count": models.Conversation.unread_count + unread,
+            },
+        ))
+
+
+async def _forget_message(db: AsyncSession, message: models.Message) -> None:
+    sender_id, recipient_id = message.sender_id, message.recipient_id
+    both = or_(_pair(sender_id, recipient_id), _pair(recipient_id, sender_id))
+
+    if sender_id != recipient_id:
+        await db.execute(
+            update(models.Conversation)
+            .filter(_pair(recipient_id, sender_id), models.Conversation.last_read_id < message.id)
+            .values(unread_count=func.max(models.Conversation.unread_count - 1, 0))
+        )
+
+    latest = (await db.execute(
+        select(models.Message.id, models.Message.sent).filter(or_(
+            and_(models.Message.sender_id == sender_id, models.Message.recipient_id == recipient_id),
+            and_(models.Message.sender_id == recipient_id, models.Message.recipient_id == sender_id),
+        )).order_by(models.Message.id.desc()).limit(1)
+    )).first()
+    if latest is None:
+        await db.execute(delete(models.Conversation).filter(both))
+    else:
+        await db.execute(
+            update(models.Conversation).filter(both).values(last_message_id=latest.id, last_sent=latest.sent)
+        )
+
+
+async def get_conversations(db: AsyncSession, user_id: int, limit: int = 50,
+                            before: Optional[Tuple[datetime, int]] = None) -> List[models.Conversation]:
+    """A user's conversations, most recent first; `before` is the key of the last row already seen"""
+    query = select(models.Conversation).options(*CONVERSATION_DETAILED).filter(models.Conversation.user_id == user_id)
+    if before is not None:
+        query = query.filter(tuple_(models.Conversation.last_sent, models.Conversation.peer_id) < tuple_(*before))
+    result = await db.scalars(
+        query.order_by(models.Conversation.last_sent.desc(), models.Conversation.peer_id.desc()).limit(limit)
+    )
+    return result.all()
+
+
+async def mark_conversation_read(db: AsyncSession, user_id: int, peer_id: int) -> Optional[models.Conversation]:
+    result = await db.execute(
+        update(models.Conversation)
+        .filter(_pair(user_id, peer_id))
+        .values(last_read_id=models.Conversation.last_message_id, unread_count=0)
+    )
+    await db.commit()
+    if not result.rowcount:
+        return None
+    return await db.scalar(
+        select(models.Conversation).options(*CONVERSATION_DETAILED).filter(_pair(user_id, peer_id))
+    )
+
+
+async def rebuild_conversations(db: AsyncSession) -> None:
+    """Recompute every conversation summary from the messages table"""
+    for statement in models.CONVERSATIONS_REBUILD:
+        await db.execute(text(statement))
+    await db.commit()
+
 
+async def get_application(db: AsyncSession, application_id: int, *options) -> Optional[models.Application]:
+    return await db.scalar(
+        select(models.Application).options(*options).filter(models.Application.id == application_id)
+    )
 
-def get_user_applications(db: Session, user_id: int) -> List[models.Application]:
-    return db.query(models.Application).filter(models.Application.user_id == user_id).all()
 
+async def get_user_applications(db: AsyncSession, user_id: int) -> List[models.Application]:
+    result = await db.scalars(select(models.Application).filter(models.Application.user_id == user_id))
+    return result.all()
 
-def get_vacancy_applications(db: Session, vacancy_id: int) -> List[models.Application]:
-    return db.query(models.Application).filter(models.Application.vacancy_id == vacancy_id).all()
 
+async def get_vacancy_applications(db: AsyncSession, vacancy_id: int) -> List[models.Application]:
+    result = await db.scalars(select(models.Application).filter(models.Application.vacancy_id == vacancy_id))
+    return result.all()
 
-def create_application(db: Session, user_id: int, application_data: dict) -> models.Application:
+
+async def create_application(db: AsyncSession, user_id: int, application_data: dict) -> models.Application:
     db_application = models.Application(user_id=user_id, **application_data)
     db.add(db_application)
-    db.commit()
-    db.refresh(db_application)
+    await db.commit()
+    await db.refresh(db_application)
     return db_application
 
 
-def update_application(db: Session, application_id: int, application_data: dict) -> Optional[models.Application]:
-    db_application = get_application(db, application_id)
+async def update_application(db: AsyncSession, application_id: int, application_data: dict) -> Optional[
+    models.Application]:
+    db_application = await get_application(db, application_id)
     if not db_application:
         return None
 
     for field, value in application_data.items():
         setattr(db_application, field, value)
 
-    db.commit()
-    db.refresh(db_application)
+    await db.commit()
+    await db.refresh(db_application)
     return db_application
 
 
-def delete_application(db: Session, application_id: int) -> bool:
-    db_application = get_application(db, application_id)
+async def delete_application(db: AsyncSession, application_id: int) -> bool:
+    db_application = await get_application(db, application_id)
     if not db_application:
         return False
-    db.delete(db_application)
-    db.commit()
+    await db.delete(db_application)
+    await db.commit()
     return True
 
 
-def get_user_bookmarks(db: Session, user_id: int) -> List[models.Bookmark]:
-    return db.query(models.Bookmark).filter(models.Bookmark.user_id == user_id).all()
+async def get_user_bookmarks(db: AsyncSession, user_id: int, *options, limit: Optional[int] = None,
+                             after_vacancy_id: Optional[int] = None) -> List[models.Bookmark]:
+    query = select(models.Bookmark).options(*options).filter(models.Bookmark.user_id == user_id)
+    if after_vacancy_id is not None:
+        query = query.filter(models.Bookmark.vacancy_id > after_vacancy_id)
+    result = await db.scalars(query.order_by(models.Bookmark.vacancy_id).limit(limit))
+    return result.all()
+
 
+async def get_bookmarked_ids(db: AsyncSession, user_id: int) -> frozenset:
+    """
+    The user's bookmarked vacancy ids, served from cache.bookmark_cache while the user's
+    bookmarks version (kept by triggers, so any process's writes count) is unchanged
+    """
+    version = await cache.table_versions.scoped(db, "bookmarks", user_id)
+    cached = cache.bookmark_cache.get(user_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    result = await db.scalars(select(models.Bookmark.vacancy_id).filter(models.Bookmark.user_id == user_id))
+    ids = frozenset(result.all())
+    cache.bookmark_cache.set(user_id, (version, ids))
+    return ids
 
-def create_bookmark(db: Session, user_id: int, vacancy_id: int) -> models.Bookmark:
+
+async def create_bookmark(db: AsyncSession, user_id: int, vacancy_id: int) -> models.Bookmark:
     # Check if bookmark already exists
-    existing = db.query(models.Bookmark).filter(
+    existing = await db.scalar(select(models.Bookmark).filter(
         models.Bookmark.user_id == user_id,
         models.Bookmark.vacancy_id == vacancy_id
-    ).first()
+    ))
 
     if existing:
         return existing
 
     db_bookmark = models.Bookmark(user_id=user_id, vacancy_id=vacancy_id)
     db.add(db_bookmark)
-    db.commit()
-    db.refresh(db_bookmark)
+    await db.commit()
+    await db.refresh(db_bookmark)
     return db_bookmark
 
 
-def delete_bookmark(db: Session, user_id: int, vacancy_id: int) -> bool:
-    db_bookmark = db.query(models.Bookmark).filter(
+async def delete_bookmark(db: AsyncSession, user_id: int, vacancy_id: int) -> bool:
+    db_bookmark = await db.scalar(select(models.Bookmark).filter(
         models.Bookmark.user_id == user_id,
         models.Bookmark.vacancy_id == vacancy_id
-    ).first()
+    ))
 
     if not db_bookmark:
         return False
 
-    db.delete(db_bookmark)
-    db.commit()
+    await db.delete(db_bookmark)
+    await db.commit()
     return True
 
 
-def get_media(db: Session, media_id: int) -> Optional[models.Media]:
-    return db.query(models.Media).filter(models.Media.id == media_id).first()
-
-
-def create_media(db: Session, media_data: dict) -> models.Media:
+async def update_bookmarks(db: AsyncSession, user_id: int, add: List[int],
+                           remove: List[int]) -> Tuple[List[int], List[int], List[int]]:
+    """
+    Remove then add bookmarks in one transaction. Returns (added, removed, missing): ids that
+    were newly bookmarked, ids that were un-bookmarked, and requested vacancies that don't exist.
+    Ids already in the requested state appear in neither list.
+    """
+    removed = []
+    if remove:
+        result = await db.execute(
+            delete(models.Bookmark)
+            .filter(models.Bookmark.user_id == user_id, models.Bookmark.vacancy_id.in_(set(remove)))
+            .returning(models.Bookmark.vacancy_id)
+        )
+        removed = sorted(result.scalars().all())
+
+    added, missing = [], []
+    if add:
+        wanted = set(add)
+        existing = set((await db.scalars(select(models.Vacancy.id).filter(models.Vacancy.id.in_(wanted)))).all())
+        missing = sorted(wanted - existing)
+        if existing:
+            result = await db.execute(
+                sqlite_insert(models.Bookmark)
+                .values([{"user_id": user_id, "vacancy_id": vacancy_id} for vacancy_id in existing])
+                .on_conflict_do_nothing()
+                .returning(models.Bookmark.vacancy_id)
+            )
+            added = sorted(result.scalars().all())
+
+    await db.commit()
+    return added, removed, missing
+
+
+async def get_media(db: AsyncSession, media_id: int) -> Optional[models.Media]:
+    return await db.scalar(select(models.Media).filter(models.Media.id == media_id))
+
+
+async def create_media(db: AsyncSession, media_data: dict) -> models.Media:
     db_media = models.Media(**media_data)
     db.add(db_media)
-    db.commit()
-    db.refresh(db_media)
+    await db.commit()
+    await db.refresh(db_media)
     return db_media
 
 
-def delete_media(db: Session, media_id: int) -> bool:
-    db_media = get_media(db, media_id)
+async def create_stored_media(db: AsyncSession, blob: storage.StoredBlob, name: str,
+                              content_type: Optional[str]) -> models.Media:
+    """Put an uploaded blob in place and record it; identical content shares one file"""
+    async with storage.blob_lock(blob.sha256):
+        await storage.place(blob)
+        # Derivatives are shared with the content, so is the placeholder
+        placeholder = await db.scalar(select(models.Media.placeholder).filter(
+            models.Media.sha256 == blob.sha256, models.Media.placeholder.isnot(None)).limit(1))
+        return await create_media(db, {
+            "name": name, "path": storage.blob_key(blob.sha256), "size": blob.size,
+            "sha256": blob.sha256, "content_type": content_type, "placeholder": placeholder,
+        })
+
+
+async def set_media_placeholder(db: AsyncSession, sha256: str, placeholder: str) -> None:
+    await db.execute(update(models.Media).filter(models.Media.sha256 == sha256).values(placeholder=placeholder))
+    await db.commit()
+
+
+async def delete_media(db: AsyncSession, media_id: int) -> bool:
+    db_media = await get_media(db, media_id)
     if not db_media:
         return False
-    db.delete(db_media)
-    db.commit()
+    sha256 = db_media.sha256
+    async with storage.blob_lock(sha256):
+        await db.delete(db_media)
+        await db.commit()
+        # Drop the blob with its last reference
+        if sha256 is not None and not await db.scalar(
+                select(func.count()).select_from(models.Media).filter(models.Media.sha256 == sha256)):
+            await storage.remove(sha256)
     return True
 
 
-def add_message_media(db: Session, message_id: int, media_id: int) -> models.MessageMedia:
+async def add_message_media(db: AsyncSession, message_id: int, media_id: int) -> models.MessageMedia:
     db_mm = models.MessageMedia(message_id=message_id, media_id=media_id)
     db.add(db_mm)
-    db.commit()
-    db.refresh(db_mm)
+    await db.commit()
+    await db.refresh(db_mm)
     return db_mm
 
 
-def add_vacancy_media(db: Session, vacancy_id: int, media_id: int) -> models.VacancyMedia:
+async def add_vacancy_media(db: AsyncSession, vacancy_id: int, media_id: int) -> models.VacancyMedia:
     db_vm = models.VacancyMedia(vacancy_id=vacancy_id, media_id=media_id)
     db.add(db_vm)
-    db.commit()
-    db.refresh(db_vm)
+    await db.commit()
+    await db.refresh(db_vm)
     return db_vm
 
 
-def add_application_media(db: Session, application_id: int, media_id: int) -> models.ApplicationMedia:
+async def add_application_media(db: AsyncSession, application_id: int, media_id: int) -> models.ApplicationMedia:
     db_am = models.ApplicationMedia(application_id=application_id, media_id=media_id)
     db.add(db_am)
-    db.commit()
-    db.refresh(db_am)
-    return db_am
\ No newline at end of file
+    await db.commit()
+    await db.refresh(db_am)
+    return db_am
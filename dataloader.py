@@ -0,0 +1,90 @@
+import asyncio
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from fastapi import Depends
+from sqlalchemy import inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
+from models import get_read_db
+
+
+# ===== Request-scoped Batch Loader =====
+
+class Loader:
+    """
+    DataLoader-style batcher for one request. load() calls made in the same event-loop turn
+    are resolved together, one IN query per model; rows are memoised for the rest of the
+    request, so an id referenced many times is fetched once.
+
+    The loader issues its queries on the request's read session, so don't run other queries
+    on that session concurrently with a pending load.
+    """
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+        self.queries = 0
+        self._rows: Dict[Tuple[type, int], Optional[object]] = {}
+        self._pending: Dict[type, Dict[int, asyncio.Future]] = defaultdict(dict)
+        self._dispatch: Optional[asyncio.Task] = None
+
+    def prime(self, model: type, rows: Iterable) -> None:
+        """Memoise rows loaded some other way"""
+        for row in rows:
+            self._rows[model, row.id] = row
+
+    def load(self, model: type, row_id: Optional[int]) -> asyncio.Future:
+        """A future for the row with this id (None if there is none)"""
+        future = asyncio.get_running_loop().create_future()
+        if row_id is None or (model, row_id) in self._rows:
+            future.set_result(self._rows.get((model, row_id)) if row_id is not None else None)
+            return future
+        pending = self._pending[model]
+        if row_id in pending:
+            return pending[row_id]
+        pending[row_id] = future
+        if self._dispatch is None:
+            self._dispatch = asyncio.create_task(self._run())
+        return future
+
+    async def load_many(self, model: type, ids: Iterable[int]) -> List:
+        """Rows for `ids` in id order, leaving out missing ones"""
+        rows = await asyncio.gather(*(self.load(model, row_id) for row_id in sorted(set(ids))))
+        return [row for row in rows if row is not None]
+
+    async def attach(self, rows: Sequence, relationship: str) -> None:
+        """Fill a many-to-one relationship on every row from one batched lookup, ready to serialize"""
+        if not rows:
+            return
+        mapper = inspect(type(rows[0]))
+        prop = mapper.relationships[relationship]
+        (column,) = prop.local_columns
+        key = mapper.get_property_by_column(column).key
+        related = await asyncio.gather(*(self.load(prop.mapper.class_, getattr(row, key)) for row in rows))
+        for row, value in zip(rows, related):
+            set_committed_value(row, relationship, value)
+
+    async def _run(self) -> None:
+        # Runs after the caller's current turn, by which point a gather() has queued all of its ids
+        try:
+            while self._pending:
+                model, pending = self._pending.popitem()
+                try:
+                    self.queries += 1
+                    rows = (await self.db.scalars(select(model).filter(model.id.in_(pending)))).all()
+                except Exception as error:
+                    for future in pending.values():
+                        if not future.done():
+                            future.set_exception(error)
+                    continue
+                found = {row.id: row for row in rows}
+                for row_id, future in pending.items():
+                    self._rows[model, row_id] = found.get(row_id)
+                    if not future.done():
+                        future.set_result(found.get(row_id))
+        finally:
+            self._dispatch = None
+
+
+async def get_loader(db: AsyncSession = Depends(get_read_db)) -> Loader:
+    """One Loader per request, sharing the request's read session"""
+    return Loader(db)
@@ -0,0 +1,63 @@
+import csv
+import enum
+import io
+import json
+import re
+from typing import AsyncIterator
+from sqlalchemy import Select
+import models
+
+YIELD_PER = 1000
+
+
+class Format(str, enum.Enum):
+    csv = "csv"
+    ndjson = "ndjson"
+
+
+MEDIA_TYPES = {
+    Format.csv: "text/csv; charset=utf-8",
+    Format.ndjson: "application/x-ndjson",
+}
+
+# Spreadsheets evaluate a cell starting with one of these as a formula
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+# A leading + or - is left alone on signed numbers, and on text like "-5 years" where the
+# sign (and any number) is followed by whitespace and nothing that could compute or call
+# anything; "+A1" or "-SUM" could be a reference, so they are quoted
+_SIGNED_NUMBER = re.compile(r"[+-](\d+([.,]\d*)?|[.,]\d+)([eE][+-]?\d+)?")
+_SIGNED_TEXT = re.compile(r"[+-](\d+([.,]\d+)?)?\s[^-+*/^&=(!|@]*")
+
+
+def csv_cell(value):
+    """Quote student-written text that a spreadsheet would otherwise run as a formula"""
+    if not isinstance(value, str) or not value.startswith(FORMULA_PREFIXES):
+        return value
+    if value[0] in "+-" and (_SIGNED_NUMBER.fullmatch(value) or _SIGNED_TEXT.fullmatch(value)):
+        return value
+    return "'" + value
+
+
+async def stream_rows(query: Select, format: Format) -> AsyncIterator[bytes]:
+    """
+    Run `query` on a server-side cursor and encode rows as they arrive, one partition at a time.
+    Uses its own session because the response body outlives the request's dependencies.
+    """
+    async with models.ReadSessionLocal() as db:
+        result = await db.stream(query.execution_options(yield_per=YIELD_PER))
+        columns = list(result.keys())
+
+        if format == Format.csv:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(columns)
+            async for rows in result.partitions():
+                writer.writerows([csv_cell(value) for value in row] for row in rows)
+                yield buffer.getvalue().encode()
+                buffer.seek(0)
+                buffer.truncate()
+            if buffer.tell():
+                yield buffer.getvalue().encode()
+        else:
+            async for rows in result.partitions():
+                yield "".join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in rows).encode()
@@ -1,22 +1,52 @@
 import uvicorn
-from fastapi import FastAPI, APIRouter, Depends, HTTPException, Query, status
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, Query, Request, Response, status
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from models import get_db
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from sqlalchemy import and_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import get_db, get_read_db
 from auth import Role
 import schemas
 import models
 import crud
 import auth
+import bulk
+import cache
+import dataloader
+import export
+import metrics
+import migrations
+import pagination
+import passwords
+import policy
+import profiler
+import pubsub
+import storage
+import thumbnails
+import asyncio
+import json
 import logging
-from typing import Union, List, Optional
-from datetime import timedelta
+import os
+from contextlib import asynccontextmanager
+from typing import Dict, Union, List, Optional
+from datetime import datetime, timedelta
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    async with models.async_engine.begin() as connection:
+        await connection.run_sync(migrations.upgrade)
+    yield
+    passwords.pool.shutdown()
+    await thumbnails.pool.shutdown()
+
 
 app = FastAPI(
     title="Stageровка API",
     description="API для сервиса публикации и поиска студенческих стажировок",
-    version="0.2.1"
+    version="0.2.1",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -25,8 +55,35 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[pagination.NEXT_CURSOR_HEADER, "X-Bulk-Inserted", "X-Bulk-Failed", "ETag", "X-Cache",
+                    "X-Request-ID", "X-Profile-Queries", "Server-Timing", "X-Facets"],
 )
 
+if profiler.ENABLED:
+    profiler.configure_log()
+    profiler.instrument_engine(models.async_engine.sync_engine)
+    profiler.instrument_engine(models.read_engine.sync_engine)
+    app.add_middleware(profiler.ProfilerMiddleware)
+
+app.add_middleware(metrics.MetricsMiddleware)
+metrics.instrument_engine(models.async_engine.sync_engine)
+metrics.instrument_engine(models.read_engine.sync_engine)
+metrics.metrics.register_collector(lambda: {
+    f"principal_cache_{name}": value for name, value in cache.principal_cache.stats().items()
+})
+metrics.metrics.register_collector(lambda: {
+    f"response_cache_{name}": value for name, value in cache.response_cache.stats().items()
+})
+metrics.metrics.register_collector(lambda: {
+    f"password_hashing_{name}": value for name, value in passwords.pool.stats().items()
+})
+metrics.metrics.register_collector(lambda: {
+    f"message_stream_{name}": value for name, value in pubsub.hub.stats().items()
+})
+metrics.metrics.register_collector(lambda: {
+    f"thumbnails_{name}": value for name, value in thumbnails.pool.stats().items()
+})
+
 logging.basicConfig(
     level=logging.DEBUG,       # show debug and above
     format="[%(levelname)s] %(name)s: %(message)s"
@@ -36,30 +93,22 @@ logger = logging.getLogger(__name__)
 auth_router = APIRouter(prefix="/api/auth", tags=["authentication"])
 
 @auth_router.post("/register", response_model=schemas.UserResponse, status_code=status.HTTP_201_CREATED)
-def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def register(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
     """Register a new user (defaults to Student role)"""
     # Check if email already exists
-    existing_user = db.query(models.User).filter(models.User.email == user.email).first()
+    existing_user = await crud.get_user_by_email(db, user.email)
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
 
-    # Hash password
+    # Create user (crud hashes the password in the hashing pool)
     user_data = user.model_dump()
-    logger.debug(user_data['password'])
-    user_data['password'] = auth.get_password_hash(user_data['password'])
-
-    # Create user
-    db_user = models.User(**user_data)
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
+    return await crud.create_user(db, user_data)
 
 
 @auth_router.post("/login", response_model=auth.Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
     """Login and get access token"""
-    user = auth.authenticate_user(db, form_data.username, form_data.password)
+    user = await auth.authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -75,9 +124,12 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
 
 
 @auth_router.get("/me", response_model=schemas.UserResponse)
-def get_current_user_info(current_user: models.User = Depends(auth.get_current_user)):
+async def get_current_user_info(
+        current_user: auth.Principal = Depends(auth.get_current_user),
+        db: AsyncSession = Depends(get_read_db)
+):
     """Get current authenticated user info"""
-    return current_user
+    return await crud.get_user(db, current_user.id)
 
 app.include_router(auth_router)
 
@@ -86,62 +138,77 @@ user_router = APIRouter(prefix="/api/users", tags=["users"])
 
 
 @user_router.get("/", response_model=List[schemas.UserResponse])
-def list_users(
+async def list_users(
+        response: Response,
         skip: int = 0,
         limit: int = 100,
-        current_user: models.User = Depends(auth.get_current_user),
-        db: Session = Depends(get_db)
+        cursor: Optional[str] = None,
+        ids: Optional[List[int]] = Depends(pagination.batch_ids),
+        current_user: auth.Principal = Depends(auth.get_current_user),
+        access: policy.Policy = Depends(policy.get_policy),
+        loader: dataloader.Loader = Depends(dataloader.get_loader),
+        db: AsyncSession = Depends(get_read_db)
 ):
     """
     List users based on role:
     - Students: Only themselves
     - Agents: Themselves + students who applied to their org
     - Admins: Everyone
+
+    Pass the X-Next-Cursor response header back as `cursor` to fetch the next page.
+    With `ids`, returns the listed users the caller may see, by id.
     """
+    if ids is not None:
+        return await loader.load_many(models.User, await access.visible_ids(models.User, ids))
+
+    after = pagination.decode_cursor(cursor, int)
+    after_id = after[0] if after else None
+
     if current_user.role == Role.ADMIN:
-        return crud.get_users(db, skip=skip, limit=limit)
+        users = await crud.get_users(db, skip=skip, limit=limit, after_id=after_id)
+        return pagination.set_next_cursor(response, users, limit, pagination.id_key)
 
     elif current_user.role == Role.AGENT:
-        # Get agent themselves + students who applied to their org
-        students_with_applications = db.query(models.User).join(
-            models.Application
-        ).join(
-            models.Vacancy
-        ).filter(
-            models.Vacancy.employer_id == current_user.org_id,
-            models.User.role == Role.STUDENT
-        ).distinct().all()
-
-        # Include the agent themselves
-        result = [current_user] + students_with_applications
-        return result[skip:skip + limit]
+        # Everyone policy.user_scope lets an agent see is themselves or one of their org's applicants,
+        # so the page walks the org_applicants index under that scope and costs O(limit).
+        # The agent heads the unpaged list
+        head = []
+        if after_id is None:
+            if skip == 0:
+                head = [await access.get(models.User, current_user.id)]
+            else:
+                skip -= 1
+        applicants = []
+        if current_user.org_id is not None and limit > len(head):
+            applicants = await crud.get_org_applicants(
+                db, current_user.org_id, skip=skip, limit=limit - len(head), after_id=after_id,
+                scope=and_(access.scope(models.User), models.User.id != current_user.id)
+            )
+        page = head + applicants
+        # A cursor pointing at the agent restarts the student list
+        return pagination.set_next_cursor(
+            response, page, limit, lambda user: (0,) if user.id == current_user.id else (user.id,)
+        )
 
     else:  # Student
-        return [current_user]
+        return [await crud.get_user(db, current_user.id)]
 
 
 @user_router.get("/{user_id}", response_model=schemas.UserDetailed)
-def get_user(
+async def get_user(
         user_id: int,
-        current_user: models.User = Depends(auth.get_current_user),
-        db: Session = Depends(get_db)
+        access: policy.Policy = Depends(policy.get_policy)
 ):
     """Get a specific user (with permission check)"""
-    if not auth.can_view_user(current_user, user_id, db):
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to view this user")
-
-    db_user = crud.get_user(db, user_id)
-    if not db_user:
-        raise HTTPException(status_code=404, detail="User not found")
-    return db_user
+    return await access.get(models.User, user_id, *crud.USER_DETAILED, denied="Not authorized to view this user")
 
 
 @user_router.patch("/{user_id}", response_model=schemas.UserResponse)
-def update_user(
+async def update_user(
         user_id: int,
         user: schemas.UserUpdate,
-        current_user: models.User = Depends(auth.get_current_user),
-        db: Session = Depends(get_db)
+        current_user: auth.Principal = Depends(auth.get_current_user),
+        db: AsyncSession = Depends(get_db)
 ):
     """Update user (self or admin only)"""
     if not auth.can_modify_user(current_user, user_id):
@@ -151,22 +218,22 @@ def update_user(
 
     # Hash password if it's being updated
     if 'password' in update_data:
-        update_data['password'] = auth.get_password_hash(update_data['password'])
+        update_data['password'] = await auth.get_password_hash(update_data['password'])
 
-    db_user = crud.update_user(db, user_id, update_data)
+    db_user = await crud.update_user(db, user_id, update_data)
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
     return db_user
 
 
 @user_router.delete("/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_user(
+async def delete_user(
         user_id: int,
-        current_user: models.User = Depends(auth.require_admin),
-        db: Session = Depends(get_db)
+        current_user: auth.Principal = Depends(auth.require_admin),
+        db: AsyncSession = Depends(get_db)
 ):
     """Delete user (admin only)"""
-    if not crud.delete_user(db, user_id):
+    if not await crud.delete_user(db, user_id):
         raise HTTPException(status_code=404, detail="User not found")
 
 
@@ -175,31 +242,125 @@ app.include_router(user_router)
 vacancy_router = APIRouter(prefix="/api/vacancies", tags=["vacancies"])
 
 
-@vacancy_router.get("/", response_model=List[schemas.VacancyResponse])
-def list_vacancies(
+FACETS_HEADER = "X-Facets"
+
+
+def vacancy_stats(row) -> dict:
+    return {"vacancy_id": row.id, "title": row.title,
+            "application_count": row.application_count, "bookmark_count": row.bookmark_count}
+
+
+async def bookmark_variant(
+        current_user: Optional[auth.Principal] = Depends(auth.get_optional_user),
+        db: AsyncSession = Depends(get_read_db)
+) -> Optional[str]:
+    """ETag variant for vacancy lists annotated with the caller's bookmarks: moves only with their own"""
+    if current_user is None:
+        return None
+    return f"u{current_user.id}.{await cache.table_versions.scoped(db, 'bookmarks', current_user.id)}"
+
+
+@vacancy_router.get("/", response_model=List[schemas.VacancyListItem],
+                    dependencies=[Depends(cache.conditional_get("vacancies", variant=bookmark_variant))])
+async def list_vacancies(
+        request: Request,
+        response: Response,
         skip: int = 0,
         limit: int = 100,
+        cursor: Optional[str] = None,
         employer_id: Optional[int] = None,
-        db: Session = Depends(get_db)
+        vacancy_status: Optional[int] = Query(None, alias="status"),
+        required_year: Optional[int] = None,
+        salary_min: Optional[float] = None,
+        salary_max: Optional[float] = None,
+        ids: Optional[List[int]] = Depends(pagination.batch_ids),
+        sort: crud.VacancySort = crud.VacancySort.created,
+        facets: Optional[str] = Query(None, description="Comma-separated facets to count: "
+                                                        + ", ".join(crud.VACANCY_FACETS)),
+        current_user: Optional[auth.Principal] = Depends(auth.get_optional_user),
+        versions: Dict[str, int] = Depends(cache.get_versions),
+        db: AsyncSession = Depends(get_read_db)
 ):
-    """List all vacancies (public endpoint)"""
-    return crud.get_vacancies(db, skip=skip, limit=limit, employer_id=employer_id)
+    """
+    List vacancies (public endpoint), filtered by employer, status, required year and a salary
+    range, oldest first unless `sort` says otherwise; page with `cursor` from X-Next-Cursor.
+    `ids` restricts the list to the given vacancies.
+    With `facets` the X-Facets header holds vacancy counts per facet value as JSON.
+    With a bearer token each item's is_bookmarked reflects the caller's bookmarks.
+    """
+    facet_names = [name.strip() for name in facets.split(",") if name.strip()] if facets else []
+    unknown = [name for name in facet_names if name not in crud.VACANCY_FACETS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown facets: {', '.join(unknown)}")
+
+    # Lists of one employer's vacancies only move with that employer's writes
+    if employer_id is not None:
+        version = await cache.table_versions.scoped(db, "vacancies", employer_id)
+    else:
+        version = versions.get("vacancies", 0)
+    key = cache.response_cache.key(request, "vacancies", version, scope=employer_id)
+    entry = cache.response_cache.get(key)
+    cache_status = "HIT"
+    if entry is None:
+        filters = crud.vacancy_filters(employer_id, vacancy_status, required_year, salary_min, salary_max, ids)
+        if sort in (crud.VacancySort.salary, crud.VacancySort.highest_salary):
+            after = pagination.decode_cursor(cursor, pagination.nullable(float), int)
+            sort_key = pagination.vacancy_salary_key
+        else:
+            after = pagination.decode_cursor(cursor, datetime.fromisoformat, int)
+            sort_key = pagination.vacancy_key
+        vacancies = await crud.get_vacancies(db, skip=skip, limit=limit, after=after, sort=sort, filters=filters)
+        pagination.set_next_cursor(response, vacancies, limit, sort_key)
+        if facet_names:
+            counts = await crud.count_vacancy_facets(db, facet_names, filters)
+            response.headers[FACETS_HEADER] = json.dumps(
+                {facet: {str(value) if value is not None else "null": count for value, count in values.items()}
+                 for facet, values in counts.items()},
+                separators=(",", ":"),
+            )
+        body = schemas.VacancyList.dump_json(schemas.VacancyList.validate_python(vacancies, from_attributes=True))
+        headers = (pagination.NEXT_CURSOR_HEADER, FACETS_HEADER)
+        flags = cache.flag_offsets(body, "is_bookmarked", [v.id for v in vacancies])
+        if employer_id is not None and version == 0:
+            # No vacancy was ever written for this employer (or it doesn't exist): the page is
+            # empty and cheap, and caching it would let any id in the query string take a slot
+            entry = cache.CachedResponse.capture(body, response, headers, flags)
+        else:
+            entry = cache.response_cache.set(key, body, response, headers=headers, flags=flags)
+        cache_status = "MISS"
+
+    if current_user is not None:
+        entry = entry.with_flags(await crud.get_bookmarked_ids(db, current_user.id))
+    return entry.to_response(response, cache_status)
+
+
+@vacancy_router.get("/search", response_model=List[schemas.VacancySearchResult])
+async def search_vacancies(
+        q: str = Query(..., min_length=1),
+        skip: int = 0,
+        limit: int = Query(20, le=100),
+        db: AsyncSession = Depends(get_read_db)
+):
+    """Full-text search over vacancies, best matches first (public endpoint)"""
+    results = await crud.search_vacancies(db, q, skip=skip, limit=limit)
+    return [{"vacancy": vacancy, "rank": rank, "snippet": snippet} for vacancy, rank, snippet in results]
 
 
-@vacancy_router.get("/{vacancy_id}", response_model=schemas.VacancyDetailed)
-def get_vacancy(vacancy_id: int, db: Session = Depends(get_db)):
+@vacancy_router.get("/{vacancy_id}", response_model=schemas.VacancyDetailed,
+                    dependencies=[Depends(cache.conditional_get("vacancies", "organisations", "applications"))])
+async def get_vacancy(vacancy_id: int, db: AsyncSession = Depends(get_read_db)):
     """Get a specific vacancy (public endpoint)"""
-    db_vacancy = crud.get_vacancy(db, vacancy_id)
+    db_vacancy = await crud.get_vacancy(db, vacancy_id, *crud.VACANCY_DETAILED)
     if not db_vacancy:
         raise HTTPException(status_code=404, detail="Vacancy not found")
     return db_vacancy
 
 
 @vacancy_router.post("/", response_model=schemas.VacancyResponse, status_code=status.HTTP_201_CREATED)
-def create_vacancy(
+async def create_vacancy(
         vacancy: schemas.VacancyCreate,
-        current_user: models.User = Depends(auth.require_agent),
-        db: Session = Depends(get_db)
+        current_user: auth.Principal = Depends(auth.require_agent),
+        db: AsyncSession = Depends(get_db)
 ):
     """Create a vacancy (agents and admins only)"""
     # Agents can only create vacancies for their own org
@@ -208,18 +369,54 @@ def create_vacancy(
                             detail="Can only create vacancies for your organization")
 
     vacancy_data = vacancy.model_dump()
-    return crud.create_vacancy(db, vacancy_data)
+    return await crud.create_vacancy(db, vacancy_data)
+
+
+@vacancy_router.post("/bulk")
+async def bulk_create_vacancies(
+        request: Request,
+        current_user: auth.Principal = Depends(auth.require_agent),
+        db: AsyncSession = Depends(get_db)
+):
+    """
+    Create vacancies from an NDJSON body, one VacancyCreate object per line (agents and admins only).
+    Responds with NDJSON holding the new id or the error for every input line.
+    """
+    def authorize(vacancy: schemas.VacancyCreate) -> Optional[str]:
+        if current_user.role == Role.AGENT and vacancy.employer_id != current_user.org_id:
+            return "Can only create vacancies for your organization"
+        return None
+
+    ingest = bulk.BulkIngest(db, schemas.VacancyCreate, models.Vacancy, authorize)
+    await ingest.run(bulk.iter_ndjson_lines(request))
+    return ingest.response()
+
+
+@vacancy_router.get("/{vacancy_id}/stats", response_model=schemas.VacancyStats)
+async def get_vacancy_stats(
+        vacancy_id: int,
+        current_user: auth.Principal = Depends(auth.require_agent),
+        db: AsyncSession = Depends(get_read_db)
+):
+    """Application and bookmark counts of a vacancy (agents for their org, admins for any)"""
+    rows = await crud.get_vacancy_stats(db, vacancy_id=vacancy_id)
+    if not rows:
+        raise HTTPException(status_code=404, detail="Vacancy not found")
+
+    if not auth.can_modify_vacancy(current_user, rows[0]):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized")
+    return vacancy_stats(rows[0])
 
 
 @vacancy_router.patch("/{vacancy_id}", response_model=schemas.VacancyResponse)
-def update_vacancy(
+async def update_vacancy(
         vacancy_id: int,
         vacancy: schemas.VacancyUpdate,
-        current_user: models.User = Depends(auth.require_agent),
-        db: Session = Depends(get_db)
+        current_user: auth.Principal = Depends(auth.require_agent),
+        db: AsyncSession = Depends(get_db)
 ):
     """Update a vacancy (agents for their org, admins for any)"""
-    db_vacancy = crud.get_vacancy(db, vacancy_id)
+    db_vacancy = await crud.get_vacancy(db, vacancy_id)
     if not db_vacancy:
         raise HTTPException(status_code=404, detail="Vacancy not found")
 
@@ -227,24 +424,24 @@ def update_vacancy(
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to modify this vacancy")
 
     update_data = vacancy.model_dump(exclude_unset=True)
-    return crud.update_vacancy(db, vacancy_id, update_data)
+    return await crud.update_vacancy(db, vacancy_id, update_data)
 
 
 @vacancy_router.delete("/{vacancy_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_vacancy(
+async def delete_vacancy(
         vacancy_id: int,
-        current_user: models.User = Depends(auth.require_agent),
-        db: Session = Depends(get_db)
+        current_user: auth.Principal = Depends(auth.require_agent),
+        db: AsyncSession = Depends(get_db)
 ):
     """Delete a vacancy (agents for their org, admins for any)"""
-    db_vacancy = crud.get_vacancy(db, vacancy_id)
+    db_vacancy = await crud.get_vacancy(db, vacancy_id)
     if not db_vacancy:
         raise HTTPException(status_code=404, detail="Vacancy not found")
 
     if not auth.can_modify_vacancy(current_user, db_vacancy):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to delete this vacancy")
 
-    if not crud.delete_vacancy(db, vacancy_id):
+    if not await crud.delete_vacancy(db, vacancy_id):
         raise HTTPException(status_code=404, detail="Vacancy not found")
 
 
@@ -254,76 +451,107 @@ application_router = APIRouter(prefix="/api/applications", tags=["applications"]
 
 
 @application_router.get("/", response_model=List[schemas.ApplicationResponse])
-def list_applications(
+async def list_applications(
+        response: Response,
         skip: int = 0,
         limit: int = 100,
-        current_user: models.User = Depends(auth.get_current_user),
-        db: Session = Depends(get_db)
+        cursor: Optional[str] = None,
+        expand: bool = Query(False, description="Include each application's user and vacancy"),
+        access: policy.Policy = Depends(policy.get_policy),
+        loader: dataloader.Loader = Depends(dataloader.get_loader),
+        db: AsyncSession = Depends(get_read_db)
 ):
     """
     List applications based on role:
     - Students: Only their own applications
     - Agents: Applications to their org's vacancies
     - Admins: All applications
+
+    Pass the X-Next-Cursor response header back as `cursor` to fetch the next page.
+    With `expand`, each item also has its user and vacancy, loaded with one query each for the whole page.
     """
-    if current_user.role == Role.ADMIN:
-        return db.query(models.Application).offset(skip).limit(limit).all()
+    query = select(models.Application).filter(access.scope(models.Application))
+    after = pagination.decode_cursor(cursor, int)
+    if after is not None:
+        query = query.filter(models.Application.id > after[0])
+    applications = (await db.scalars(query.order_by(models.Application.id).offset(skip).limit(limit))).all()
+    access.remember(models.Application, applications)
+    pagination.set_next_cursor(response, applications, limit, pagination.id_key)
+    if not expand:
+        return applications
+    # Applicants repeat across a page and vacancies more so; each distinct one is loaded once
+    await loader.attach(applications, "user")
+    await loader.attach(applications, "vacancy")
+    # Serialized here since the route's response_model is the plain ApplicationResponse
+    headers = {name: value for name, value in response.headers.items() if name != "content-length"}
+    body = schemas.ApplicationDetailedList.dump_json(
+        schemas.ApplicationDetailedList.validate_python(applications, from_attributes=True)
+    )
+    return Response(content=body, media_type="application/json", headers=headers)
 
-    elif current_user.role == Role.AGENT:
-        # Applications to this agent's organization vacancies
-        return db.query(models.Application).join(
-            models.Vacancy
-        ).filter(
-            models.Vacancy.employer_id == current_user.org_id
-        ).offset(skip).limit(limit).all()
 
-    else:  # Student
-        return crud.get_user_applications(db, current_user.id)
+@application_router.get("/export")
+async def export_applications(
+        format: export.Format = export.Format.csv,
+        current_user: auth.Principal = Depends(auth.require_agent),
+):
+    """
+    Stream every application visible to the caller as CSV or NDJSON (agents and admins only),
+    with the applicant's name and the vacancy title joined in
+    """
+    query = select(
+        models.Application.id,
+        models.Application.vacancy_id,
+        models.Vacancy.title.label("vacancy_title"),
+        models.Application.user_id,
+        models.User.fname.label("applicant_fname"),
+        models.User.lname.label("applicant_lname"),
+        models.Application.title,
+        models.Application.content,
+    ).join(
+        models.Vacancy, models.Application.vacancy_id == models.Vacancy.id
+    ).join(
+        models.User, models.Application.user_id == models.User.id
+    ).filter(
+        policy.application_scope(current_user)
+    ).order_by(models.Application.id)
+
+    return StreamingResponse(
+        export.stream_rows(query, format),
+        media_type=export.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="applications.{format.value}"'},
+    )
 
 
 @application_router.get("/{application_id}", response_model=schemas.ApplicationDetailed)
-def get_application(
+async def get_application(
         application_id: int,
-        current_user: models.User = Depends(auth.get_current_user),
-        db: Session = Depends(get_db)
+        access: policy.Policy = Depends(policy.get_policy)
 ):
     """Get a specific application (with permission check)"""
-    db_application = crud.get_application(db, application_id)
-    if not db_application:
-        raise HTTPException(status_code=404, detail="Application not found")
-
-    # Check permissions
-    if current_user.role == Role.STUDENT and db_application.user_id != current_user.id:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized")
-
-    if current_user.role == Role.AGENT:
-        vacancy = db_application.vacancy
-        if vacancy.employer_id != current_user.org_id:
-            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized")
-
-    return db_application
+    return await access.get(models.Application, application_id, *crud.APPLICATION_DETAILED)
 
 
 @application_router.post("/", response_model=schemas.ApplicationResponse, status_code=status.HTTP_201_CREATED)
-def create_application(
+async def create_application(
         application: schemas.ApplicationCreate,
-        current_user: models.User = Depends(auth.get_current_user),
-        db: Session = Depends(get_db)
+        current_user: auth.Principal = Depends(auth.get_current_user),
+        db: AsyncSession = Depends(get_db)
 ):
     """Create an application (any authenticated user can apply)"""
     application_data = application.model_dump()
-    return crud.create_application(db, current_user.id, application_data)
+    return await crud.create_application(db, current_user.id, application_data)
 
 
 @application_router.patch("/{application_id}", response_model=schemas.ApplicationResponse)
-def update_application(
+async def update_application(
         application_id: int,
         application: schemas.ApplicationUpdate,
-        current_user: models.User = Depends(auth.get_current_user),
-        db: Session = Depends(get_db)
+        current_user: auth.Principal = Depends(auth.get_current_user),
+        db: AsyncSession = Depends(get_db)
 ):
     """Update an application (students for their own, admins for any)"""
-    db_application = crud.get_application(db, application_id)
+    db_application = await crud.get_application(db, application_id)
     if not db_application:
         raise HTTPException(status_code=404, detail="Application not found")
 
@@ -331,24 +559,24 @@ def update_application(
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to modify this application")
 
     update_data = application.model_dump(exclude_unset=True)
-    return crud.update_application(db, application_id, update_data)
+    return await crud.update_application(db, application_id, update_data)
 
 
 @application_router.delete("/{application_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_application(
+async def delete_application(
         application_id: int,
-        current_user: models.User = Depends(auth.get_current_user),
-        db: Session = Depends(get_db)
+        current_user: auth.Principal = Depends(auth.get_current_user),
+        db: AsyncSession = Depends(get_db)
 ):
     """Delete an application (students for their own, admins for any)"""
-    db_application = crud.get_application(db, application_id)
+    db_application = await crud.get_application(db, application_id)
     if not db_application:
         raise HTTPException(status_code=404, detail="Application not found")
 
     if not auth.can_modify_application(current_user, db_application):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to delete this application")
 
-    if not crud.delete_application(db, application_id):
+    if not await crud.delete_application(db, application_id):
         raise HTTPException(status_code=404, detail="Application not found")
 
 
@@ -357,107 +585,486 @@ app.include_router(application_router)
 organisation_router = APIRouter(prefix="/api/organisations", tags=["organisations"])
 
 
-@organisation_router.get("/", response_model=List[schemas.OrganisationResponse])
-def list_organisations(
+@organisation_router.get("/", response_model=List[schemas.OrganisationResponse],
+                         dependencies=[Depends(cache.conditional_get("organisations"))])
+async def list_organisations(
+        request: Request,
+        response: Response,
         skip: int = 0,
         limit: int = 100,
-        db: Session = Depends(get_db)
+        cursor: Optional[str] = None,
+        ids: Optional[List[int]] = Depends(pagination.batch_ids),
+        versions: Dict[str, int] = Depends(cache.get_versions),
+        db: AsyncSession = Depends(get_read_db)
 ):
-    """List all organisations (public endpoint)"""
-    return crud.get_organisations(db, skip=skip, limit=limit)
+    """List all organisations, or those in `ids` (public endpoint); page with `cursor` from X-Next-Cursor"""
+    key = cache.response_cache.key(request, "organisations", versions.get("organisations", 0))
+    cached = cache.response_cache.get(key)
+    if cached is not None:
+        return cached.to_response(response)
+
+    after = pagination.decode_cursor(cursor, int)
+    organisations = await crud.get_organisations(db, skip=skip, limit=limit, after_id=after[0] if after else None,
+                                                 ids=ids)
+    pagination.set_next_cursor(response, organisations, limit, pagination.id_key)
+    body = schemas.OrganisationList.dump_json(
+        schemas.OrganisationList.validate_python(organisations, from_attributes=True)
+    )
+    entry = cache.response_cache.set(key, body, response, headers=(pagination.NEXT_CURSOR_HEADER,))
+    return entry.to_response(response, "MISS")
 
 
-@organisation_router.get("/{org_id}", response_model=schemas.OrganisationDetailed)
-def get_organisation(org_id: int, db: Session = Depends(get_db)):
+@organisation_router.get("/{org_id}", response_model=schemas.OrganisationDetailed,
+                         dependencies=[Depends(cache.conditional_get("organisations", "vacancies", "users"))])
+async def get_organisation(org_id: int, db: AsyncSession = Depends(get_read_db)):
     """Get a specific organisation (public endpoint)"""
-    db_org = crud.get_organisation(db, org_id)
+    db_org = await crud.get_organisation(db, org_id, *crud.ORGANISATION_DETAILED)
     if not db_org:
         raise HTTPException(status_code=404, detail="Organisation not found")
     return db_org
 
 
+@organisation_router.get("/{org_id}/stats", response_model=schemas.OrganisationStats)
+async def get_organisation_stats(
+        org_id: int,
+        current_user: auth.Principal = Depends(auth.require_agent),
+        db: AsyncSession = Depends(get_read_db)
+):
+    """Application and bookmark counts per vacancy and in total (agents for their own org, admins for any)"""
+    if not auth.can_modify_organisation(current_user, org_id):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized")
+    if not await crud.get_organisation(db, org_id):
+        raise HTTPException(status_code=404, detail="Organisation not found")
+
+    vacancies = [vacancy_stats(row) for row in await crud.get_vacancy_stats(db, employer_id=org_id)]
+    return {
+        "organisation_id": org_id,
+        "vacancy_count": len(vacancies),
+        "application_count": sum(vacancy["application_count"] for vacancy in vacancies),
+        "bookmark_count": sum(vacancy["bookmark_count"] for vacancy in vacancies),
+        "vacancies": vacancies,
+    }
+
+
 @organisation_router.post("/", response_model=schemas.OrganisationResponse, status_code=status.HTTP_201_CREATED)
-def create_organisation(
+async def create_organisation(
         organisation: schemas.OrganisationCreate,
-        current_user: models.User = Depends(auth.require_admin),
-        db: Session = Depends(get_db)
+        current_user: auth.Principal = Depends(auth.require_admin),
+        db: AsyncSession = Depends(get_db)
 ):
     """Create an organisation (admin only)"""
     org_data = organisation.model_dump()
-    return crud.create_organisation(db, org_data)
+    return await crud.create_organisation(db, org_data)
+
+
+@organisation_router.post("/bulk")
+async def bulk_create_organisations(
+        request: Request,
+        current_user: auth.Principal = Depends(auth.require_admin),
+        db: AsyncSession = Depends(get_db)
+):
+    """
+    Create organisations from an NDJSON body, one OrganisationCreate object per line (admin only).
+    Responds with NDJSON holding the new id or the error for every input line.
+    """
+    ingest = bulk.BulkIngest(db, schemas.OrganisationCreate, models.Organisation)
+    await ingest.run(bulk.iter_ndjson_lines(request))
+    return ingest.response()
 
 
 @organisation_router.patch("/{org_id}", response_model=schemas.OrganisationResponse)
-def update_organisation(
+async def update_organisation(
         org_id: int,
         organisation: schemas.OrganisationUpdate,
-        current_user: models.User = Depends(auth.require_agent),
-        db: Session = Depends(get_db)
+        current_user: auth.Principal = Depends(auth.require_agent),
+        db: AsyncSession = Depends(get_db)
 ):
     """Update an organisation (agents for their own, admins for any)"""
     if not auth.can_modify_organisation(current_user, org_id):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to modify this organisation")
 
     update_data = organisation.model_dump(exclude_unset=True)
-    db_org = crud.update_organisation(db, org_id, update_data)
+    db_org = await crud.update_organisation(db, org_id, update_data)
     if not db_org:
         raise HTTPException(status_code=404, detail="Organisation not found")
     return db_org
 
 
 @organisation_router.delete("/{org_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_organisation(
+async def delete_organisation(
         org_id: int,
-        current_user: models.User = Depends(auth.require_admin),
-        db: Session = Depends(get_db)
+        current_user: auth.Principal = Depends(auth.require_admin),
+        db: AsyncSession = Depends(get_db)
 ):
     """Delete an organisation (admin only)"""
-    if not crud.delete_organisation(db, org_id):
+    if not await crud.delete_organisation(db, org_id):
         raise HTTPException(status_code=404, detail="Organisation not found")
 
 
 app.include_router(organisation_router)
 
 
+bookmark_router = APIRouter(prefix="/api/bookmarks", tags=["bookmarks"])
+
+
+@bookmark_router.get("/", response_model=List[schemas.BookmarkDetailed])
+async def list_bookmarks(
+        response: Response,
+        limit: int = Query(100, ge=1, le=500),
+        cursor: Optional[str] = None,
+        current_user: auth.Principal = Depends(auth.get_current_user),
+        db: AsyncSession = Depends(get_read_db)
+):
+    """The current user's bookmarks with their vacancies; page with `cursor` from X-Next-Cursor"""
+    after = pagination.decode_cursor(cursor, int)
+    bookmarks = await crud.get_user_bookmarks(db, current_user.id, *crud.BOOKMARK_DETAILED, limit=limit,
+                                              after_vacancy_id=after[0] if after else None)
+    return pagination.set_next_cursor(response, bookmarks, limit, lambda bookmark: (bookmark.vacancy_id,))
+
+
+@bookmark_router.get("/ids", response_model=List[int])
+async def list_bookmarked_ids(
+        current_user: auth.Principal = Depends(auth.get_current_user),
+        db: AsyncSession = Depends(get_read_db)
+):
+    """Ids of every vacancy the current user has bookmarked"""
+    return sorted(await crud.get_bookmarked_ids(db, current_user.id))
+
+
+@bookmark_router.post("/", response_model=schemas.BookmarkResponse, status_code=status.HTTP_201_CREATED)
+async def create_bookmark(
+        bookmark: schemas.BookmarkCreate,
+        current_user: auth.Principal = Depends(auth.get_current_user),
+        db: AsyncSession = Depends(get_db)
+):
+    """Bookmark a vacancy (idempotent)"""
+    if not await crud.get_vacancy(db, bookmark.vacancy_id):
+        raise HTTPException(status_code=404, detail="Vacancy not found")
+    return await crud.create_bookmark(db, current_user.id, bookmark.vacancy_id)
+
+
+@bookmark_router.post("/batch", response_model=schemas.BookmarkBatchResult)
+async def update_bookmarks(
+        batch: schemas.BookmarkBatch,
+        current_user: auth.Principal = Depends(auth.get_current_user),
+        db: AsyncSession = Depends(get_db)
+):
+    """Remove and add many bookmarks in one transaction; removals are applied first"""
+    added, removed, missing = await crud.update_bookmarks(db, current_user.id, batch.add, batch.remove)
+    return {"added": added, "removed": removed, "missing": missing}
+
+
+@bookmark_router.delete("/{vacancy_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_bookmark(
+        vacancy_id: int,
+        current_user: auth.Principal = Depends(auth.get_current_user),
+        db: AsyncSession = Depends(get_db)
+):
+    """Remove a bookmark"""
+    if not await crud.delete_bookmark(db, current_user.id, vacancy_id):
+        raise HTTPException(status_code=404, detail="Bookmark not found")
+
+
+app.include_router(bookmark_router)
+
+
+message_router = APIRouter(prefix="/api/messages", tags=["messages"])
+
+
+def publish_message(event: str, db_message: models.Message) -> None:
+    """Push a message event to both parties' open streams"""
+    data = schemas.MessageResponse.model_validate(db_message).model_dump_json()
+    for user_id in {db_message.sender_id, db_message.recipient_id}:
+        pubsub.hub.publish(user_id, event, data)
+
+
+@message_router.get("/inbox", response_model=List[schemas.MessageResponse])
+async def list_inbox(
+        response: Response,
+        limit: int = Query(50, ge=1, le=200),
+        cursor: Optional[str] = None,
+        current_user: auth.Principal = Depends(auth.get_current_user),
+        db: AsyncSession = Depends(get_read_db)
+):
+    """Messages sent to the current user, newest first; page with `cursor` from X-Next-Cursor"""
+    before = pagination.decode_cursor(cursor, int)
+    messages = await crud.get_user_messages(db, current_user.id, sent=False, limit=limit,
+                                            before_id=before[0] if before else None)
+    return pagination.set_next_cursor(response, messages, limit, pagination.id_key)
+
+
+@message_router.get("/outbox", response_model=List[schemas.MessageResponse])
+async def list_outbox(
+        response: Response,
+        limit: int = Query(50, ge=1, le=200),
+        cursor: Optional[str] = None,
+        current_user: auth.Principal = Depends(auth.get_current_user),
+        db: AsyncSession = Depends(get_read_db)
+):
+    """Messages sent by the current user, newest first; page with `cursor` from X-Next-Cursor"""
+    before = pagination.decode_cursor(cursor, int)
+    messages = await crud.get_user_messages(db, current_user.id, sent=True, limit=limit,
+                                            before_id=before[0] if before else None)
+    return pagination.set_next_cursor(response, messages, limit, pagination.id_key)
+
+
+@message_router.get("/stream")
+async def stream_messages(
+        request: Request,
+        current_user: auth.Principal = Depends(auth.get_current_user)
+):
+    """
+    Server-Sent Events feed of the current user's messages as they are created (`message.created`),
+    edited (`message.updated`) or deleted (`message.deleted`). A `lagged` event means some were
+    dropped and the inbox should be refetched.
+    """
+    return StreamingResponse(
+        pubsub.event_stream(request, current_user.id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@message_router.get("/conversations", response_model=List[schemas.ConversationResponse])
+async def list_conversations(
+        response: Response,
+        limit: int = Query(50, ge=1, le=200),
+        cursor: Optional[str] = None,
+        current_user: auth.Principal = Depends(auth.get_current_user),
+        db: AsyncSession = Depends(get_read_db)
+):
+    """
+    The current user's conversations, most recent first, each with the peer, the last message
+    and the number of unread messages; page with `cursor` from X-Next-Cursor
+    """
+    before = pagination.decode_cursor(cursor, datetime.fromisoformat, int)
+    conversations = await crud.get_conversations(db, current_user.id, limit=limit, before=before)
+    return pagination.set_next_cursor(response, conversations, limit, pagination.conversation_key)
+
+
+@message_router.post("/conversations/{peer_id}/read", response_model=schemas.ConversationResponse)
+async def mark_conversation_read(
+        peer_id: int,
+        current_user: auth.Principal = Depends(auth.get_current_user),
+        db: AsyncSession = Depends(get_db)
+):
+    """Mark every message in the conversation with `peer_id` as read"""
+    conversation = await crud.mark_conversation_read(db, current_user.id, peer_id)
+    if not conversation:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return conversation
+
+
+@message_router.get("/{message_id}", response_model=schemas.MessageDetailed)
+async def get_message(
+        message_id: int,
+        access: policy.Policy = Depends(policy.get_policy)
+):
+    """Get a message (its sender, its recipient or an admin)"""
+    return await access.get(models.Message, message_id, *crud.MESSAGE_DETAILED)
+
+
+@message_router.post("/", response_model=schemas.MessageResponse, status_code=status.HTTP_201_CREATED)
+async def send_message(
+        message: schemas.MessageCreate,
+        current_user: auth.Principal = Depends(auth.get_current_user),
+        db: AsyncSession = Depends(get_db)
+):
+    """Send a message to another user (any authenticated user)"""
+    if not await crud.get_user(db, message.recipient_id):
+        raise HTTPException(status_code=404, detail="Recipient not found")
+
+    db_message = await crud.create_message(db, current_user.id, message.model_dump())
+    publish_message("message.created", db_message)
+    return db_message
+
+
+@message_router.patch("/{message_id}", response_model=schemas.MessageResponse)
+async def update_message(
+        message_id: int,
+        message: schemas.MessageUpdate,
+        current_user: auth.Principal = Depends(auth.get_current_user),
+        db: AsyncSession = Depends(get_db)
+):
+    """Edit a message (its sender only)"""
+    db_message = await crud.get_message(db, message_id)
+    if not db_message:
+        raise HTTPException(status_code=404, detail="Message not found")
+
+    if db_message.sender_id != current_user.id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to modify this message")
+
+    if message.content is None:
+        return db_message
+    db_message = await crud.update_message(db, message_id, message.content)
+    publish_message("message.updated", db_message)
+    return db_message
+
+
+@message_router.delete("/{message_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_message(
+        message_id: int,
+        current_user: auth.Principal = Depends(auth.get_current_user),
+        db: AsyncSession = Depends(get_db)
+):
+    """Delete a message (its sender or an admin)"""
+    db_message = await crud.get_message(db, message_id)
+    if not db_message:
+        raise HTTPException(status_code=404, detail="Message not found")
+
+    if current_user.role != Role.ADMIN and db_message.sender_id != current_user.id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to delete this message")
+
+    if not await crud.delete_message(db, message_id):
+        raise HTTPException(status_code=404, detail="Message not found")
+    publish_message("message.deleted", db_message)
+
+
+app.include_router(message_router)
+
+
 media_router = APIRouter(prefix="/api/media", tags=["media"])
 
 
+@media_router.get("/", response_model=List[schemas.MediaResponse])
+async def list_media(
+    ids: Optional[List[int]] = Depends(pagination.batch_ids),
+    current_user: auth.Principal = Depends(auth.get_current_user),
+    loader: dataloader.Loader = Depends(dataloader.get_loader)
+):
+    """Get several media records by `ids` in one request (authenticated users only)"""
+    if ids is None:
+        raise HTTPException(status_code=400, detail="ids is required")
+    return await loader.load_many(models.Media, ids)
+
+
 @media_router.get("/{media_id}", response_model=schemas.MediaResponse)
-def get_media(
+async def get_media(
     media_id: int,
-    current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    current_user: auth.Principal = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Get media info (authenticated users only)"""
-    db_media = crud.get_media(db, media_id)
+    db_media = await crud.get_media(db, media_id)
     if not db_media:
         raise HTTPException(status_code=404, detail="Media not found")
     return db_media
 
 
+@media_router.api_route("/{media_id}/content", methods=["GET", "HEAD"], response_class=FileResponse)
+async def get_media_content(
+    media_id: int,
+    request: Request,
+    current_user: auth.Principal = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Download uploaded content (authenticated users only); supports Range and If-None-Match"""
+    db_media = await crud.get_media(db, media_id)
+    if not db_media or not db_media.sha256 or not await asyncio.to_thread(
+            os.path.exists, storage.blob_path(db_media.sha256)):
+        raise HTTPException(status_code=404, detail="Media content not found")
+
+    # Content never changes under a hash, so the hash is a strong validator
+    headers = {"ETag": f'"{db_media.sha256}"', "Cache-Control": "private, max-age=31536000, immutable",
+               "X-Content-Type-Options": "nosniff"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and cache.etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return FileResponse(
+        storage.blob_path(db_media.sha256),
+        media_type=db_media.content_type or "application/octet-stream",
+        filename=db_media.name,
+        headers=headers,
+    )
+
+
+@media_router.post("/upload", response_model=schemas.MediaResponse, status_code=status.HTTP_201_CREATED)
+async def upload_media_content(
+    request: Request,
+    name: Optional[str] = None,
+    current_user: auth.Principal = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Upload a file (any authenticated user), either as multipart/form-data with a `file` field or
+    as the raw request body with its Content-Type and a `name` query parameter. The body is
+    written to disk in chunks as it arrives; identical content is stored only once.
+    Thumbnails of images are generated in the background after the response.
+    """
+    storage.check_content_length(request)
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        upload = {}
+        blob = await storage.receive(storage.iter_form_file(request, upload))
+        name = name or upload["filename"]
+        content_type = upload["content_type"]
+    else:
+        blob = await storage.receive(request.stream())
+        content_type = request.headers.get("content-type")
+
+    db_media = await crud.create_stored_media(db, blob, name or blob.sha256, content_type)
+    if db_media.placeholder is None and thumbnails.is_image(content_type):
+        thumbnails.pool.schedule(db_media.sha256)
+    return db_media
+
+
+@media_router.get("/{media_id}/thumb/{size}", response_class=FileResponse)
+async def get_media_thumbnail(
+    media_id: int,
+    size: int,
+    request: Request,
+    current_user: auth.Principal = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Thumbnail of an uploaded image fitted into a size x size box (authenticated users only)"""
+    if size not in thumbnails.THUMB_SIZES:
+        raise HTTPException(status_code=404, detail=f"Thumbnail sizes are {', '.join(map(str, thumbnails.THUMB_SIZES))}")
+    db_media = await crud.get_media(db, media_id)
+    if not db_media or not db_media.sha256 or not thumbnails.is_image(db_media.content_type):
+        raise HTTPException(status_code=404, detail="Thumbnail not found")
+
+    headers = {"ETag": f'"{db_media.sha256}-{size}"', "Cache-Control": "private, max-age=31536000, immutable",
+               "X-Content-Type-Options": "nosniff"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and cache.etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    path = thumbnails.thumb_path(db_media.sha256, size)
+    # Not generated yet (upload job still queued, or dropped): render now, joining any running job
+    if not await asyncio.to_thread(os.path.exists, path) and await thumbnails.pool.ensure(db_media.sha256) is None:
+        raise HTTPException(status_code=404, detail="Thumbnail not found")
+    return FileResponse(path, media_type=thumbnails.THUMB_MEDIA_TYPE, headers=headers)
+
+
 @media_router.post("/", response_model=schemas.MediaResponse, status_code=status.HTTP_201_CREATED)
-def upload_media(
+async def upload_media(
     media: schemas.MediaCreate,
-    current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    current_user: auth.Principal = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    """Upload media (any authenticated user)"""
+    """Create a media record without content (any authenticated user); POST /upload stores a file"""
     media_data = media.model_dump()
-    return crud.create_media(db, media_data)
+    return await crud.create_media(db, media_data)
 
 
 @media_router.delete("/{media_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_media(
+async def delete_media(
     media_id: int,
-    current_user: models.User = Depends(auth.require_admin),
-    db: Session = Depends(get_db)
+    current_user: auth.Principal = Depends(auth.require_admin),
+    db: AsyncSession = Depends(get_db)
 ):
     """Delete media (admin only)"""
-    if not crud.delete_media(db, media_id):
+    if not await crud.delete_media(db, media_id):
         raise HTTPException(status_code=404, detail="Media not found")
 
 
 app.include_router(media_router)
 
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics():
+    """Prometheus scrape endpoint"""
+    return PlainTextResponse(metrics.metrics.render(), media_type="text/plain; version=0.0.4")
+
 if __name__ == '__main__':
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,48 @@
+import argparse
+import asyncio
+import crud
+import migrations
+import models
+
+
+async def migrate(args):
+    async with models.async_engine.begin() as connection:
+        version = await connection.run_sync(migrations.upgrade)
+    print(f"Database schema is at version {version}")
+
+
+async def rebuild_search(args):
+    async with models.AsyncSessionLocal() as db:
+        await crud.rebuild_vacancy_index(db)
+    print("Vacancy search index rebuilt")
+
+
+async def rebuild_conversations(args):
+    async with models.AsyncSessionLocal() as db:
+        await crud.rebuild_conversations(db)
+    print("Conversation summaries rebuilt")
+
+
+async def repair_counters(args):
+    async with models.AsyncSessionLocal() as db:
+        repaired = await crud.repair_vacancy_counters(db)
+    print(f"Vacancy counters recomputed; {repaired} vacancies were out of date")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("migrate", help="Apply pending schema migrations").set_defaults(func=migrate)
+    subparsers.add_parser("rebuild-search", help="Rebuild the vacancy full-text index").set_defaults(func=rebuild_search)
+    subparsers.add_parser("rebuild-conversations",
+                          help="Recompute conversation summaries from messages").set_defaults(func=rebuild_conversations)
+    subparsers.add_parser("repair-counters",
+                          help="Recompute vacancy application and bookmark counters").set_defaults(func=repair_counters)
+
+    args = parser.parse_args()
+    asyncio.run(args.func(args))
+
+
+if __name__ == '__main__':
+    main()
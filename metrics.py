@@ -0,0 +1,154 @@
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds in seconds; the implicit +Inf bucket catches the rest
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UNMATCHED_ROUTE = "unmatched"
+
+# [query count, query seconds] of the request being handled, if any
+_request_queries: ContextVar[Optional[list]] = ContextVar("request_queries", default=None)
+
+
+class RouteMetrics:
+    __slots__ = ("buckets", "count", "total", "statuses", "queries", "query_seconds")
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.statuses: Dict[int, int] = defaultdict(int)
+        self.queries = 0
+        self.query_seconds = 0.0
+
+
+class Metrics:
+    """Process-local request and query metrics, rendered in Prometheus text format"""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.routes: Dict[Tuple[str, str], RouteMetrics] = defaultdict(RouteMetrics)
+        self._collectors: List[Callable[[], Dict[str, float]]] = []
+
+    def observe(self, method: str, route: str, status: int, seconds: float, queries: list) -> None:
+        metrics = self.routes[method, route]
+        metrics.buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        metrics.count += 1
+        metrics.total += seconds
+        metrics.statuses[status] += 1
+        metrics.queries += queries[0]
+        metrics.query_seconds += queries[1]
+
+    def register_collector(self, collector: Callable[[], Dict[str, float]]) -> None:
+        """Add a callable returning {metric name: value}, exported as gauges on each scrape"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = [
+            "# HELP http_requests_in_flight Requests currently being handled",
+            "# TYPE http_requests_in_flight gauge",
+            f"http_requests_in_flight {self.in_flight}",
+            "# HELP http_request_duration_seconds Request latency by route template",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        routes = sorted(self.routes.items())
+        for (method, route), metrics in routes:
+            labels = f'method="{method}",route="{_escape(route)}"'
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, metrics.buckets):
+                cumulative += count
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {metrics.count}')
+            lines.append(f"http_request_duration_seconds_sum{{{labels}}} {metrics.total}")
+            lines.append(f"http_request_duration_seconds_count{{{labels}}} {metrics.count}")
+
+        lines += ["# HELP http_requests_total Responses by route template and status",
+                  "# TYPE http_requests_total counter"]
+        for (method, route), metrics in routes:
+            for status, count in sorted(metrics.statuses.items()):
+                lines.append(f'http_requests_total{{method="{method}",route="{_escape(route)}",status="{status}"}} {count}')
+
+        lines += ["# HELP db_queries_total SQL statements executed while handling the route",
+                  "# TYPE db_queries_total counter"]
+        for (method, route), metrics in routes:
+            lines.append(f'db_queries_total{{method="{method}",route="{_escape(route)}"}} {metrics.queries}')
+        lines += ["# HELP db_query_duration_seconds_total Time spent in SQL statements for the route",
+                  "# TYPE db_query_duration_seconds_total counter"]
+        for (method, route), metrics in routes:
+            lines.append(f'db_query_duration_seconds_total{{method="{method}",route="{_escape(route)}"}} '
+                         f'{metrics.query_seconds}')
+
+        for collector in self._collectors:
+            for name, value in collector().items():
+                lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+metrics = Metrics()
+
+
+# ===== SQL Instrumentation =====
+
+# The start time lives on the statement's execution context rather than the pooled
+# connection, so a statement that raises (and never reaches after_cursor_execute) leaves
+# nothing behind.
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = context._query_started
+    queries = _request_queries.get()
+    if queries is not None:
+        queries[0] += 1
+        queries[1] += time.perf_counter() - started
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Attribute statement counts and time on `engine` (a sync engine) to the current request"""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+# ===== ASGI Middleware =====
+
+class MetricsMiddleware:
+    """Plain ASGI middleware (no BaseHTTPMiddleware task overhead) timing every HTTP request"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        queries = [0, 0.0]
+        token = _request_queries.set(queries)
+        metrics.in_flight += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.in_flight -= 1
+            _request_queries.reset(token)
+            route = scope.get("route")
+            metrics.observe(scope["method"], getattr(route, "path", UNMATCHED_ROUTE), status, elapsed, queries)
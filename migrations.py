@@ -0,0 +1,141 @@
+from typing import Callable, List
+from sqlalchemy import inspect
+from sqlalchemy.engine import Connection
+import models
+
+
+# ===== Migrations =====
+# Schema changes are applied in order and tracked in SQLite's PRAGMA user_version:
+# a database at version N has had the first N migrations applied. Fresh databases get
+# the current models via create_all and are stamped with the latest version directly.
+
+def _initial_schema(connection: Connection) -> None:
+    """Databases from before migrations existed: create missing tables and the search index"""
+    models.Base.metadata.create_all(connection)
+    for statement in models.VACANCY_FTS_DDL:
+        connection.exec_driver_sql(statement)
+    connection.exec_driver_sql("INSERT INTO vacancies_fts(vacancies_fts) VALUES ('rebuild')")
+
+
+def _hot_path_indexes(connection: Connection) -> None:
+    """Composite indexes for application, vacancy, message and bookmark lookups"""
+    for table in (models.Application, models.Vacancy, models.Message, models.Bookmark, models.User):
+        for index in table.__table__.indexes:
+            index.create(connection, checkfirst=True)
+    connection.exec_driver_sql("PRAGMA optimize")
+
+
+def _mailbox_indexes(connection: Connection) -> None:
+    """(owner, id) indexes so inbox and outbox pages come out of the index already ordered"""
+    for index in models.Message.__table__.indexes:
+        index.create(connection, checkfirst=True)
+
+
+def _conversations(connection: Connection) -> None:
+    """Per-pair conversation summaries, backfilled from existing messages"""
+    models.Conversation.__table__.create(connection, checkfirst=True)
+    for index in models.Conversation.__table__.indexes:
+        index.create(connection, checkfirst=True)
+    for statement in models.CONVERSATIONS_REBUILD:
+        connection.exec_driver_sql(statement)
+
+
+def _vacancy_filter_indexes(connection: Connection) -> None:
+    """Indexes behind the status / required_year / salary filters and the salary sort"""
+    for index in models.Vacancy.__table__.indexes:
+        index.create(connection, checkfirst=True)
+    connection.exec_driver_sql("PRAGMA optimize")
+
+
+def _vacancy_counters(connection: Connection) -> None:
+    """Trigger-maintained application and bookmark counters on vacancies"""
+    columns = {column["name"] for column in inspect(connection).get_columns(models.Vacancy.__tablename__)}
+    for name in ("application_count", "bookmark_count"):
+        if name not in columns:
+            connection.exec_driver_sql(f"ALTER TABLE vacancies ADD COLUMN {name} INTEGER NOT NULL DEFAULT 0")
+    for statements in models.VACANCY_COUNTER_DDL.values():
+        for statement in statements:
+            connection.exec_driver_sql(statement)
+    connection.exec_driver_sql(models.VACANCY_COUNTERS_REPAIR)
+
+
+def _org_applicants(connection: Connection) -> None:
+    """Per-organisation applicant index behind the agents' user list"""
+    models.OrgApplicant.__table__.create(connection, checkfirst=True)
+    for statement in models.ORG_APPLICANTS_DDL:
+        connection.exec_driver_sql(statement)
+    connection.exec_driver_sql(models.ORG_APPLICANTS_REBUILD)
+
+
+def _media_content(connection: Connection) -> None:
+    """Size, hash and content type of uploaded media"""
+    columns = {column["name"] for column in inspect(connection).get_columns(models.Media.__tablename__)}
+    for name, ddl in (("size", "INTEGER"), ("sha256", "VARCHAR(64)"), ("content_type", "VARCHAR")):
+        if name not in columns:
+            connection.exec_driver_sql(f"ALTER TABLE media ADD COLUMN {name} {ddl}")
+    for index in models.Media.__table__.indexes:
+        index.create(connection, checkfirst=True)
+
+
+def _media_placeholder(connection: Connection) -> None:
+    """Placeholder hash of image media"""
+    columns = {column["name"] for column in inspect(connection).get_columns(models.Media.__tablename__)}
+    if "placeholder" not in columns:
+        connection.exec_driver_sql("ALTER TABLE media ADD COLUMN placeholder VARCHAR")
+
+
+def _table_versions(connection: Connection) -> None:
+    """Trigger-maintained per-table versions behind the ETags"""
+    models.TableVersion.__table__.create(connection, checkfirst=True)
+    for statement in models.TABLE_VERSION_DDL:
+        connection.exec_driver_sql(statement)
+
+
+def _vacancy_scope_versions(connection: Connection) -> None:
+    """Per-employer vacancy versions behind the employer-filtered list cache"""
+    for statement in models.SCOPED_VERSION_DDL['vacancies']:
+        connection.exec_driver_sql(statement)
+
+
+def _bookmark_user_versions(connection: Connection) -> None:
+    """Per-user bookmark versions behind the cached bookmark sets and is_bookmarked ETags"""
+    for statement in models.SCOPED_VERSION_DDL['bookmarks']:
+        connection.exec_driver_sql(statement)
+
+
+MIGRATIONS: List[Callable[[Connection], None]] = [
+    _initial_schema,
+    _hot_path_indexes,
+    _mailbox_indexes,
+    _conversations,
+    _vacancy_filter_indexes,
+    _vacancy_counters,
+    _org_applicants,
+    _media_content,
+    _media_placeholder,
+    _table_versions,
+    _vacancy_scope_versions,
+    _bookmark_user_versions,
+]
+
+
+def get_version(connection: Connection) -> int:
+    return connection.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def _set_version(connection: Connection, version: int) -> None:
+    connection.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+
+
+def upgrade(connection: Connection) -> int:
+    """Bring the database up to date; returns the resulting schema version"""
+    version = get_version(connection)
+    if version == 0 and not inspect(connection).has_table(models.User.__tablename__):
+        models.Base.metadata.create_all(connection)
+        _set_version(connection, len(MIGRATIONS))
+        return len(MIGRATIONS)
+
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        migration(connection)
+        _set_version(connection, number)
+    return get_version(connection)
@@ -1,27 +1,73 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey, Boolean, Text, event
+from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey, Text, DDL, Index, event
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import relationship
+from sqlalchemy.sql import table, column
 from datetime import datetime
-
-DATABASE_URL = 'sqlite:///./database.db'
+import os
+
+DATABASE_PATH = os.environ.get('DATABASE_PATH', './database.db')
+DATABASE_URL = f'sqlite:///{DATABASE_PATH}'
+ASYNC_DATABASE_URL = f'sqlite+aiosqlite:///{DATABASE_PATH}'
+
+# ===== SQLite Profiles =====
+# SQLITE_PROFILE=production (default) runs in WAL mode so readers never wait behind the writer;
+# SQLITE_PROFILE=safe keeps SQLite's rollback journal and full fsyncs.
+
+SQLITE_PROFILES = {
+    'production': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'cache_size': -64000,         # KiB, i.e. 64 MB per connection
+        'mmap_size': 268435456,       # 256 MB
+        'temp_store': 'MEMORY',
+    },
+    'safe': {
+        'busy_timeout': 5000,
+    },
+}
+SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', 'production')
+SQLITE_PRAGMAS = SQLITE_PROFILES[SQLITE_PROFILE]
+READ_POOL_SIZE = int(os.environ.get('READ_POOL_SIZE', '8'))
+
+# The sync engine is only used for schema management. Requests go through the async engines:
+# async_engine for anything that writes, read_engine (query_only connections) for GET handlers.
 engine = create_engine(DATABASE_URL, connect_args={'check_same_thread': False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine(ASYNC_DATABASE_URL)
+read_engine = create_async_engine(ASYNC_DATABASE_URL, pool_size=READ_POOL_SIZE, max_overflow=READ_POOL_SIZE)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+ReadSessionLocal = async_sessionmaker(read_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 
 @event.listens_for(engine, "connect")
+@event.listens_for(async_engine.sync_engine, "connect")
+@event.listens_for(read_engine.sync_engine, "connect")
 def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
     cursor = dbapi_connection.cursor()
     cursor.execute("PRAGMA foreign_keys=ON")
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+@event.listens_for(read_engine.sync_engine, "connect")
+def make_connection_read_only(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA query_only=ON")
     cursor.close()
 
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def get_read_db():
+    """Session on the read-only pool, for handlers that never write"""
+    async with ReadSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 class User(Base):
     __tablename__ = "users"
@@ -32,7 +78,7 @@ class User(Base):
     pname = Column(String, nullable=True)
     email = Column(String, unique=True, index=True)
     password = Column(String)
-    role = Column(Boolean)
+    role = Column(Integer)
     icon_id = Column(Integer, ForeignKey('media.id', ondelete='SET NULL'), nullable=True)
     registred = Column(DateTime, default=datetime.utcnow)
     org_id = Column(Integer, ForeignKey('organisations.id', ondelete='SET NULL'), nullable=True)
@@ -45,6 +91,10 @@ class User(Base):
     icon = relationship('Media', foreign_keys=[icon_id])
     organisation = relationship('Organisation', foreign_keys=[org_id], back_populates='members')
 
+    __table_args__ = (
+        Index('ix_users_org_id', 'org_id'),
+    )
+
 
 class Vacancy(Base):
     __tablename__ = "vacancies"
@@ -58,8 +108,11 @@ class Vacancy(Base):
     salary_top = Column(Float, nullable=True)
     salary_bottom = Column(Float, nullable=True)
     required_year = Column(Integer, nullable=True)
-    created = Column(DateTime, default=datetime.utcnow)
+    created = Column(DateTime, default=datetime.utcnow, index=True)
     status = Column(Integer)
+    # Maintained by the triggers in VACANCY_COUNTER_DDL
+    application_count = Column(Integer, nullable=False, default=0, server_default='0')
+    bookmark_count = Column(Integer, nullable=False, default=0, server_default='0')
 
     # Relationships
     employer = relationship('Organisation', back_populates='vacancies')
@@ -68,6 +121,14 @@ class Vacancy(Base):
     applications = relationship('Application', back_populates='vacancy', cascade='all, delete-orphan')
     icon = relationship('Media', foreign_keys=[icon_id])
 
+    __table_args__ = (
+        Index('ix_vacancies_employer_created', 'employer_id', 'created'),
+        Index('ix_vacancies_status_created', 'status', 'created'),
+        Index('ix_vacancies_required_year', 'required_year'),
+        Index('ix_vacancies_salary_bottom', 'salary_bottom'),
+        Index('ix_vacancies_salary_top', 'salary_top'),
+    )
+
 class Organisation(Base):
     __tablename__ = 'organisations'
 
@@ -88,6 +149,12 @@ class Media(Base):
     name = Column(String)
     path = Column(String)
     added = Column(DateTime, default=datetime.utcnow)
+    # Stored content (see storage.py); NULL for records created before uploads existed
+    size = Column(Integer, nullable=True)
+    sha256 = Column(String(64), nullable=True, index=True)
+    content_type = Column(String, nullable=True)
+    # BlurHash of image content, filled in by thumbnails.py once the derivatives exist
+    placeholder = Column(String, nullable=True)
 
     message_media = relationship('MessageMedia', back_populates='media', cascade='all, delete-orphan')
     vacancy_media = relationship('VacancyMedia', back_populates='media', cascade='all, delete-orphan')
@@ -108,6 +175,13 @@ class Message(Base):
     recipient = relationship('User', foreign_keys=[recipient_id], back_populates='received_messages')
     message_media = relationship('MessageMedia', back_populates='message', cascade='all, delete-orphan')
 
+    __table_args__ = (
+        Index('ix_messages_sender_recipient', 'sender_id', 'recipient_id'),
+        Index('ix_messages_recipient_sender', 'recipient_id', 'sender_id'),
+        Index('ix_messages_recipient_id', 'recipient_id', 'id'),
+        Index('ix_messages_sender_id', 'sender_id', 'id'),
+    )
+
 
 class Bookmark(Base):
     __tablename__ = 'bookmarks'
@@ -118,6 +192,33 @@ class Bookmark(Base):
     user = relationship('User', back_populates='bookmarks')
     vacancy = relationship('Vacancy', back_populates='bookmarks')
 
+    __table_args__ = (
+        Index('ix_bookmarks_user_vacancy', 'user_id', 'vacancy_id'),
+    )
+
+
+class Conversation(Base):
+    """
+    One row per (user, peer) pair that has exchanged messages, maintained by the message CRUD
+    functions so the conversation list never has to scan the mailbox. unread_count counts the
+    peer's messages with an id above last_read_id.
+    """
+    __tablename__ = 'conversations'
+
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    peer_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    last_message_id = Column(Integer, ForeignKey('messages.id', ondelete='SET NULL'), nullable=True)
+    last_sent = Column(DateTime)
+    last_read_id = Column(Integer, default=0)
+    unread_count = Column(Integer, default=0)
+
+    peer = relationship('User', foreign_keys=[peer_id])
+    last_message = relationship('Message', foreign_keys=[last_message_id])
+
+    __table_args__ = (
+        Index('ix_conversations_user_last_sent', 'user_id', 'last_sent', 'peer_id'),
+    )
+
 
 class MessageMedia(Base):
     __tablename__ = 'messagemedia'
@@ -152,6 +253,20 @@ class Application(Base):
     vacancy = relationship('Vacancy', foreign_keys=[vacancy_id], back_populates='applications')
     application_media = relationship('ApplicationMedia', back_populates='application')
 
+    __table_args__ = (
+        Index('ix_applications_user_vacancy', 'user_id', 'vacancy_id'),
+        Index('ix_applications_vacancy_user', 'vacancy_id', 'user_id'),
+    )
+
+
+class OrgApplicant(Base):
+    """Users with at least one application to an organisation's vacancies; maintained by ORG_APPLICANTS_DDL"""
+    __tablename__ = 'org_applicants'
+
+    org_id = Column(Integer, ForeignKey('organisations.id', ondelete='CASCADE'), primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    first_applied = Column(DateTime, default=datetime.utcnow)
+
 
 class ApplicationMedia(Base):
     __tablename__ = 'applicationmedia'
@@ -163,5 +278,237 @@ class ApplicationMedia(Base):
     application = relationship('Application', back_populates='application_media')
 
 
-Base.metadata.drop_all(bind=engine)
-Base.metadata.create_all(bind=engine)
+# ===== Full-text search =====
+# vacancies_fts is an external-content FTS5 index over vacancies. The triggers
+# keep it in sync with every insert/update/delete, including FK cascades.
+
+VACANCY_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS vacancies_fts USING fts5(
+        title, brief, description,
+        content='vacancies', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS vacancies_fts_ai AFTER INSERT ON vacancies BEGIN
+        INSERT INTO vacancies_fts(rowid, title, brief, description)
+        VALUES (new.id, new.title, new.brief, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS vacancies_fts_ad AFTER DELETE ON vacancies BEGIN
+        INSERT INTO vacancies_fts(vacancies_fts, rowid, title, brief, description)
+        VALUES ('delete', old.id, old.title, old.brief, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS vacancies_fts_au AFTER UPDATE OF title, brief, description ON vacancies BEGIN
+        INSERT INTO vacancies_fts(vacancies_fts, rowid, title, brief, description)
+        VALUES ('delete', old.id, old.title, old.brief, old.description);
+        INSERT INTO vacancies_fts(rowid, title, brief, description)
+        VALUES (new.id, new.title, new.brief, new.description);
+    END""",
+]
+
+vacancies_fts = table('vacancies_fts', column('rowid'))
+
+for statement in VACANCY_FTS_DDL:
+    event.listen(Vacancy.__table__, 'after_create', DDL(statement))
+event.listen(Vacancy.__table__, 'before_drop', DDL("DROP TABLE IF EXISTS vacancies_fts"))
+
+
+# ===== Conversation summaries =====
+# Recomputes every conversation row from messages. Existing read markers are kept;
+# pairs seen for the first time start out fully read.
+
+CONVERSATIONS_REBUILD = [
+    """INSERT INTO conversations (user_id, peer_id, last_message_id, last_sent, last_read_id, unread_count)
+    SELECT pairs.user_id, pairs.peer_id, messages.id, messages.sent, messages.id, 0
+    FROM (
+        SELECT user_id, peer_id, max(id) AS id FROM (
+            SELECT sender_id AS user_id, recipient_id AS peer_id, id FROM messages
+            UNION ALL
+            SELECT recipient_id, sender_id, id FROM messages WHERE recipient_id != sender_id
+        ) GROUP BY user_id, peer_id
+    ) AS pairs JOIN messages ON messages.id = pairs.id
+    WHERE true
+    ON CONFLICT (user_id, peer_id) DO UPDATE SET
+        last_message_id = excluded.last_message_id,
+        last_sent = excluded.last_sent,
+        unread_count = (
+            SELECT count(*) FROM messages
+            WHERE messages.sender_id = conversations.peer_id AND messages.recipient_id = conversations.user_id
+              AND messages.sender_id != messages.recipient_id AND messages.id > conversations.last_read_id
+        )""",
+    """DELETE FROM conversations WHERE NOT EXISTS (
+        SELECT 1 FROM messages
+        WHERE (messages.sender_id = conversations.user_id AND messages.recipient_id = conversations.peer_id)
+           OR (messages.sender_id = conversations.peer_id AND messages.recipient_id = conversations.user_id)
+    )""",
+]
+
+
+# ===== Vacancy counters =====
+# vacancies.application_count / bookmark_count follow every insert, delete and re-targeting
+# update of applications and bookmarks, including FK cascades, within the writing transaction.
+
+VACANCY_COUNTER_DDL = {
+    'applications': [
+        """CREATE TRIGGER IF NOT EXISTS applications_count_ai AFTER INSERT ON applications BEGIN
+            UPDATE vacancies SET application_count = application_count + 1 WHERE id = new.vacancy_id;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS applications_count_ad AFTER DELETE ON applications BEGIN
+            UPDATE vacancies SET application_count = application_count - 1 WHERE id = old.vacancy_id;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS applications_count_au AFTER UPDATE OF vacancy_id ON applications
+        WHEN old.vacancy_id IS NOT new.vacancy_id BEGIN
+            UPDATE vacancies SET application_count = application_count - 1 WHERE id = old.vacancy_id;
+            UPDATE vacancies SET application_count = application_count + 1 WHERE id = new.vacancy_id;
+        END""",
+    ],
+    'bookmarks': [
+        """CREATE TRIGGER IF NOT EXISTS bookmarks_count_ai AFTER INSERT ON bookmarks BEGIN
+            UPDATE vacancies SET bookmark_count = bookmark_count + 1 WHERE id = new.vacancy_id;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS bookmarks_count_ad AFTER DELETE ON bookmarks BEGIN
+            UPDATE vacancies SET bookmark_count = bookmark_count - 1 WHERE id = old.vacancy_id;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS bookmarks_count_au AFTER UPDATE OF vacancy_id ON bookmarks
+        WHEN old.vacancy_id IS NOT new.vacancy_id BEGIN
+            UPDATE vacancies SET bookmark_count = bookmark_count - 1 WHERE id = old.vacancy_id;
+            UPDATE vacancies SET bookmark_count = bookmark_count + 1 WHERE id = new.vacancy_id;
+        END""",
+    ],
+}
+
+# Recount from scratch, touching only vacancies whose counters drifted
+VACANCY_COUNTERS_REPAIR = """
+    UPDATE vacancies SET
+        application_count = (SELECT count(*) FROM applications WHERE applications.vacancy_id = vacancies.id),
+        bookmark_count = (SELECT count(*) FROM bookmarks WHERE bookmarks.vacancy_id = vacancies.id)
+    WHERE application_count != (SELECT count(*) FROM applications WHERE applications.vacancy_id = vacancies.id)
+       OR bookmark_count != (SELECT count(*) FROM bookmarks WHERE bookmarks.vacancy_id = vacancies.id)
+"""
+
+for model in (Application, Bookmark):
+    for statement in VACANCY_COUNTER_DDL[model.__tablename__]:
+        event.listen(model.__table__, 'after_create', DDL(statement))
+
+
+# ===== Organisation applicants =====
+# org_applicants follows applications and vacancies through these triggers. Removal re-checks
+# for remaining applications instead of counting, which stays correct under FK cascades:
+# when a vacancy delete cascades, its applications' triggers no longer see the vacancy,
+# and the vacancy's own trigger cleans up afterwards.
+
+_NOW = "strftime('%Y-%m-%d %H:%M:%f000', 'now')"
+_HAS_APPLICATION = """EXISTS (
+    SELECT 1 FROM applications JOIN vacancies ON vacancies.id = applications.vacancy_id
+    WHERE applications.user_id = org_applicants.user_id AND vacancies.employer_id = org_applicants.org_id
+)"""
+
+ORG_APPLICANTS_DDL = [
+    f"""CREATE TRIGGER IF NOT EXISTS org_applicants_ai AFTER INSERT ON applications BEGIN
+        INSERT INTO org_applicants (org_id, user_id, first_applied)
+        SELECT employer_id, new.user_id, {_NOW} FROM vacancies
+        WHERE id = new.vacancy_id AND employer_id IS NOT NULL AND new.user_id IS NOT NULL
+        ON CONFLICT (org_id, user_id) DO NOTHING;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS org_applicants_ad AFTER DELETE ON applications BEGIN
+        DELETE FROM org_applicants
+        WHERE user_id = old.user_id AND org_id = (SELECT employer_id FROM vacancies WHERE id = old.vacancy_id)
+          AND NOT {_HAS_APPLICATION};
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS org_applicants_au AFTER UPDATE OF user_id, vacancy_id ON applications BEGIN
+        DELETE FROM org_applicants
+        WHERE user_id = old.user_id AND org_id = (SELECT employer_id FROM vacancies WHERE id = old.vacancy_id)
+          AND NOT {_HAS_APPLICATION};
+        INSERT INTO org_applicants (org_id, user_id, first_applied)
+        SELECT employer_id, new.user_id, {_NOW} FROM vacancies
+        WHERE id = new.vacancy_id AND employer_id IS NOT NULL AND new.user_id IS NOT NULL
+        ON CONFLICT (org_id, user_id) DO NOTHING;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS org_applicants_vacancy_ad AFTER DELETE ON vacancies BEGIN
+        DELETE FROM org_applicants WHERE org_id = old.employer_id AND NOT {_HAS_APPLICATION};
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS org_applicants_vacancy_au AFTER UPDATE OF employer_id ON vacancies
+    WHEN old.employer_id IS NOT new.employer_id BEGIN
+        DELETE FROM org_applicants WHERE org_id = old.employer_id AND NOT {_HAS_APPLICATION};
+        INSERT INTO org_applicants (org_id, user_id, first_applied)
+        SELECT new.employer_id, user_id, {_NOW} FROM applications
+        WHERE vacancy_id = new.id AND new.employer_id IS NOT NULL AND user_id IS NOT NULL
+        ON CONFLICT (org_id, user_id) DO NOTHING;
+    END""",
+]
+
+# Backfill for existing data; applications carry no timestamp, so first_applied starts at "now"
+ORG_APPLICANTS_REBUILD = f"""
+    INSERT OR IGNORE INTO org_applicants (org_id, user_id, first_applied)
+    SELECT DISTINCT vacancies.employer_id, applications.user_id, {_NOW}
+    FROM applications JOIN vacancies ON vacancies.id = applications.vacancy_id
+    WHERE vacancies.employer_id IS NOT NULL AND applications.user_id IS NOT NULL
+"""
+
+# The triggers span three tables, so they are created once the whole schema exists.
+# DDL() %-formats its text, hence the escaping of strftime's format.
+for statement in ORG_APPLICANTS_DDL:
+    event.listen(Base.metadata, 'after_create', DDL(statement.replace('%', '%%')))
+
+
+# ===== Table Versions =====
+# One counter per table that public responses are built from, bumped by triggers on every
+# row change. Writes from any process (other workers, manage.py, bulk imports, cascades and
+# SET NULL actions) move them, so cache.conditional_get's ETags are valid across processes.
+# The random 'epoch' row keeps a recreated database from reissuing ETags a client still holds.
+
+class TableVersion(Base):
+    __tablename__ = 'table_versions'
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, server_default='0')
+
+
+# Vacancy updates that only touch the counters don't change any response that uses an ETag
+_VERSIONED_COLUMNS = {
+    'vacancies': 'employer_id, title, brief, description, icon_id, salary_top, salary_bottom, '
+                 'required_year, created, status',
+}
+VERSIONED_TABLES = ('users', 'organisations', 'vacancies', 'applications', 'bookmarks')
+
+TABLE_VERSION_DDL = [
+    "INSERT OR IGNORE INTO table_versions (name, version) VALUES ('epoch', abs(random() % 4294967296))",
+]
+for _table in VERSIONED_TABLES:
+    TABLE_VERSION_DDL.append(f"INSERT OR IGNORE INTO table_versions (name, version) VALUES ('{_table}', 0)")
+    for _suffix, _event in (('ai', 'INSERT'), ('ad', 'DELETE'), ('au', 'UPDATE')):
+        if _event == 'UPDATE' and _table in _VERSIONED_COLUMNS:
+            _event = f'UPDATE OF {_VERSIONED_COLUMNS[_table]}'
+        TABLE_VERSION_DDL.append(
+            f"""CREATE TRIGGER IF NOT EXISTS {_table}_version_{_suffix} AFTER {_event} ON {_table} BEGIN
+        UPDATE table_versions SET version = version + 1 WHERE name = '{_table}';
+    END"""
+        )
+
+for statement in TABLE_VERSION_DDL:
+    event.listen(Base.metadata, 'after_create', DDL(statement.replace('%', '%%')))
+
+
+# Scoped versions, named '<table>:<value>', count the writes to one slice of a table, so a
+# cache built from that slice survives writes elsewhere: employer-filtered vacancy lists
+# only move with their employer's vacancies, a user's bookmark set only with their own
+# bookmarks. A row that changes scope bumps both.
+SCOPED_VERSION_COLUMNS = {'vacancies': 'employer_id', 'bookmarks': 'user_id'}
+
+SCOPED_VERSION_DDL = {}
+for _table, _column in SCOPED_VERSION_COLUMNS.items():
+    _bump = (f"INSERT INTO table_versions (name, version) SELECT '{_table}:' || {{row}}.{_column}, 1 "
+             f"WHERE {{row}}.{_column} IS NOT NULL ON CONFLICT (name) DO UPDATE SET version = version + 1;")
+    _update = f'UPDATE OF {_VERSIONED_COLUMNS[_table]}' if _table in _VERSIONED_COLUMNS else 'UPDATE'
+    SCOPED_VERSION_DDL[_table] = [
+        f"""CREATE TRIGGER IF NOT EXISTS {_table}_scope_version_ai AFTER INSERT ON {_table} BEGIN
+        {_bump.format(row='new')}
+    END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {_table}_scope_version_ad AFTER DELETE ON {_table} BEGIN
+        {_bump.format(row='old')}
+    END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {_table}_scope_version_au AFTER {_update} ON {_table} BEGIN
+        {_bump.format(row='old')}
+        {_bump.format(row='new')}
+    END""",
+    ]
+    for statement in SCOPED_VERSION_DDL[_table]:
+        event.listen(Base.metadata, 'after_create', DDL(statement))
@@ -0,0 +1,78 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, Callable, List, Optional, Sequence
+from fastapi import HTTPException, Query, Response, status
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+# ===== Opaque Cursors =====
+
+def encode_cursor(*values: Any) -> str:
+    """Pack the sort key of the last row on a page into an opaque token"""
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str], *types: Callable[[Any], Any]) -> Optional[tuple]:
+    """Unpack a token from encode_cursor, converting each value with the matching type"""
+    if cursor is None:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError(cursor)
+        return tuple(convert(value) for convert, value in zip(types, values))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+def set_next_cursor(response: Response, items: Sequence, limit: int, key: Callable[[Any], tuple]) -> List:
+    """Advertise the next page in a header when this one came back full; returns items unchanged"""
+    if items and len(items) >= limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(*key(items[-1]))
+    return list(items)
+
+
+def vacancy_key(vacancy) -> tuple:
+    return vacancy.created, vacancy.id
+
+
+def vacancy_salary_key(vacancy) -> tuple:
+    return vacancy.salary_bottom, vacancy.id
+
+
+def nullable(convert: Callable[[Any], Any]) -> Callable[[Any], Any]:
+    """decode_cursor type for sort keys that may be NULL"""
+    return lambda value: None if value is None else convert(value)
+
+
+def id_key(row) -> tuple:
+    return (row.id,)
+
+
+def conversation_key(conversation) -> tuple:
+    return conversation.last_sent, conversation.peer_id
+
+
+# ===== Batch Reads =====
+
+MAX_BATCH_IDS = 100
+
+
+def batch_ids(
+        ids: Optional[str] = Query(None, description=f"Comma-separated ids to fetch (at most {MAX_BATCH_IDS})")
+) -> Optional[List[int]]:
+    """Dependency parsing `?ids=1,2,3` for multi-get list endpoints; None when absent"""
+    if ids is None:
+        return None
+    try:
+        parsed = sorted({int(value) for value in ids.split(",") if value.strip()})
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ids must be comma-separated integers")
+    if len(parsed) > MAX_BATCH_IDS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"At most {MAX_BATCH_IDS} ids per request")
+    return parsed
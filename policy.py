@@ -0,0 +1,125 @@
+from typing import Callable, Dict, Iterable, Set, Tuple
+from fastapi import Depends, HTTPException, status
+from sqlalchemy import and_, exists, or_, select, true
+from sqlalchemy.ext.asyncio import AsyncSession
+from auth import Principal, Role, get_current_user
+from models import get_read_db
+import models
+
+
+# ===== Scopes =====
+# Each scope compiles one role's read rules for a model into a WHERE clause, so the same
+# rule filters list queries, loads single rows and answers batch checks.
+
+def user_scope(principal: Principal):
+    """
+    Students: themselves
+    Agents: themselves + students who applied to their org's vacancies
+    Admins: everyone
+    """
+    if principal.role == Role.ADMIN:
+        return true()
+    if principal.role == Role.AGENT:
+        return or_(
+            models.User.id == principal.id,
+            and_(
+                models.User.role == Role.STUDENT,
+                # Correlated on users only, so it still works in queries already joining org_applicants
+                exists().where(
+                    models.OrgApplicant.org_id == principal.org_id,
+                    models.OrgApplicant.user_id == models.User.id,
+                ).correlate(models.User),
+            ),
+        )
+    return models.User.id == principal.id
+
+
+def application_scope(principal: Principal):
+    """
+    Students: their own
+    Agents: those to their org's vacancies
+    Admins: all
+    """
+    if principal.role == Role.ADMIN:
+        return true()
+    if principal.role == Role.AGENT:
+        return models.Application.vacancy_id.in_(
+            select(models.Vacancy.id).filter(models.Vacancy.employer_id == principal.org_id)
+        )
+    return models.Application.user_id == principal.id
+
+
+def message_scope(principal: Principal):
+    """Sender and recipient; admins see everything"""
+    if principal.role == Role.ADMIN:
+        return true()
+    return or_(models.Message.sender_id == principal.id, models.Message.recipient_id == principal.id)
+
+
+SCOPES: Dict[type, Callable[[Principal], object]] = {
+    models.User: user_scope,
+    models.Application: application_scope,
+    models.Message: message_scope,
+}
+
+
+# ===== Per-request Policy =====
+
+class Policy:
+    """
+    Read authorization for one request. Decisions are memoised per (model, id): a row
+    checked by visible_ids(), get() or remember() is not checked against the scope again,
+    and a denied row is refused without another query.
+    """
+
+    def __init__(self, principal: Principal, db: AsyncSession):
+        self.principal = principal
+        self.db = db
+        self._decisions: Dict[Tuple[type, int], bool] = {}
+
+    def scope(self, model: type):
+        return SCOPES[model](self.principal)
+
+    def remember(self, model: type, rows: Iterable) -> None:
+        """Record rows that were loaded through scope(model) as visible"""
+        for row in rows:
+            self._decisions[model, row.id] = True
+
+    async def visible_ids(self, model: type, ids: Iterable[int]) -> Set[int]:
+        """The subset of `ids` the principal may read, in at most one query; ids that don't exist are left out"""
+        ids = set(ids)
+        unknown = [row_id for row_id in ids if (model, row_id) not in self._decisions]
+        if unknown:
+            allowed = set((await self.db.scalars(
+                select(model.id).filter(model.id.in_(unknown), self.scope(model))
+            )).all())
+            for row_id in unknown:
+                self._decisions[model, row_id] = row_id in allowed
+        return {row_id for row_id in ids if self._decisions[model, row_id]}
+
+    async def get(self, model: type, row_id: int, *options, denied: str = "Not authorized"):
+        """
+        Load a row through the scope in one query, or without it if the row is already known
+        to be visible. Raises 403 if the principal can't see it, whether or not it exists, so
+        ids can't be probed; only admins, whose scopes cover every row, get 404 for missing ones.
+        """
+        visible = self._decisions.get((model, row_id))
+        if visible is not False:
+            query = select(model).options(*options).filter(model.id == row_id)
+            row = await self.db.scalar(query if visible else query.filter(self.scope(model)))
+            if row is not None:
+                self._decisions[model, row_id] = True
+                return row
+            self._decisions[model, row_id] = False
+
+        if self.principal.role == Role.ADMIN:
+            raise HTTPException(status_code=404, detail=f"{model.__name__} not found")
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=denied)
+
+
+async def get_policy(
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_read_db)
+) -> Policy:
+    """One Policy per request; FastAPI reuses it for every dependency that asks"""
+    return Policy(current_user, db)
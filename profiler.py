@@ -0,0 +1,213 @@
+import json
+import logging
+import os
+import time
+import uuid
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+from typing import Optional
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import auth
+
+# Configuration (opt-in: nothing is installed unless SQL_PROFILER=1)
+ENABLED = os.environ.get("SQL_PROFILER", "0") == "1"
+# X-Profile is honoured for admins only, unless this is set (development setups)
+PROFILE_ANYONE = os.environ.get("SQL_PROFILER_ANYONE", "0") == "1"
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "100"))
+SLOW_QUERY_LOG = os.environ.get("SLOW_QUERY_LOG", "slow_queries.log")
+MAX_STATEMENT_CHARS = 2000
+
+slow_log = logging.getLogger("sql.slow")
+slow_log.propagate = False
+profile_log = logging.getLogger("sql.profile")
+
+
+class RequestProfile:
+    __slots__ = ("request_id", "scope", "capture_all", "queries")
+
+    def __init__(self, request_id: str, scope: dict, capture_all: bool):
+        self.request_id = request_id
+        self.scope = scope
+        self.capture_all = capture_all
+        self.queries = []
+
+    @property
+    def route(self) -> str:
+        route = self.scope.get("route")
+        return getattr(route, "path", self.scope["path"])
+
+
+_profile: ContextVar[Optional[RequestProfile]] = ContextVar("sql_profile", default=None)
+
+
+# ===== Statement Capture =====
+
+def _parameter_shape(parameters, executemany: bool):
+    """Types, not values: the log must not collect personal data"""
+    if executemany:
+        rows = list(parameters)
+        return {"rows": len(rows), "columns": _parameter_shape(rows[0], False) if rows else []}
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    return [type(value).__name__ for value in parameters or ()]
+
+
+def _query_plan(conn, statement: str, parameters) -> list:
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+        return [row[-1] for row in cursor.fetchall()]
+    except Exception as e:
+        return [f"unavailable: {e}"]
+    finally:
+        cursor.close()
+
+
+# Kept on the execution context, not conn.info: a statement that raises never reaches
+# after_cursor_execute and would otherwise leave its start time on the pooled connection.
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._profile_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed_ms = (time.perf_counter() - context._profile_started) * 1000
+    profile = _profile.get()
+    slow = elapsed_ms >= SLOW_QUERY_MS
+    if not slow and (profile is None or not profile.capture_all):
+        return
+
+    record = {
+        "statement": statement[:MAX_STATEMENT_CHARS],
+        "parameters": _parameter_shape(parameters, executemany),
+        "duration_ms": round(elapsed_ms, 3),
+    }
+    if slow and not executemany:
+        record["plan"] = _query_plan(conn, statement, parameters)
+    if profile is not None:
+        profile.queries.append(record)
+    if slow:
+        slow_log.warning(json.dumps({
+            "request_id": profile.request_id if profile else None,
+            "route": profile.route if profile else None,
+            **record,
+        }, ensure_ascii=False))
+
+
+def instrument_engine(engine: Engine) -> None:
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def configure_log(path: str = SLOW_QUERY_LOG, max_bytes: int = 10 * 1024 * 1024, backups: int = 5) -> None:
+    handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    slow_log.addHandler(handler)
+    slow_log.setLevel(logging.WARNING)
+
+
+# ===== ASGI Middleware =====
+
+class ProfilerMiddleware:
+    """
+    Tags every request with an X-Request-ID for the slow-query log. With `X-Profile: 1`
+    from an admin (or anyone with SQL_PROFILER_ANYONE=1) the request's full statement list
+    is returned too: JSON bodies are wrapped as {"response": ..., "profile": {...}}. Other
+    responses, which may stream (SSE, exports), pass through unbuffered with summary headers
+    counting the queries made before they started; their full profile is logged when they end.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1") or uuid.uuid4().hex
+        capture_all = headers.get(b"x-profile") == b"1" and await self._may_profile(headers)
+        profile = RequestProfile(request_id, scope, capture_all)
+        token = _profile.set(profile)
+        try:
+            if capture_all:
+                await self._profiled(scope, receive, send, profile)
+            else:
+                await self.app(scope, receive, self._tagging(send, request_id))
+        finally:
+            _profile.reset(token)
+
+    @staticmethod
+    async def _may_profile(headers: dict) -> bool:
+        if PROFILE_ANYONE:
+            return True
+        scheme, _, token = headers.get(b"authorization", b"").decode("latin-1").partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            return False
+        principal = await auth.load_principal(token)
+        return principal is not None and principal.role == auth.Role.ADMIN
+
+    @staticmethod
+    def _summary(profile: RequestProfile) -> dict:
+        return {
+            "request_id": profile.request_id,
+            "route": profile.route,
+            "query_count": len(profile.queries),
+            "query_ms": round(sum(query["duration_ms"] for query in profile.queries), 3),
+        }
+
+    @staticmethod
+    def _summary_headers(summary: dict) -> list:
+        return [
+            (b"x-request-id", summary["request_id"].encode()),
+            (b"x-profile-queries", str(summary["query_count"]).encode()),
+            (b"server-timing", f'db;dur={summary["query_ms"]}'.encode()),
+        ]
+
+    @staticmethod
+    def _tagging(send, request_id: str):
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode())]
+            await send(message)
+
+        return send_with_id
+
+    async def _profiled(self, scope, receive, send, profile: RequestProfile):
+        start, chunks, passthrough = None, [], False
+
+        async def forward(message):
+            nonlocal start, passthrough
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                if dict(headers).get(b"content-type", b"").startswith(b"application/json"):
+                    start = message
+                    return
+                passthrough = True
+                message = {**message, "headers": headers + self._summary_headers(self._summary(profile))}
+            elif message["type"] == "http.response.body" and not passthrough:
+                chunks.append(message.get("body", b""))
+                return
+            await send(message)
+
+        await self.app(scope, receive, forward)
+
+        if passthrough:
+            profile_log.info(json.dumps({**self._summary(profile), "queries": profile.queries}, default=str))
+            return
+        if start is None:
+            return
+
+        body = b"".join(chunks)
+        summary = self._summary(profile)
+        if body:
+            body = json.dumps(
+                {"response": json.loads(body), "profile": {**summary, "queries": profile.queries}},
+                ensure_ascii=False, default=str,
+            ).encode()
+        headers = [(name, value) for name, value in start.get("headers", []) if name.lower() != b"content-length"]
+        headers += self._summary_headers(summary) + [(b"content-length", str(len(body)).encode())]
+        await send({**start, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
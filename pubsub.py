@@ -0,0 +1,88 @@
+import asyncio
+import json
+from collections import defaultdict
+from typing import AsyncIterator, Dict, Set
+
+# Process-local, like the caches in cache.py: with several workers a client only hears about
+# messages written through the worker it is connected to.
+
+QUEUE_SIZE = 100
+KEEPALIVE_SECONDS = 15.0
+
+
+class Subscription:
+    """One connected client; events that arrive while the queue is full are dropped and flagged"""
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.lagged = False
+
+    def deliver(self, event: str, data: str) -> None:
+        try:
+            self.queue.put_nowait((event, data))
+        except asyncio.QueueFull:
+            self.lagged = True
+
+
+class Hub:
+    """Fan-out of per-user events to every connection that user has open"""
+
+    def __init__(self):
+        self._subscribers: Dict[int, Set[Subscription]] = defaultdict(set)
+
+    def subscribe(self, user_id: int) -> Subscription:
+        subscription = Subscription(user_id)
+        self._subscribers[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscribers = self._subscribers.get(subscription.user_id)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.user_id]
+
+    def publish(self, user_id: int, event: str, data: str) -> int:
+        """Queue an event for all of a user's connections; returns how many received it"""
+        subscribers = self._subscribers.get(user_id, ())
+        for subscription in subscribers:
+            subscription.deliver(event, data)
+        return len(subscribers)
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._subscribers),
+            "connections": sum(len(subscribers) for subscribers in self._subscribers.values()),
+        }
+
+
+hub = Hub()
+
+
+# ===== Server-Sent Events =====
+
+def _frame(event: str, data: str) -> str:
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+async def event_stream(request, user_id: int, keepalive: float = KEEPALIVE_SECONDS) -> AsyncIterator[str]:
+    """
+    SSE body for one user. Sends a comment every `keepalive` seconds so proxies keep the
+    connection open, and a `lagged` event when the client fell behind and should refetch.
+    """
+    subscription = hub.subscribe(user_id)
+    try:
+        yield _frame("ready", json.dumps({"user_id": user_id}))
+        while not await request.is_disconnected():
+            if subscription.lagged:
+                subscription.lagged = False
+                yield _frame("lagged", "{}")
+            try:
+                event, data = await asyncio.wait_for(subscription.queue.get(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield _frame(event, data)
+    finally:
+        hub.unsubscribe(subscription)
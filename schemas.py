@@ -1,4 +1,4 @@
-from pydantic import BaseModel, field_validator, EmailStr, ConfigDict
+from pydantic import BaseModel, field_validator, EmailStr, ConfigDict, Field, TypeAdapter
 from typing import List, Optional
 from datetime import datetime
 
@@ -127,6 +127,11 @@ class VacancyResponse(VacancyBase):
     model_config = ConfigDict(from_attributes=True)
 
 
+class VacancyListItem(VacancyResponse):
+    # False for anonymous callers
+    is_bookmarked: bool = False
+
+
 class VacancyDetailed(VacancyResponse):
     employer: Optional[OrganisationResponse] = None
     applications: List['ApplicationResponse'] = []
@@ -134,6 +139,27 @@ class VacancyDetailed(VacancyResponse):
     model_config = ConfigDict(from_attributes=True)
 
 
+class VacancyStats(BaseModel):
+    vacancy_id: int
+    title: str
+    application_count: int
+    bookmark_count: int
+
+
+class OrganisationStats(BaseModel):
+    organisation_id: int
+    vacancy_count: int
+    application_count: int
+    bookmark_count: int
+    vacancies: List[VacancyStats]
+
+
+class VacancySearchResult(BaseModel):
+    vacancy: VacancyResponse
+    rank: float
+    snippet: str
+
+
 class MediaBase(BaseModel):
     name: str
     path: str
@@ -151,6 +177,10 @@ class MediaUpdate(BaseModel):
 class MediaResponse(MediaBase):
     id: int
     added: datetime
+    size: Optional[int] = None
+    sha256: Optional[str] = None
+    content_type: Optional[str] = None
+    placeholder: Optional[str] = None
 
     model_config = ConfigDict(from_attributes=True)
 
@@ -160,7 +190,7 @@ class MessageBase(BaseModel):
 
 
 class MessageCreate(MessageBase):
-    recepient_id: int
+    recipient_id: int
 
 
 class MessageUpdate(BaseModel):
@@ -172,7 +202,7 @@ class MessageResponse(MessageBase):
     sent: datetime
     last_edit: Optional[datetime] = None
     sender_id: int
-    recepient_id: int
+    recipient_id: int
 
     model_config = ConfigDict(from_attributes=True)
 
@@ -184,6 +214,16 @@ class MessageDetailed(MessageResponse):
     model_config = ConfigDict(from_attributes=True)
 
 
+class ConversationResponse(BaseModel):
+    peer_id: int
+    last_sent: Optional[datetime] = None
+    unread_count: int
+    peer: Optional[UserResponse] = None
+    last_message: Optional[MessageResponse] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+
 class ApplicationBase(BaseModel):
     title: str
     content: str
@@ -230,6 +270,17 @@ class BookmarkDetailed(BookmarkResponse):
     model_config = ConfigDict(from_attributes=True)
 
 
+class BookmarkBatch(BaseModel):
+    add: List[int] = Field(default_factory=list, max_length=1000)
+    remove: List[int] = Field(default_factory=list, max_length=1000)
+
+
+class BookmarkBatchResult(BaseModel):
+    added: List[int]
+    removed: List[int]
+    missing: List[int]
+
+
 class MessageMediaCreate(BaseModel):
     media_id: int
 
@@ -240,3 +291,9 @@ class VacancyMediaCreate(BaseModel):
 
 class ApplicationMediaCreate(BaseModel):
     media_id: int
+
+
+# Adapters for endpoints that serialize lists themselves (e.g. to cache the JSON bytes)
+VacancyList = TypeAdapter(List[VacancyListItem])
+OrganisationList = TypeAdapter(List[OrganisationResponse])
+ApplicationDetailedList = TypeAdapter(List[ApplicationDetailed])
@@ -0,0 +1,197 @@
+import asyncio
+import hashlib
+import os
+import shutil
+import uuid
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional
+from fastapi import HTTPException, Request, status
+
+try:
+    from python_multipart.exceptions import FormParserError
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart is optional; without it only raw-body uploads work
+    MultipartParser = None
+
+# Configuration
+MEDIA_ROOT = os.environ.get("MEDIA_ROOT", "./media")
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+CHUNK_SIZE = 1024 * 1024
+# Room for multipart boundaries, part headers and small extra fields around the file
+FORM_OVERHEAD_BYTES = 64 * 1024
+
+# ===== Content-addressed Blobs =====
+# Every upload is stored once under MEDIA_ROOT/ab/cd/<sha256>; Media rows with the same
+# content share the blob, which is removed when the last of them is deleted.
+
+
+class StoredBlob(NamedTuple):
+    sha256: str
+    size: int
+    temp_path: str
+
+
+def blob_key(sha256: str) -> str:
+    """Blob location relative to MEDIA_ROOT, as kept in Media.path"""
+    return os.path.join(sha256[:2], sha256[2:4], sha256)
+
+
+def blob_path(sha256: str) -> str:
+    return os.path.join(MEDIA_ROOT, blob_key(sha256))
+
+
+def derived_path(sha256: str, name: str) -> str:
+    """Files generated from a blob (thumbnails) live under MEDIA_ROOT/derived, keyed by the same hash"""
+    return os.path.join(MEDIA_ROOT, "derived", blob_key(sha256), name)
+
+
+def check_content_length(request: Request) -> None:
+    """Reject bodies that announce themselves as too large before reading them"""
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > MAX_UPLOAD_BYTES + FORM_OVERHEAD_BYTES:
+        raise HTTPException(status_code=status.HTTP_413_CONTENT_TOO_LARGE, detail="Upload too large")
+
+
+async def iter_form_file(request: Request, meta: Dict[str, Optional[str]], field: str = "file") -> AsyncIterator[bytes]:
+    """
+    Yield the content of one file field of a multipart/form-data body as the body arrives.
+    Starlette's request.form() would spool the whole upload to a temporary file first; here
+    the parser feeds receive() directly, so its size limit applies while reading. `meta` gets
+    the field's filename and content_type.
+    """
+    if MultipartParser is None:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                            detail="Multipart uploads are unavailable; send the file as the raw request body")
+    _, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if not boundary:
+        raise HTTPException(status_code=400, detail="Missing multipart boundary")
+
+    part = {"field": b"", "value": b"", "headers": {}, "is_file": False}
+    found = []
+    pending: List[bytes] = []
+
+    def on_header_field(data: bytes, start: int, end: int) -> None:
+        part["field"] += data[start:end]
+
+    def on_header_value(data: bytes, start: int, end: int) -> None:
+        part["value"] += data[start:end]
+
+    def on_header_end() -> None:
+        part["headers"][part["field"].lower()] = part["value"]
+        part["field"] = part["value"] = b""
+
+    def on_headers_finished() -> None:
+        _, options = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        if not found and options.get(b"name") == field.encode() and b"filename" in options:
+            found.append(True)
+            part["is_file"] = True
+            meta["filename"] = options[b"filename"].decode("utf-8", "replace") or None
+            meta["content_type"] = part["headers"].get(b"content-type", b"").decode("latin-1") or None
+
+    def on_part_data(data: bytes, start: int, end: int) -> None:
+        if part["is_file"]:
+            pending.append(data[start:end])
+
+    def on_part_end() -> None:
+        part["headers"], part["is_file"] = {}, False
+
+    parser = MultipartParser(boundary, {
+        "on_header_field": on_header_field, "on_header_value": on_header_value, "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished, "on_part_data": on_part_data, "on_part_end": on_part_end,
+    })
+    received = 0
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > MAX_UPLOAD_BYTES + FORM_OVERHEAD_BYTES:
+                raise HTTPException(status_code=status.HTTP_413_CONTENT_TOO_LARGE, detail="Upload too large")
+            parser.write(chunk)
+            while pending:
+                yield pending.pop(0)
+        parser.finalize()
+    except FormParserError:
+        raise HTTPException(status_code=400, detail="Malformed multipart body")
+    if not found:
+        raise HTTPException(status_code=400, detail="Missing file field")
+
+
+async def receive(chunks: AsyncIterator[bytes]) -> StoredBlob:
+    """Write chunks to a temporary file under MEDIA_ROOT while hashing them"""
+    directory = os.path.join(MEDIA_ROOT, "tmp")
+    await asyncio.to_thread(os.makedirs, directory, exist_ok=True)
+    temp_path = os.path.join(directory, uuid.uuid4().hex)
+    digest = hashlib.sha256()
+    size = 0
+    file = await asyncio.to_thread(open, temp_path, "wb")
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > MAX_UPLOAD_BYTES:
+                raise HTTPException(status_code=status.HTTP_413_CONTENT_TOO_LARGE, detail="Upload too large")
+            digest.update(chunk)
+            await asyncio.to_thread(file.write, chunk)
+    except BaseException:
+        await asyncio.to_thread(file.close)
+        await asyncio.to_thread(_remove, temp_path)
+        raise
+    await asyncio.to_thread(file.close)
+    return StoredBlob(digest.hexdigest(), size, temp_path)
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _place(blob: StoredBlob) -> None:
+    final_path = blob_path(blob.sha256)
+    if os.path.exists(final_path):
+        os.remove(blob.temp_path)
+        return
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+    os.replace(blob.temp_path, final_path)
+
+
+async def place(blob: StoredBlob) -> None:
+    """Move a received blob into place, or drop it if the same content is already stored"""
+    await asyncio.to_thread(_place, blob)
+
+
+def _remove_blob(sha256: str) -> None:
+    _remove(blob_path(sha256))
+    shutil.rmtree(os.path.dirname(derived_path(sha256, "")), ignore_errors=True)
+
+
+async def remove(sha256: str) -> None:
+    """Delete a blob together with everything derived from it"""
+    await asyncio.to_thread(_remove_blob, sha256)
+
+
+# ===== Blob Locks =====
+# Placing a blob and inserting its Media row, or deleting the last row and its blob, happen
+# under the hash's lock so a concurrent upload of the same content can't lose its file.
+# Process-local, like the caches: run a single writer process per MEDIA_ROOT.
+
+_locks = {}
+_holders = defaultdict(int)
+
+
+@asynccontextmanager
+async def blob_lock(sha256: Optional[str]):
+    if sha256 is None:
+        yield
+        return
+    lock = _locks.setdefault(sha256, asyncio.Lock())
+    _holders[sha256] += 1
+    try:
+        async with lock:
+            yield
+    finally:
+        _holders[sha256] -= 1
+        if not _holders[sha256]:
+            del _holders[sha256]
+            del _locks[sha256]
@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+# The app reads its settings at import time, so point it at a scratch database first
+_workdir = tempfile.mkdtemp(prefix="pp-tests-")
+os.environ.setdefault("DATABASE_PATH", os.path.join(_workdir, "test.db"))
+os.environ.setdefault("MEDIA_ROOT", os.path.join(_workdir, "media"))
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+# Small enough that tests can exhaust the read pool cheaply
+os.environ.setdefault("READ_POOL_SIZE", "2")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,29 @@
+import json
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+import auth
+import main
+import models
+from auth import Role
+
+
+def test_results_follow_input_order():
+    with TestClient(main.app) as client:
+        with Session(models.engine) as db:
+            admin = models.User(fname="b", lname="b", email="bulk-admin@example.com", password="-", role=Role.ADMIN)
+            db.add(admin)
+            db.commit()
+            headers = {"Authorization": f"Bearer {auth.create_access_token({'sub': str(admin.id)})}"}
+
+        body = "\n".join([
+            json.dumps({"title": "bulk one", "description": "d"}),
+            json.dumps({"title": "bulk two"}),
+            "not json",
+            json.dumps({"title": "bulk three", "description": "d"}),
+        ])
+        response = client.post("/api/organisations/bulk", content=body, headers=headers)
+        assert response.status_code == 200
+        results = [json.loads(line) for line in response.text.splitlines()]
+        assert [result["line"] for result in results] == [1, 2, 3, 4]
+        assert ["id" in result for result in results] == [True, False, False, True]
+        assert response.headers["X-Bulk-Inserted"] == "2"
@@ -0,0 +1,147 @@
+"""
+Conditional GETs and cached list pages: what is answered from process memory, and which
+writes move it on.
+"""
+import pytest
+from fastapi import Response
+from fastapi.testclient import TestClient
+from sqlalchemy import event, insert
+from sqlalchemy.orm import Session
+import auth
+import cache
+import main
+import models
+from auth import Role
+
+
+@pytest.fixture(scope="module")
+def client():
+    ttl, cache.table_versions.ttl = cache.table_versions.ttl, 3600
+    with TestClient(main.app) as client:
+        yield client
+    cache.table_versions.ttl = ttl
+
+
+@pytest.fixture(scope="module")
+def admin(client):
+    with Session(models.engine) as db:
+        user = models.User(fname="c", lname="c", email="cache-admin@example.com", password="-", role=Role.ADMIN)
+        db.add(user)
+        db.commit()
+        return {"Authorization": f"Bearer {auth.create_access_token({'sub': str(user.id)})}"}
+
+
+class Statements:
+    """Counts statements run on the read pool while active"""
+
+    def __enter__(self):
+        self.count = 0
+        event.listen(models.read_engine.sync_engine, "before_cursor_execute", self)
+        return self
+
+    def __call__(self, *args):
+        self.count += 1
+
+    def __exit__(self, *exc):
+        event.remove(models.read_engine.sync_engine, "before_cursor_execute", self)
+
+
+def test_not_modified_without_database(client, admin):
+    etag = client.get("/api/organisations/").headers["ETag"]
+
+    with Statements() as statements:
+        response = client.get("/api/organisations/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert statements.count == 0
+
+    # A write in this process is seen by the next request, whatever the ttl
+    client.post("/api/organisations/", json={"title": "new org", "description": "d"}, headers=admin)
+    response = client.get("/api/organisations/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_vacancy_writes_only_move_their_employer(client, admin):
+    with Session(models.engine) as db:
+        first = models.Organisation(title="first", description="d")
+        second = models.Organisation(title="second", description="d")
+        db.add_all([first, second])
+        db.commit()
+        first_id, second_id = first.id, second.id
+
+    def list_status(params):
+        return client.get("/api/vacancies/", params=params).headers["X-Cache"]
+
+    client.post("/api/vacancies/", json={"title": "first job", "description": "d", "status": 1,
+                                         "employer_id": first_id}, headers=admin)
+    assert list_status({"employer_id": first_id}) == "MISS"
+    assert list_status({}) == "MISS"
+    assert list_status({"employer_id": first_id}) == "HIT"
+
+    client.post("/api/vacancies/", json={"title": "second job", "description": "d", "status": 1,
+                                         "employer_id": second_id}, headers=admin)
+    assert list_status({"employer_id": first_id}) == "HIT"
+    assert list_status({}) == "MISS"
+
+    # Moving a vacancy between employers changes both lists
+    with Session(models.engine) as db:
+        db.query(models.Vacancy).filter(models.Vacancy.title == "second job").update({"employer_id": first_id})
+        db.commit()
+    assert list_status({"employer_id": first_id}) == "MISS"
+
+
+def test_bookmarks_are_per_user_and_seen_across_processes(client, admin):
+    with Session(models.engine) as db:
+        org = models.Organisation(title="bookmarked org", description="d")
+        db.add(org)
+        db.flush()
+        vacancies = [models.Vacancy(title=f"bookmarkable {n}", description="d", status=1, employer_id=org.id)
+                     for n in range(3)]
+        students = [models.User(fname="s", lname="s", email=f"bookmark-{n}@example.com", password="-",
+                                role=Role.STUDENT) for n in range(2)]
+        db.add_all(vacancies + students)
+        db.commit()
+        org_id, ids = org.id, [vacancy.id for vacancy in vacancies]
+        first, second = [{"Authorization": f"Bearer {auth.create_access_token({'sub': str(s.id)})}"}
+                         for s in students]
+        other_id = students[1].id
+
+    def page(headers):
+        response = client.get("/api/vacancies/", params={"employer_id": org_id}, headers=headers)
+        return response, {item["id"] for item in response.json() if item["is_bookmarked"]}
+
+    client.get("/api/vacancies/", params={"employer_id": org_id})
+    client.post("/api/bookmarks/", json={"vacancy_id": ids[1]}, headers=first)
+    response, marked = page(first)
+    assert response.headers["X-Cache"] == "HIT" and marked == {ids[1]}
+    etag = page(second)[0].headers["ETag"]
+
+    # Another user's toggle leaves this user's ETag alone
+    client.post("/api/bookmarks/", json={"vacancy_id": ids[0]}, headers=first)
+    assert page(first)[1] == {ids[0], ids[1]}
+    assert client.get("/api/vacancies/", params={"employer_id": org_id},
+                      headers={**second, "If-None-Match": etag}).status_code == 304
+
+    # A write from another process (no session commit here) shows once the versions ttl runs out
+    page(second)
+    with models.engine.begin() as connection:
+        connection.execute(insert(models.Bookmark).values(user_id=other_id, vacancy_id=ids[2]))
+    assert page(second)[1] == set()
+    cache.table_versions.expire()
+    assert page(second)[1] == {ids[2]}
+
+
+def test_unknown_employers_leave_no_bookkeeping(client):
+    entries = len(cache.response_cache._entries)
+    for employer_id in range(10_000_000, 10_000_050):
+        assert client.get("/api/vacancies/", params={"employer_id": employer_id}).json() == []
+    assert len(cache.response_cache._entries) == entries
+
+
+def test_evicted_scopes_leave_no_bookkeeping():
+    responses = cache.ResponseCache(max_bytes=4 * (cache.ResponseCache.ENTRY_OVERHEAD + 2))
+    for employer_id in range(100):
+        key = ("/api/vacancies/", (("employer_id", str(employer_id)),), "vacancies", employer_id, 1)
+        responses.set(key, b"[]", Response())
+    assert len(responses._entries) == 4
+    assert len(responses._latest) == len(responses._keys) == 4
@@ -0,0 +1,57 @@
+import csv
+import json
+import io
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+import auth
+import main
+import models
+from auth import Role
+
+FORMULAS = ["=HYPERLINK(\"http://x\")", "+HYPERLINK(\"http://x\")", "-2+3", "+A1", "-A1", "+SUM", "@SUM(A1)",
+            "\tcmd", "\rcmd"]
+# A leading sign alone is not a formula: numbers and plain text stay as they are
+PLAIN = ["-5", "+1.5", "-1e+5", "-5 years", "+7 phone", "- item"]
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture(scope="module")
+def headers(client):
+    with Session(models.engine) as db:
+        admin = models.User(fname="x", lname="x", email="export-admin@example.com", password="-", role=Role.ADMIN)
+        org = models.Organisation(title="export org", description="d")
+        db.add_all([admin, org])
+        db.flush()
+        vacancy = models.Vacancy(title="=export vacancy", description="d", status=1, employer_id=org.id)
+        db.add(vacancy)
+        db.flush()
+        for i, formula in enumerate(FORMULAS):
+            student = models.User(fname=formula, lname=PLAIN[i % len(PLAIN)], email=f"formula{i}@example.com",
+                                  password="-", role=Role.STUDENT)
+            db.add(student)
+            db.flush()
+            db.add(models.Application(title="export", content=formula, user_id=student.id, vacancy_id=vacancy.id))
+        db.commit()
+        return {"Authorization": f"Bearer {auth.create_access_token({'sub': str(admin.id)})}"}
+
+
+def test_csv_neutralises_formulas(client, headers):
+    response = client.get("/api/applications/export?format=csv", headers=headers)
+    assert response.status_code == 200
+    rows = [row for row in csv.DictReader(io.StringIO(response.text, newline="")) if row["title"] == "export"]
+    assert sorted(row["content"] for row in rows) == sorted("'" + formula for formula in FORMULAS)
+    assert {row["applicant_fname"] for row in rows} == {"'" + formula for formula in FORMULAS}
+    assert {row["applicant_lname"] for row in rows} == set(PLAIN)
+    assert {row["vacancy_title"] for row in rows} == {"'=export vacancy"}
+
+
+def test_ndjson_keeps_values(client, headers):
+    response = client.get("/api/applications/export?format=ndjson", headers=headers)
+    rows = [row for row in map(json.loads, response.text.splitlines()) if row["title"] == "export"]
+    assert sorted(row["content"] for row in rows) == sorted(FORMULAS)
@@ -0,0 +1,71 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+import auth
+import main
+import models
+import policy
+from auth import Role
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+
+def token(user_id: int) -> dict:
+    return {"Authorization": f"Bearer {auth.create_access_token({'sub': str(user_id)})}"}
+
+
+def test_remembered_denial_needs_no_query():
+    # db=None: any query would fail
+    access = policy.Policy(auth.Principal(id=1, role=Role.STUDENT, org_id=None), db=None)
+    access._decisions[models.User, 2] = False
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(access.get(models.User, 2))
+    assert error.value.status_code == 403
+
+
+def test_batch_ids_are_scoped(client):
+    with Session(models.engine) as db:
+        users = [models.User(fname="p", lname="p", email=f"policy-{n}@example.com", password="-", role=Role.STUDENT)
+                 for n in range(2)]
+        db.add_all(users)
+        db.commit()
+        own, other = users[0].id, users[1].id
+
+    response = client.get("/api/users/", params={"ids": f"{own},{other},999999"}, headers=token(own))
+    assert [user["id"] for user in response.json()] == [own]
+
+
+def test_agent_list_follows_user_scope(client):
+    with Session(models.engine) as db:
+        org = models.Organisation(title="policy org", description="d")
+        db.add(org)
+        db.flush()
+        vacancy = models.Vacancy(title="policy job", description="d", status=1, employer_id=org.id)
+        agent = models.User(fname="a", lname="a", email="policy-agent@example.com", password="-",
+                            role=Role.AGENT, org_id=org.id)
+        applicants = [models.User(fname="p", lname="p", email=f"policy-applicant-{n}@example.com", password="-",
+                                  role=role) for n, role in enumerate((Role.STUDENT, Role.AGENT, Role.STUDENT))]
+        db.add_all([vacancy, agent] + applicants)
+        db.flush()
+        db.add_all(models.Application(title="t", content="c", user_id=user.id, vacancy_id=vacancy.id)
+                   for user in applicants + [agent])
+        db.commit()
+        agent_id = agent.id
+        expected = [agent_id] + [user.id for user in applicants if user.role == Role.STUDENT]
+
+    first = client.get("/api/users/", params={"limit": 2}, headers=token(agent_id))
+    rest = client.get("/api/users/", params={"limit": 2, "cursor": first.headers["X-Next-Cursor"]},
+                      headers=token(agent_id))
+    listed = [user["id"] for user in first.json() + rest.json()]
+    assert listed == expected
+
+    # The same rule answers ?ids=
+    every = ",".join(str(user_id) for user_id in [agent_id] + [user.id for user in applicants])
+    assert [user["id"] for user in client.get("/api/users/", params={"ids": every},
+                                              headers=token(agent_id)).json()] == sorted(expected)
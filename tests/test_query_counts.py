@@ -0,0 +1,104 @@
+"""
+Detailed endpoints must run a fixed number of statements however many related rows they
+serialize, so a relationship slipping back to per-row loading (N+1) fails here.
+"""
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import cache
+import main
+import models
+import passwords
+from auth import Role
+
+SMALL, LARGE = 1, 6
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+
+@pytest.fixture(scope="module")
+def client():
+    # Keep the in-process table versions warm between a request and the one it counts
+    ttl, cache.table_versions.ttl = cache.table_versions.ttl, 3600
+    with TestClient(main.app) as client:
+        yield client
+    cache.table_versions.ttl = ttl
+
+
+@pytest.fixture(scope="module")
+def data(client):
+    """Two of everything: one with SMALL related rows, one with LARGE"""
+    password = passwords.hash_password("password1")
+    ids = {}
+    with Session(models.engine) as db:
+        admin = models.User(fname="a", lname="a", email="admin@example.com", password=password, role=Role.ADMIN)
+        db.add(admin)
+        for label, n in (("small", SMALL), ("large", LARGE)):
+            org = models.Organisation(title=f"org {label}", description="d")
+            db.add(org)
+            db.flush()
+            vacancies = [models.Vacancy(title=f"vacancy {i} {label}", description="d", status=1, employer_id=org.id)
+                         for i in range(n)]
+            members = [models.User(fname="m", lname="m", email=f"member{i}-{label}@example.com", password=password,
+                                   role=Role.AGENT, org_id=org.id) for i in range(n)]
+            student = models.User(fname="s", lname="s", email=f"student-{label}@example.com", password=password,
+                                  role=Role.STUDENT)
+            db.add_all(vacancies + members + [student])
+            db.flush()
+            for vacancy in vacancies:
+                db.add(models.Application(title="t", content="c", user_id=student.id, vacancy_id=vacancy.id))
+                db.add(models.Bookmark(user_id=student.id, vacancy_id=vacancy.id))
+            # The vacancy under test also collects n applications from the members
+            for member in members:
+                db.add(models.Application(title="t", content="c", user_id=member.id, vacancy_id=vacancies[-1].id))
+            for member in members:
+                db.add(models.Message(content="hi", sender_id=student.id, recipient_id=member.id))
+            ids[label] = {"org": org.id, "vacancy": vacancies[-1].id, "student": student.id,
+                          "email": student.email}
+        db.commit()
+    return ids
+
+
+def login(client, email):
+    token = client.post("/api/auth/login", data={"username": email, "password": "password1"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    # Warm the principal cache so the counts cover only the endpoint's own queries
+    client.get("/api/auth/me", headers=headers)
+    return headers
+
+
+def count_queries(client, url, headers=None) -> int:
+    client.get(url, headers=headers)
+    counter = QueryCounter()
+    engine = models.read_engine.sync_engine
+    event.listen(engine, "before_cursor_execute", counter)
+    try:
+        response = client.get(url, headers=headers)
+    finally:
+        event.remove(engine, "before_cursor_execute", counter)
+    assert response.status_code == 200, response.text
+    return counter.count
+
+
+@pytest.mark.parametrize("path, expected", [
+    ("/api/users/{student}", 4),
+    ("/api/vacancies/{vacancy}", 2),
+    ("/api/organisations/{org}", 3),
+])
+def test_detailed_endpoints(client, data, path, expected):
+    headers = login(client, "admin@example.com")
+    counts = [count_queries(client, path.format(**data[label]), headers) for label in ("small", "large")]
+    assert counts == [expected, expected]
+
+
+def test_expanded_application_list(client, data):
+    counts = [count_queries(client, "/api/applications/?expand=true", login(client, data[label]["email"]))
+              for label in ("small", "large")]
+    assert counts == [3, 3]
@@ -0,0 +1,20 @@
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+import main
+import models
+
+
+def test_snippet_escapes_vacancy_text():
+    with TestClient(main.app) as client:
+        with Session(models.engine) as db:
+            org = models.Organisation(title="search org", description="d")
+            db.add(org)
+            db.flush()
+            db.add(models.Vacancy(title="xss probe", description='<img src=x onerror="alert(1)"> zanzibar & co',
+                                  status=1, employer_id=org.id))
+            db.commit()
+
+        response = client.get("/api/vacancies/search", params={"q": "zanzibar"})
+        assert response.status_code == 200
+        (result,) = response.json()
+        assert result["snippet"] == '&lt;img src=x onerror=&quot;alert(1)&quot;&gt; <mark>zanzibar</mark> &amp; co'
@@ -0,0 +1,114 @@
+"""
+Long-lived responses (SSE, exports) must not hold a read-pool connection while they stream,
+or a handful of idle subscribers starves every other endpoint.
+"""
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+import auth
+import cache
+import main
+import models
+from auth import Role
+
+# More than the read pool and its overflow together
+STREAMS = 2 * models.READ_POOL_SIZE + 1
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture(scope="module")
+def tokens(client):
+    with Session(models.engine) as db:
+        users = [models.User(fname="l", lname="l", email=f"listener{i}@example.com", password="-", role=Role.AGENT)
+                 for i in range(STREAMS)]
+        db.add_all(users)
+        db.commit()
+        return [auth.create_access_token({"sub": str(user.id)}) for user in users]
+
+
+def scope(path: str, token: str = None) -> dict:
+    headers = [(b"host", b"testserver")]
+    if token:
+        headers.append((b"authorization", f"Bearer {token}".encode()))
+    return {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+            "root_path": "", "headers": headers, "client": ("testclient", 50000), "server": ("testserver", 80)}
+
+
+class Connection:
+    """
+    Drives the app directly: the test client would wait for a streaming body to finish.
+    With `stall`, the client stops reading after the first chunk, like a slow download.
+    """
+
+    def __init__(self, path: str, token: str = None, stall: bool = False):
+        self.stall = stall
+        self.started = asyncio.Event()
+        self.status = None
+        self._disconnect = asyncio.Event()
+        self._body_sent = False
+        self.task = asyncio.create_task(main.app(scope(path, token), self._receive, self._send))
+
+    async def _receive(self):
+        if not self._body_sent:
+            self._body_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await self._disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    async def _send(self, message):
+        if message["type"] == "http.response.start":
+            self.status = message["status"]
+            self.started.set()
+        elif self.stall:
+            await self._disconnect.wait()
+
+    async def close(self):
+        self._disconnect.set()
+        await asyncio.wait_for(self.task, timeout=5)
+
+
+def test_open_streams_do_not_hold_read_connections(client, tokens):
+    # Each listener is a principal cache miss, so each one has to look its user up
+    cache.principal_cache.clear()
+
+    async def scenario():
+        streams = [Connection("/api/messages/stream", token) for token in tokens]
+        try:
+            await asyncio.wait_for(asyncio.gather(*(stream.started.wait() for stream in streams)), timeout=5)
+            assert {stream.status for stream in streams} == {200}
+
+            read = Connection("/api/vacancies/")
+            await asyncio.wait_for(read.task, timeout=5)
+            return read.status
+        finally:
+            await asyncio.gather(*(stream.close() for stream in streams))
+
+    assert client.portal.call(scenario) == 200
+
+
+def test_export_holds_one_read_connection(client):
+    with Session(models.engine) as db:
+        admin = models.User(fname="e", lname="e", email="exporter@example.com", password="-", role=Role.ADMIN)
+        db.add(admin)
+        db.commit()
+        token = auth.create_access_token({"sub": str(admin.id)})
+    cache.principal_cache.clear()
+
+    async def scenario():
+        export = Connection("/api/applications/export", token, stall=True)
+        try:
+            await asyncio.wait_for(export.started.wait(), timeout=5)
+            await asyncio.sleep(0.1)
+            # Only the export's own cursor may be checked out while the body streams
+            return models.read_engine.pool.checkedout()
+        finally:
+            await export.close()
+
+    assert client.portal.call(scenario) <= 1
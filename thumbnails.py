@@ -0,0 +1,219 @@
+import asyncio
+import logging
+import math
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from fastapi import HTTPException, status
+import crud
+import models
+import storage
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it media simply has no thumbnails
+    Image = ImageOps = None
+
+# Configuration
+THUMB_SIZES = (64, 128, 256)
+THUMB_FORMAT = "webp"
+THUMB_MEDIA_TYPE = "image/webp"
+THUMB_WORKERS = int(os.environ.get("THUMB_WORKERS", str(min(2, os.cpu_count() or 1))))
+THUMB_MAX_QUEUE = int(os.environ.get("THUMB_MAX_QUEUE", "256"))
+MAX_IMAGE_PIXELS = int(os.environ.get("MAX_IMAGE_PIXELS", str(50_000_000)))
+
+AVAILABLE = Image is not None
+
+logger = logging.getLogger("thumbnails")
+
+
+def is_image(content_type: Optional[str]) -> bool:
+    return AVAILABLE and bool(content_type) and content_type.startswith("image/")
+
+
+def thumb_path(sha256: str, size: int) -> str:
+    return storage.derived_path(sha256, f"{size}.{THUMB_FORMAT}")
+
+
+# ===== Placeholder =====
+# A BlurHash (https://blurha.sh) of the image: ~30 characters a client can decode into a blurred
+# preview and show in a card until the thumbnail arrives.
+
+_BASE83 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+
+
+def _base83(value: int, length: int) -> str:
+    return "".join(_BASE83[value // 83 ** (length - i - 1) % 83] for i in range(length))
+
+
+def _to_linear(value: int) -> float:
+    v = value / 255
+    return v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+
+
+def _to_srgb(value: float) -> int:
+    v = max(0.0, min(1.0, value))
+    return int(v * 12.92 * 255 + 0.5) if v <= 0.0031308 else int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def _sign_pow(value: float, exp: float) -> float:
+    return math.copysign(abs(value) ** exp, value)
+
+
+def blurhash(image, x_components: int = 4, y_components: int = 3) -> str:
+    """Encode a (small) RGB image; callers shrink it first, the cost is per pixel and component"""
+    width, height = image.size
+    pixels = [tuple(_to_linear(c) for c in pixel) for pixel in image.getdata()]
+    cos_x = [[math.cos(math.pi * i * x / width) for x in range(width)] for i in range(x_components)]
+    cos_y = [[math.cos(math.pi * j * y / height) for y in range(height)] for j in range(y_components)]
+
+    factors = []
+    for j in range(y_components):
+        for i in range(x_components):
+            scale = (1 if i == j == 0 else 2) / (width * height)
+            r = g = b = 0.0
+            for y in range(height):
+                row = y * width
+                for x in range(width):
+                    basis = cos_x[i][x] * cos_y[j][y]
+                    pr, pg, pb = pixels[row + x]
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    result = _base83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        quantised_max = max(0, min(82, int(max(abs(c) for f in ac for c in f) * 166 - 0.5)))
+        maximum = (quantised_max + 1) / 166
+        result += _base83(quantised_max, 1)
+    else:
+        maximum = 1.0
+        result += _base83(0, 1)
+    result += _base83((_to_srgb(dc[0]) << 16) + (_to_srgb(dc[1]) << 8) + _to_srgb(dc[2]), 4)
+    for factor in ac:
+        r, g, b = (max(0, min(18, int(_sign_pow(c / maximum, 0.5) * 9 + 9.5))) for c in factor)
+        result += _base83(r * 19 * 19 + g * 19 + b, 2)
+    return result
+
+
+# ===== Worker Functions (run inside the pool) =====
+
+def render(source: str, targets: List[Tuple[int, str]]) -> Optional[str]:
+    """Write each (size, path) thumbnail and return the placeholder; None if the file isn't a readable image"""
+    try:
+        with Image.open(source) as original:
+            # Opening only reads the header, so oversized images are refused before decoding
+            if original.width * original.height > MAX_IMAGE_PIXELS:
+                return None
+            largest = max(size for size, _ in targets)
+            # JPEG can decode at a reduced scale, which is most of the work for large photos
+            original.draft("RGB", (largest, largest))
+            image = ImageOps.exif_transpose(original)
+            has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+            image = image.convert("RGBA" if has_alpha else "RGB")
+    except (OSError, ValueError, SyntaxError, Image.DecompressionBombError):
+        return None
+
+    # Largest first, each size shrunk from the previous one
+    for size, path in sorted(targets, reverse=True):
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        if os.path.exists(path):
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        image.save(temp_path, format=THUMB_FORMAT, quality=80)
+        os.replace(temp_path, path)
+
+    image.thumbnail((32, 32), Image.Resampling.BILINEAR)
+    return blurhash(image.convert("RGB"))
+
+
+# ===== Pool =====
+
+class ThumbnailPool:
+    """Generates derivatives in worker processes. Jobs are keyed by content hash, so an upload's
+    background job and a request for a thumbnail that isn't there yet share one render."""
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.running = 0
+        self.generated = 0
+        self.failed = 0
+        self.dropped = 0
+        self._slots = asyncio.Semaphore(workers)
+        self._jobs: Dict[str, asyncio.Task] = {}
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _start(self, sha256: str) -> asyncio.Task:
+        job = self._jobs.get(sha256)
+        if job is None:
+            job = self._jobs[sha256] = asyncio.create_task(self._generate(sha256))
+            job.add_done_callback(lambda _: self._jobs.pop(sha256, None))
+        return job
+
+    async def _generate(self, sha256: str) -> Optional[str]:
+        async with self._slots:
+            self.running += 1
+            try:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                targets = [(size, thumb_path(sha256, size)) for size in THUMB_SIZES]
+                placeholder = await asyncio.get_running_loop().run_in_executor(
+                    self._executor, render, storage.blob_path(sha256), targets)
+            except Exception:
+                self.failed += 1
+                logger.exception("Thumbnail generation failed for %s", sha256)
+                return None
+            finally:
+                self.running -= 1
+
+        if placeholder is None:
+            return None
+        self.generated += 1
+        try:
+            async with models.AsyncSessionLocal() as db:
+                await crud.set_media_placeholder(db, sha256, placeholder)
+        except Exception:
+            logger.exception("Could not record the placeholder for %s", sha256)
+        # The blob may have been deleted while we rendered it
+        if not await asyncio.to_thread(os.path.exists, storage.blob_path(sha256)):
+            await storage.remove(sha256)
+        return placeholder
+
+    def schedule(self, sha256: str) -> None:
+        """Fire-and-forget generation after an upload; dropped when the pool is saturated,
+        the thumbnail endpoint then generates on first request"""
+        if sha256 not in self._jobs and len(self._jobs) >= self.max_queue:
+            self.dropped += 1
+            return
+        self._start(sha256)
+
+    async def ensure(self, sha256: str) -> Optional[str]:
+        """Wait for a blob's derivatives; returns the placeholder, None if it isn't a readable image"""
+        if sha256 not in self._jobs and len(self._jobs) >= self.max_queue:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Thumbnail generation is busy, retry shortly",
+                headers={"Retry-After": "1"},
+            )
+        # Shielded so a client disconnecting doesn't cancel a render others may be waiting on
+        return await asyncio.shield(self._start(sha256))
+
+    async def shutdown(self) -> None:
+        for job in list(self._jobs.values()):
+            job.cancel()
+        await asyncio.gather(*self._jobs.values(), return_exceptions=True)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {"workers": self.workers, "running": self.running, "queue_depth": len(self._jobs) - self.running,
+                "generated": self.generated, "failed": self.failed, "dropped": self.dropped}
+
+
+pool = ThumbnailPool(THUMB_WORKERS, THUMB_MAX_QUEUE)